@@ -0,0 +1,59 @@
+"""Compare downcast_matrix converting column by column and by dtype
+
+The frame mimics a matrix read back from CSV: mostly float64 features, plus
+0/1 flag columns (e.g. one-hot categoricals) that pandas parses as int64. The
+old conversion applied astype(float32) to each column as a Series; the new one
+(triage.util.pandas.downcast_matrix) converts the float columns as one block
+and keeps the flags as uint8. Both run with the default triage logging
+configuration, under which spam messages aren't logged: the old conversion
+computed the memory statistics of its spam messages all the same.
+
+Usage: python benchmarks/downcast_matrix.py [num_rows] [num_columns] [num_flag_columns]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from triage.util.pandas import downcast_matrix
+
+
+def apply_downcast(df):
+    """The conversion downcast_matrix did before, memory statistics included"""
+    df.memory_usage(deep=True).sum()
+    new_df = df.apply(lambda x: x.astype(np.float32))
+    new_df.memory_usage(deep=True).sum()
+    return new_df
+
+
+def make_frame(num_rows, num_columns, num_flag_columns):
+    rng = np.random.default_rng(0)
+    num_float_columns = num_columns - num_flag_columns
+    df = pd.DataFrame(
+        rng.random((num_rows, num_float_columns)),
+        columns=[f"feature_{i}" for i in range(num_float_columns)],
+    )
+    flags = pd.DataFrame(
+        rng.integers(0, 2, (num_rows, num_flag_columns)),
+        columns=[f"flag_{i}" for i in range(num_flag_columns)],
+    )
+    return pd.concat([df, flags], axis=1)
+
+
+def main(num_rows=20_000, num_columns=3_000, num_flag_columns=1_000):
+    print(f"{num_rows:,} rows x {num_columns:,} columns ({num_flag_columns:,} int64 flags)")
+    for name, frame in (
+        ("float64 and flags", make_frame(num_rows, num_columns, num_flag_columns)),
+        ("float64 only", make_frame(num_rows, num_columns, 0)),
+    ):
+        for downcast in (apply_downcast, downcast_matrix):
+            start = time.perf_counter()
+            downcasted = downcast(frame)
+            elapsed = time.perf_counter() - start
+            size_mb = downcasted.memory_usage().sum() / 2 ** 20
+            print(f"{name}, {downcast.__name__}: {elapsed:.2f}s, {size_mb:,.0f} MB")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
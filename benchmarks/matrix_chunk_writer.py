@@ -0,0 +1,84 @@
+"""Compare the peak memory of saving a matrix at once and in chunks
+
+Generates a synthetic matrix either whole, then saved with MatrixStore.save
+as MatrixBuilder.build_matrix does by default, or one chunk of entities at a
+time written with MatrixStore.chunk_writer as it does with
+matrix_chunk_entities. Each way runs in its own process so that its peak
+memory can be read from its resource usage.
+
+Usage: python benchmarks/matrix_chunk_writer.py [num_entities] [num_features] [chunk_entities]
+"""
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from triage.component.catwalk.storage import CSVMatrixStore, ProjectStorage
+
+AS_OF_DATES = pd.date_range("2016-01-01", periods=12, freq="MS")
+
+
+def make_chunk(first_entity, num_entities, num_features):
+    rng = np.random.default_rng(first_entity)
+    index = pd.MultiIndex.from_product(
+        [np.arange(first_entity, first_entity + num_entities), AS_OF_DATES],
+        names=["entity_id", "as_of_date"],
+    )
+    design_matrix = pd.DataFrame(
+        rng.random((len(index), num_features), dtype=np.float32).round(3),
+        index=index,
+        columns=[f"feature_{i}" for i in range(num_features)],
+    )
+    labels = pd.Series(rng.integers(0, 2, len(index)).astype("float32"), index=index, name="label")
+    return design_matrix, labels
+
+
+def save_at_once(matrix_store, num_entities, num_features, chunk_entities):
+    matrix_store.matrix_label_tuple = make_chunk(0, num_entities, num_features)
+    matrix_store.save()
+
+
+def save_in_chunks(matrix_store, num_entities, num_features, chunk_entities):
+    with matrix_store.chunk_writer() as write_chunk:
+        for first_entity in range(0, num_entities, chunk_entities):
+            write_chunk(*make_chunk(
+                first_entity, min(chunk_entities, num_entities - first_entity), num_features
+            ))
+
+
+SAVES = {"at_once": save_at_once, "in_chunks": save_in_chunks}
+
+
+def run_save(name, directory, num_entities, num_features, chunk_entities):
+    matrix_store = CSVMatrixStore(
+        ProjectStorage(directory), [], name, metadata={"label_name": "label"}
+    )
+    start = time.perf_counter()
+    SAVES[name](matrix_store, num_entities, num_features, chunk_entities)
+    elapsed = time.perf_counter() - start
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+    print(f"{name}: {elapsed:.1f}s, peak memory {max_rss_mb:,.0f} MB")
+
+
+def main(num_entities=5_000, num_features=100, chunk_entities=500):
+    print(f"{num_entities * len(AS_OF_DATES):,} rows x {num_features} features")
+    with tempfile.TemporaryDirectory() as directory:
+        for name in SAVES:
+            subprocess.run(
+                [
+                    sys.executable, "-c",
+                    "import sys, runpy; "
+                    "runpy.run_path(sys.argv[1])['run_save'](sys.argv[2], sys.argv[3], *map(int, sys.argv[4:]))",
+                    __file__, name, directory,
+                    str(num_entities), str(num_features), str(chunk_entities),
+                ],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
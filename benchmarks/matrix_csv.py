@@ -0,0 +1,91 @@
+"""Compare loading a feature query's COPY output through a StringIO and streaming it
+
+The COPY output is simulated by a CSV file on disk. The old path read all of it
+into a StringIO, parsed it to float64 and downcast it afterwards; the new path
+(triage.component.architect.builders.read_matrix_csv) parses it in chunks into
+preallocated float32 arrays. Each variant runs in its own process so that its
+peak memory can be read from the resource usage of the child.
+
+Usage: python benchmarks/matrix_csv.py [num_rows] [num_columns]
+"""
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def write_csv(path, num_rows, num_columns):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.random((num_rows, num_columns)).round(3),
+        columns=[f"feature_{i}" for i in range(num_columns)],
+    )
+    df.insert(0, "as_of_date", "2016-01-01")
+    df.insert(0, "entity_id", np.arange(num_rows))
+    df.to_csv(path, index=False)
+
+
+def stringio_path(path, num_rows):
+    """The parsing MatrixBuilder.query_to_df did before streaming"""
+    from triage.util.pandas import downcast_matrix
+
+    with open(path) as f:
+        out = io.StringIO(f.read())
+    df = pd.read_csv(out, parse_dates=["as_of_date"])
+    df.set_index(["entity_id", "as_of_date"], inplace=True)
+    return downcast_matrix(df)
+
+
+def streaming_path(path, num_rows):
+    """The parsing MatrixBuilder.query_to_df does now"""
+    from triage.component.architect.builders import read_matrix_csv
+
+    with open(path) as f:
+        return read_matrix_csv(f, num_rows=num_rows)
+
+
+VARIANTS = {"stringio": stringio_path, "streaming": streaming_path}
+
+
+def run_variant(name, path, num_rows):
+    start = time.perf_counter()
+    df = VARIANTS[name](path, num_rows)
+    elapsed = time.perf_counter() - start
+    assert df.shape[0] == num_rows
+    print(f"{elapsed:.2f}")
+
+
+def main(num_rows=200_000, num_columns=300):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "matrix.csv")
+        write_csv(path, num_rows, num_columns)
+        size_mb = os.path.getsize(path) / 2 ** 20
+        print(f"{num_rows:,} rows x {num_columns} columns, {size_mb:,.0f} MB of CSV")
+        for name in VARIANTS:
+            # ru_maxrss of the children is the largest of any child so far,
+            # so each variant gets its own fresh process tree
+            output = subprocess.run(
+                [
+                    sys.executable, "-c",
+                    "import sys; sys.argv = sys.argv[1:];"
+                    "import resource, runpy;"
+                    "module = runpy.run_path(sys.argv[0]);"
+                    "module['run_variant'](sys.argv[1], sys.argv[2], int(sys.argv[3]));"
+                    "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)",
+                    __file__, name, path, str(num_rows),
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.split()
+            elapsed, max_rss_kb = float(output[0]), int(output[1])
+            print(f"{name}: {elapsed:.2f}s, peak memory {max_rss_kb / 2 ** 10:,.0f} MB")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
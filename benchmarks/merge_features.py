@@ -0,0 +1,66 @@
+"""Compare merging feature dataframes with an index join and by position
+
+Builds one label dataframe and a number of float32 feature dataframes sharing
+the same (entity_id, as_of_date) index, as MatrixBuilder.load_features_data
+returns them, and merges them both ways, reporting the time and the peak
+memory allocated during the merge.
+
+Usage: python benchmarks/merge_features.py [num_rows] [num_tables] [columns_per_table]
+"""
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from triage.component.architect.builders import MatrixBuilder
+
+
+def join_merge(builder, dataframes):
+    """The merge MatrixBuilder.merge_feature_csvs always did before"""
+    for df in dataframes[1:]:
+        if any(df[column].isnull().values.any() for column in df.columns):
+            raise ValueError("nulls")
+    return dataframes[1].join(dataframes[2:] + [dataframes[0]])
+
+
+def positional_merge(builder, dataframes):
+    """The merge MatrixBuilder.merge_feature_csvs does now for aligned dataframes"""
+    return builder.merge_feature_csvs(dataframes, matrix_uuid="benchmark")
+
+
+def main(num_rows=500_000, num_tables=40, columns_per_table=25):
+    rng = np.random.default_rng(0)
+    index = pd.MultiIndex.from_arrays(
+        [
+            np.repeat(np.arange(num_rows // 10), 10),
+            np.tile(pd.date_range("2016-01-01", periods=10, freq="MS").values, num_rows // 10),
+        ],
+        names=["entity_id", "as_of_date"],
+    )
+    dataframes = [pd.DataFrame({"outcome": rng.integers(0, 2, len(index)).astype("float32")}, index=index)]
+    for table in range(num_tables):
+        dataframes.append(
+            pd.DataFrame(
+                rng.random((len(index), columns_per_table), dtype=np.float32),
+                index=index,
+                columns=[f"t{table}_f{column}" for column in range(columns_per_table)],
+            )
+        )
+    builder = MatrixBuilder(db_config={}, matrix_storage_engine=None, engine=None, experiment_hash=None)
+    print(f"{len(index):,} rows x {num_tables * columns_per_table} features")
+
+    for name, merge in [("index join", join_merge), ("positional", positional_merge)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        merged = merge(builder, dataframes)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name}: {elapsed:.2f}s, peak allocations {peak / 2 ** 20:,.0f} MB")
+        del merged
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,54 @@
+"""Compare sort_predictions_and_labels against the previous DataFrame-based sort
+
+Usage: python benchmarks/sort_predictions.py [num_predictions]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from triage.component.catwalk.utils import sort_predictions_and_labels
+
+
+def dataframe_sort(predictions_proba, labels, tiebreaker, sort_seed=None):
+    """The sort as it was implemented before moving to numpy"""
+    df = pd.DataFrame(predictions_proba, columns=["score"])
+    df["label_value"] = labels
+    if tiebreaker == "random":
+        np.random.seed(sort_seed)
+        df["random"] = np.random.rand(len(df))
+        df.sort_values(by=["score", "random"], inplace=True, ascending=[False, False])
+    elif tiebreaker == "worst":
+        df.sort_values(by=["score", "label_value"], inplace=True, ascending=[False, True], na_position="first")
+    else:
+        df.sort_values(by=["score", "label_value"], inplace=True, ascending=[False, False], na_position="last")
+    return df["score"].to_numpy(), df["label_value"].to_numpy()
+
+
+def evaluation_sorts(sort_function, predictions_proba, labels, trials):
+    """The sequence of sorts ModelEvaluator.evaluate runs for one model"""
+    worst = sort_function(predictions_proba, labels, "worst")
+    sort_function(*worst, "best")
+    for seed in range(1, trials + 1):
+        sort_function(*worst, "random", seed)
+
+
+def main(num_predictions=10_000_000, trials=5):
+    rng = np.random.default_rng(0)
+    # rounded scores, so there are plenty of ties to break
+    predictions_proba = np.round(rng.random(num_predictions), 3)
+    labels = rng.choice([0.0, 1.0, np.nan], num_predictions, p=[0.6, 0.1, 0.3])
+
+    for name, sort_function in [
+        ("dataframe sort", dataframe_sort),
+        ("numpy sort", sort_predictions_and_labels),
+    ]:
+        start = time.perf_counter()
+        evaluation_sorts(sort_function, predictions_proba, labels, trials)
+        print(f"{name}: {time.perf_counter() - start:.2f}s for {num_predictions} predictions, "
+              f"worst + best + {trials} random sorts")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
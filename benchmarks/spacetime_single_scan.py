@@ -0,0 +1,103 @@
+"""Compare the per_date and single_scan SpacetimeAggregation query strategies
+
+Fills an events table with random events and a cohort table with every entity
+at each as-of-date, then builds the pre-imputation group table of the same
+aggregation with both query strategies, with and without rollup_intervals,
+running the inserts the way FeatureGenerator does, and reports the time spent
+in the inserts.
+
+Needs a PostgreSQL database it can create tables in.
+
+Usage: python benchmarks/spacetime_single_scan.py db_url [num_entities] [num_dates] [events_per_entity]
+"""
+import itertools
+import sys
+import time
+
+import sqlalchemy
+
+from triage.component.collate import Aggregate, SpacetimeAggregation
+
+
+def aggregation(dates, query_strategy, rollup_intervals):
+    return SpacetimeAggregation(
+        aggregates=[
+            Aggregate("amount", ["sum", "avg", "max"], {"all": {"type": "zero"}}),
+            Aggregate("flag::int", ["sum", "avg"], {"all": {"type": "zero"}}),
+        ],
+        from_obj="benchmark_events",
+        groups=["entity_id"],
+        intervals=["1month", "6month", "1year", "all"],
+        dates=dates,
+        state_table="benchmark_cohort",
+        state_group="entity_id",
+        date_column="event_date",
+        output_date_column="as_of_date",
+        prefix=f"benchmark_{query_strategy}",
+        join_with_cohort_table=True,
+        query_strategy=query_strategy,
+        rollup_intervals=rollup_intervals,
+    )
+
+
+def run_inserts(db_engine, aggregation):
+    with db_engine.begin() as conn:
+        for group in aggregation.groups:
+            conn.execute(aggregation.get_drops()[group])
+            conn.execute(aggregation.get_creates()[group])
+    start = time.perf_counter()
+    for inserts in aggregation.get_inserts().values():
+        for insert in inserts:
+            with db_engine.begin() as conn:
+                conn.execute(insert)
+    return time.perf_counter() - start
+
+
+def main(db_url, num_entities=20_000, num_dates=24, events_per_entity=50):
+    db_engine = sqlalchemy.create_engine(db_url)
+    dates = [f"{2014 + month // 12}-{month % 12 + 1:02d}-01" for month in range(num_dates)]
+    with db_engine.begin() as conn:
+        conn.execute("drop table if exists benchmark_events")
+        conn.execute(
+            "create table benchmark_events as "
+            "select entity_id, '2013-01-01'::date + (random() * %s)::int as event_date, "
+            "random() * 100 as amount, random() < 0.2 as flag "
+            "from generate_series(1, %s) entity_id, generate_series(1, %s)",
+            (365 * (num_dates // 12 + 2), num_entities, events_per_entity),
+        )
+        conn.execute("create index on benchmark_events (entity_id, event_date)")
+        conn.execute("drop table if exists benchmark_cohort")
+        conn.execute(
+            "create table benchmark_cohort as "
+            "select entity_id, as_of_date::date from generate_series(1, %s) entity_id, "
+            "unnest(%s::date[]) as_of_date",
+            (num_entities, dates),
+        )
+        conn.execute("create index on benchmark_cohort (entity_id, as_of_date)")
+        conn.execute("analyze benchmark_events")
+        conn.execute("analyze benchmark_cohort")
+
+    timings = {}
+    for query_strategy, rollup_intervals in itertools.product(
+        ("per_date", "single_scan"), (False, True)
+    ):
+        agg = aggregation(dates, query_strategy, rollup_intervals)
+        name = query_strategy + (" rollup" if rollup_intervals else "")
+        timings[name] = run_inserts(db_engine, agg)
+        rows = db_engine.execute(
+            f"select count(*) from {agg.get_table_name('entity_id')}"
+        ).scalar()
+        print(
+            f"{name:<20} {len(agg.get_inserts()['entity_id']):>4} inserts "
+            f"{timings[name]:8.2f}s {rows} rows"
+        )
+        db_engine.execute(agg.get_drops()["entity_id"])
+    for name, timing in timings.items():
+        print(f"{name:<20} speedup over per_date: {timings['per_date'] / timing:.2f}x")
+
+    db_engine.execute("drop table benchmark_events")
+    db_engine.execute("drop table benchmark_cohort")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *(int(arg) for arg in sys.argv[2:]))
@@ -0,0 +1,89 @@
+"""Compare serializing predictions for COPY through ORM objects and straight from the DataFrame
+
+Measures the client-side cost of producing the COPY stream, which is what
+Predictor._write_predictions_to_db spends its time on; the rows sent to the
+database are the same either way.
+
+Usage: python benchmarks/write_predictions.py [num_predictions]
+"""
+import io
+import math
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+from triage.component.catwalk.utils import _write_csv, _write_dataframe_csv
+from triage.component.results_schema import TestPrediction
+
+
+class NullTextIO(io.TextIOBase):
+    def write(self, text):
+        return len(text)
+
+
+def orm_stream(df, model_id, matrix_uuid, test_label_timespan):
+    """The serialization as it was done before streaming the DataFrame"""
+    record_stream = (
+        TestPrediction(
+            model_id=int(model_id),
+            entity_id=int(row.entity_id),
+            as_of_date=row.as_of_date,
+            score=float(row.score),
+            label_value=int(row.label_value) if not math.isnan(row.label_value) else None,
+            rank_abs_no_ties=int(row.rank_abs_no_ties),
+            rank_abs_with_ties=int(row.rank_abs_with_ties),
+            rank_pct_no_ties=row.rank_pct_no_ties,
+            rank_pct_with_ties=row.rank_pct_with_ties,
+            matrix_uuid=matrix_uuid,
+            test_label_timespan=test_label_timespan,
+        ) for row in df.itertuples()
+    )
+    attribute_keys = [
+        column_attr.key for column_attr in sqlalchemy.inspect(TestPrediction).column_attrs
+    ]
+    _write_csv(NullTextIO(), record_stream, TestPrediction, attribute_keys)
+
+
+def dataframe_stream(df, model_id, matrix_uuid, test_label_timespan):
+    """The serialization Predictor._write_predictions_to_db does now"""
+    predictions = pd.DataFrame({
+        "model_id": int(model_id),
+        "entity_id": df["entity_id"].astype("int64"),
+        "as_of_date": df["as_of_date"],
+        "score": df["score"],
+        "label_value": df["label_value"].astype("Int64"),
+        "rank_abs_no_ties": df["rank_abs_no_ties"].astype("int64"),
+        "rank_abs_with_ties": df["rank_abs_with_ties"].astype("int64"),
+        "rank_pct_no_ties": df["rank_pct_no_ties"],
+        "rank_pct_with_ties": df["rank_pct_with_ties"],
+        "matrix_uuid": matrix_uuid,
+        "test_label_timespan": test_label_timespan,
+    })
+    _write_dataframe_csv(NullTextIO(), predictions, chunksize=100000)
+
+
+def main(num_predictions=2_000_000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "entity_id": np.arange(num_predictions),
+        "as_of_date": pd.Timestamp("2016-01-01"),
+        "score": rng.random(num_predictions),
+        "label_value": rng.choice([0.0, 1.0, np.nan], num_predictions),
+    })
+    df["rank_abs_no_ties"] = df["score"].rank(ascending=False, method="first")
+    df["rank_abs_with_ties"] = df["score"].rank(ascending=False, method="min")
+    df["rank_pct_no_ties"] = df["rank_abs_no_ties"].rank(method="dense", pct=True)
+    df["rank_pct_with_ties"] = df["score"].rank(ascending=False, method="dense", pct=True)
+
+    for name, stream in [("orm objects", orm_stream), ("dataframe chunks", dataframe_stream)]:
+        start = time.perf_counter()
+        stream(df, 1, "abcd", "1 month")
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {num_predictions / elapsed:,.0f} rows/sec ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
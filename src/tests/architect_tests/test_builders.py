@@ -1,4 +1,8 @@
 import datetime
+import io
+import os
+import threading
+import time
 from unittest import TestCase
 
 import pandas as pd
@@ -9,10 +13,12 @@ from contextlib import contextmanager
 
 from triage.component.catwalk.utils import filename_friendly_hash
 from triage.component.architect.feature_group_creator import FeatureGroup
-from triage.component.architect.builders import MatrixBuilder
+from triage.component.architect.builders import MatrixBuilder, read_matrix_csv
+from triage.component.architect.feature_blocks import FeatureBlockCache
 from triage.component.catwalk.db import ensure_db
 from triage.component.catwalk.storage import ProjectStorage
 from triage.component.results_schema.schema import Matrix
+from triage.database_reflection import table_exists
 
 from .utils import (
     create_schemas,
@@ -335,6 +341,74 @@ def test_make_entity_date_table():
             assert test.all().all()
 
 
+def test_entity_date_table_reuse():
+    dates = [
+        datetime.datetime(2016, 1, 1, 0, 0),
+        datetime.datetime(2016, 2, 1, 0, 0),
+    ]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_schemas(
+            engine=engine, features_tables=features_tables, labels=labels, states=states
+        )
+
+        with get_matrix_storage_engine() as matrix_storage_engine:
+            builder = MatrixBuilder(
+                db_config=db_config,
+                matrix_storage_engine=matrix_storage_engine,
+                experiment_hash="an_experiment_hash",
+                engine=engine,
+            )
+            table_names = [
+                builder.make_entity_date_table(
+                    as_of_times=as_of_times,
+                    label_type="binary",
+                    label_name="booking",
+                    state="active",
+                    matrix_uuid=matrix_uuid,
+                    matrix_type="train",
+                    label_timespan="1 month",
+                )
+                for matrix_uuid, as_of_times in [
+                    ("first_uuid", dates),
+                    ("second_uuid", dates),
+                    ("third_uuid", dates[:1]),
+                ]
+            ]
+            # matrices with the same entity-date query share their table
+            assert table_names[0] == table_names[1]
+            assert table_names[0] != table_names[2]
+            assert [
+                row[0] for row in engine.execute(
+                    f"select count(*) from pg_indexes where tablename = '{table_names[0]}'"
+                )
+            ] == [1]
+
+            # another run of the same experiment keeps its own tables
+            other_builder = MatrixBuilder(
+                db_config=db_config,
+                matrix_storage_engine=matrix_storage_engine,
+                experiment_hash="an_experiment_hash",
+                engine=engine,
+                run_id=2,
+            )
+            other_table_name = other_builder.make_entity_date_table(
+                as_of_times=dates,
+                label_type="binary",
+                label_name="booking",
+                state="active",
+                matrix_uuid="first_uuid",
+                matrix_type="train",
+                label_timespan="1 month",
+            )
+            assert other_table_name not in table_names
+
+            builder.drop_entity_date_tables()
+            for table_name in table_names:
+                assert not table_exists(f"features.{table_name}", engine)
+            assert table_exists(f"features.{other_table_name}", engine)
+
+
 def test_make_entity_date_table_include_missing_labels():
     """ Test that the make_entity_date_table function contains the correct
     values.
@@ -644,6 +718,49 @@ class TestMergeFeatureCSVs(TestCase):
             with self.assertRaises(ValueError):
                 builder.merge_feature_csvs(dataframes, matrix_uuid="1234")
 
+    def _dataframes(self, feature_values):
+        index = pd.MultiIndex.from_tuples(
+            [(1, pd.Timestamp("2016-01-01")), (1, pd.Timestamp("2016-02-01")), (2, pd.Timestamp("2016-01-01"))],
+            names=["entity_id", "as_of_date"],
+        )
+        labels_df = pd.DataFrame({"booking": [0.0, None, 1.0]}, index=index, dtype="float32")
+        return [labels_df] + [
+            pd.DataFrame(values, index=index, dtype="float32") for values in feature_values
+        ]
+
+    def test_merge_by_position(self):
+        builder = MatrixBuilder(
+            db_config=db_config,
+            matrix_storage_engine=None,
+            experiment_hash=experiment_hash,
+            engine=None,
+        )
+        dataframes = self._dataframes(
+            [{"f1": [1, 2, 3], "f2": [4, 5, 6]}, {"f3": [7, 8, 9]}]
+        )
+        merged = builder.merge_feature_csvs(dataframes, matrix_uuid="1234")
+        expected = dataframes[1].join(dataframes[2:] + [dataframes[0]])
+        pd.testing.assert_frame_equal(merged, expected)
+
+        # rows in another order are joined on the index instead
+        dataframes[2] = dataframes[2].iloc[::-1]
+        merged = builder.merge_feature_csvs(dataframes, matrix_uuid="1234")
+        pd.testing.assert_frame_equal(merged, expected)
+
+    def test_merge_nulls(self):
+        builder = MatrixBuilder(
+            db_config=db_config,
+            matrix_storage_engine=None,
+            experiment_hash=experiment_hash,
+            engine=None,
+        )
+        dataframes = self._dataframes([{"f1": [1, 2, 3]}, {"f2": [4, None, 6]}])
+        with self.assertRaises(ValueError):
+            builder.merge_feature_csvs(dataframes, matrix_uuid="1234")
+        dataframes[2] = dataframes[2].iloc[::-1]
+        with self.assertRaises(ValueError):
+            builder.merge_feature_csvs(dataframes, matrix_uuid="1234")
+
 
 class TestBuildMatrix(TestCase):
     @property
@@ -706,6 +823,153 @@ class TestBuildMatrix(TestCase):
                 )
                 assert len(matrix_storage_engine.get_store(uuid).design_matrix) == 5
                 assert builder.sessionmaker().query(Matrix).get(uuid).feature_dictionary ==self.good_feature_dictionary
+                stored_metadata = matrix_storage_engine.get_store(uuid).metadata
+                assert stored_metadata["num_observations"] == 5
+                assert stored_metadata["columns"] == matrix_storage_engine.get_store(uuid).design_matrix.columns.tolist()
+
+    def test_train_matrix_in_chunks(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                matrix_stores = {}
+                for matrix_chunk_entities in (None, 1):
+                    builder = MatrixBuilder(
+                        db_config=db_config,
+                        matrix_storage_engine=matrix_storage_engine,
+                        experiment_hash=experiment_hash,
+                        engine=engine,
+                        matrix_chunk_entities=matrix_chunk_entities,
+                    )
+                    uuid = f"chunks_{matrix_chunk_entities}"
+                    builder.build_matrix(
+                        as_of_times=self.good_dates,
+                        label_name="booking",
+                        label_type="binary",
+                        feature_dictionary=self.good_feature_dictionary,
+                        matrix_metadata=self.good_metadata,
+                        matrix_uuid=uuid,
+                        matrix_type="train",
+                    )
+                    matrix_stores[matrix_chunk_entities] = matrix_storage_engine.get_store(uuid)
+
+                chunked, built_at_once = matrix_stores[1], matrix_stores[None]
+                pd.testing.assert_frame_equal(chunked.design_matrix, built_at_once.design_matrix)
+                pd.testing.assert_series_equal(chunked.labels, built_at_once.labels)
+                assert chunked.metadata == built_at_once.metadata
+
+    def test_extend_train_matrix(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                    extend_matrices=True,
+                )
+                built_as_of_times = []
+                make_entity_date_table = builder.make_entity_date_table
+
+                def recording_make_entity_date_table(as_of_times, *args):
+                    built_as_of_times.append(as_of_times)
+                    return make_entity_date_table(as_of_times, *args)
+
+                builder.make_entity_date_table = recording_make_entity_date_table
+                uuids = []
+                for as_of_times in [self.good_dates[:2], self.good_dates]:
+                    metadata = dict(
+                        self.good_metadata,
+                        as_of_times=as_of_times,
+                        end_time=as_of_times[-1],
+                    )
+                    uuids.append(filename_friendly_hash(metadata))
+                    builder.build_matrix(
+                        as_of_times=as_of_times,
+                        label_name="booking",
+                        label_type="binary",
+                        feature_dictionary=self.good_feature_dictionary,
+                        matrix_metadata=metadata,
+                        matrix_uuid=uuids[-1],
+                        matrix_type="train",
+                    )
+                builder.extend_matrices = False
+                full_uuid = "built_at_once"
+                builder.build_matrix(
+                    as_of_times=self.good_dates,
+                    label_name="booking",
+                    label_type="binary",
+                    feature_dictionary=self.good_feature_dictionary,
+                    matrix_metadata=dict(self.good_metadata, as_of_times=self.good_dates),
+                    matrix_uuid=full_uuid,
+                    matrix_type="train",
+                )
+
+                # the extension only extracted the last as-of-date
+                assert built_as_of_times[1] == self.good_dates[2:]
+                extended = matrix_storage_engine.get_store(uuids[1])
+                built_at_once = matrix_storage_engine.get_store(full_uuid)
+                pd.testing.assert_frame_equal(
+                    extended.design_matrix, built_at_once.design_matrix
+                )
+                pd.testing.assert_series_equal(extended.labels, built_at_once.labels)
+
+    def test_reuse_matrix_with_same_content(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                    replace=False,
+                )
+                uuids = []
+                # metadata that doesn't change the content of the matrix
+                for user_metadata in ({"experiment": "one"}, {"experiment": "two"}):
+                    metadata = dict(self.good_metadata, **user_metadata)
+                    uuids.append(filename_friendly_hash(metadata))
+                    builder.build_matrix(
+                        as_of_times=self.good_dates,
+                        label_name="booking",
+                        label_type="binary",
+                        feature_dictionary=self.good_feature_dictionary,
+                        matrix_metadata=metadata,
+                        matrix_uuid=uuids[-1],
+                        matrix_type="train",
+                    )
+
+                built, reused = (matrix_storage_engine.get_store(uuid) for uuid in uuids)
+                assert os.path.samefile(built.matrix_base_store.path, reused.matrix_base_store.path)
+                assert reused.metadata["experiment"] == "two"
+                assert reused.metadata["content_hash"] == built.metadata["content_hash"]
+                pd.testing.assert_frame_equal(reused.design_matrix, built.design_matrix)
+                assert builder.sessionmaker().query(Matrix).get(uuids[1])
 
     def test_test_matrix(self):
         with testing.postgresql.Postgresql() as postgresql:
@@ -915,3 +1179,199 @@ class TestBuildMatrix(TestCase):
                 builder.build_matrix(**build_args)
                 assert len(matrix_storage_engine.get_store(uuid).design_matrix) == 5
                 assert builder.sessionmaker().query(Matrix).get(uuid)
+
+
+def test_read_matrix_csv():
+    csv = (
+        "entity_id,as_of_date,f1,f2\n"
+        "0,2016-01-01,1,0.5\n"
+        "1,2016-01-01,,2\n"
+        "0,2016-02-01,3,4.25\n"
+    )
+    for num_rows in (None, 3, 5):
+        df = read_matrix_csv(io.StringIO(csv), num_rows=num_rows, chunksize=2)
+        assert df.index.names == ["entity_id", "as_of_date"]
+        assert list(df.index) == [
+            (0, pd.Timestamp("2016-01-01")),
+            (1, pd.Timestamp("2016-01-01")),
+            (0, pd.Timestamp("2016-02-01")),
+        ]
+        assert list(df.columns) == ["f1", "f2"]
+        assert (df.dtypes == "float32").all()
+        assert df["f2"].tolist() == [0.5, 2.0, 4.25]
+        assert pd.isnull(df.loc[(1, pd.Timestamp("2016-01-01")), "f1"])
+
+    with TestCase().assertRaises(ValueError):
+        read_matrix_csv(io.StringIO(csv), num_rows=2, chunksize=2)
+
+
+def test_load_features_data_concurrently():
+    feature_dictionary = {
+        f"features{i}": [f"f{i}_{j}" for j in range(i + 1)] for i in range(6)
+    }
+
+    def load_tables(**builder_kwargs):
+        builder = MatrixBuilder(
+            db_config=db_config,
+            matrix_storage_engine=None,
+            experiment_hash=experiment_hash,
+            engine=None,
+            **builder_kwargs
+        )
+        running = []
+        most_running = [0]
+        lock = threading.Lock()
+
+        def query_to_df(query_string, num_rows=None):
+            table_name = next(name for name in feature_dictionary if f"{name} r" in query_string)
+            with lock:
+                running.append(table_name)
+                most_running[0] = max(most_running[0], len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(table_name)
+            return table_name
+
+        builder.query_to_df = query_to_df
+        return (
+            builder.load_features_data(
+                as_of_times=[],
+                feature_dictionary=feature_dictionary,
+                entity_date_table_name="entity_dates",
+                matrix_uuid="my_uuid",
+                num_rows=2 ** 14,
+            ),
+            most_running[0],
+        )
+
+    # results come back in the order of the feature dictionary either way
+    assert load_tables() == (list(feature_dictionary), 1)
+    assert load_tables(n_feature_workers=3) == (list(feature_dictionary), 3)
+    # each table takes 2 ** 14 * (4 * num_features + 16) bytes, 320KB to 640KB,
+    # so with 1MB no more than two tables fit at once
+    tables, most_running = load_tables(n_feature_workers=3, feature_memory_budget=1)
+    assert tables == list(feature_dictionary)
+    assert most_running == 2
+
+    with TestCase().assertRaises(ValueError):
+        MatrixBuilder(
+            db_config=db_config,
+            matrix_storage_engine=None,
+            experiment_hash=experiment_hash,
+            engine=None,
+            n_feature_workers=0,
+        )
+
+
+def test_load_features_data_from_feature_blocks():
+    dates = [datetime.datetime(2016, 1, 1, 0, 0), datetime.datetime(2016, 2, 1, 0, 0)]
+    features = pd.DataFrame(
+        {
+            "entity_id": [0, 1, 0, 1, 2],
+            "as_of_date": [dates[0], dates[0], dates[1], dates[1], dates[1]],
+            "f1": [1.0, 2.0, 3.0, 4.0, 5.0],
+            "f2": [6.0, 7.0, 8.0, 9.0, 10.0],
+        },
+    ).astype({"f1": "float32", "f2": "float32"}).set_index(["entity_id", "as_of_date"])
+
+    with TemporaryDirectory() as temp_dir:
+        builder = MatrixBuilder(
+            db_config=db_config,
+            matrix_storage_engine=None,
+            experiment_hash=experiment_hash,
+            engine=None,
+            feature_block_cache=FeatureBlockCache(
+                temp_dir, {"features0": {"columns": ["f1", "f2"], "as_of_dates": [dates[1]]}}
+            ),
+        )
+        extracted = []
+
+        def extract_feature_block(feature_table_name, feature_names, as_of_time):
+            extracted.append((as_of_time, feature_names))
+            return features.xs(as_of_time, level="as_of_date", drop_level=False)[feature_names]
+
+        builder._extract_feature_block = extract_feature_block
+
+        def load(entity_dates, feature_names):
+            # the only query left is the one for the matrix's entity-dates
+            builder.query_to_df = lambda query_string, num_rows=None: pd.DataFrame(
+                index=pd.MultiIndex.from_tuples(entity_dates, names=["entity_id", "as_of_date"])
+            )
+            return builder.load_features_data(
+                as_of_times=sorted(set(date for _, date in entity_dates)),
+                feature_dictionary={"features0": feature_names},
+                entity_date_table_name="entity_dates",
+                matrix_uuid="my_uuid",
+            )[0]
+
+        train = load([(0, dates[0]), (0, dates[1]), (1, dates[1]), (3, dates[1])], ["f1", "f2"])
+        assert train["f1"].tolist()[:3] == [1.0, 3.0, 4.0]
+        assert train["f2"].tolist()[:3] == [6.0, 8.0, 9.0]
+        # an entity-date missing from the feature table is null, as in an outer join
+        assert train.iloc[3].isnull().all()
+        assert (train.dtypes == "float32").all()
+
+        test = load([(1, dates[1]), (2, dates[1])], ["f2"])
+        assert test.index.tolist() == [(1, dates[1]), (2, dates[1])]
+        assert test["f2"].tolist() == [9.0, 10.0]
+
+        # the block shared by both matrices was only extracted once, with all of
+        # its columns; the other one just for the matrix needing it
+        assert extracted == [(dates[0], ["f1", "f2"]), (dates[1], ["f1", "f2"])]
+
+
+def test_entity_id_range_condition():
+    assert MatrixBuilder._entity_id_range_condition("ed", None) == ""
+    assert MatrixBuilder._entity_id_range_condition("ed", (None, None)) == ""
+    assert MatrixBuilder._entity_id_range_condition("ed", (5, None)) == "ed.entity_id >= 5"
+    assert (
+        MatrixBuilder._entity_id_range_condition_clause((5, 10))
+        == "AND r.entity_id >= 5 AND r.entity_id < 10"
+    )
+
+
+def test_matrix_content_hash():
+    builder = MatrixBuilder(
+        db_config=db_config,
+        matrix_storage_engine=None,
+        experiment_hash=experiment_hash,
+        engine=None,
+    )
+    as_of_times = [datetime.datetime(2016, 1, 1), datetime.datetime(2016, 2, 1)]
+    feature_dictionary = {"features0": ["f1", "f2"], "features1": ["f3", "f4"]}
+    metadata = matrix_metadata_creator(matrix_type="train")
+    content_hash = builder.matrix_content_hash(
+        as_of_times, feature_dictionary, metadata, "train"
+    )
+
+    # metadata that doesn't determine the content is left out
+    assert content_hash == builder.matrix_content_hash(
+        as_of_times,
+        feature_dictionary,
+        dict(metadata, matrix_id="another id", feature_groups=["another group"]),
+        "train",
+    )
+    assert content_hash != builder.matrix_content_hash(
+        as_of_times[:1], feature_dictionary, metadata, "train"
+    )
+    assert content_hash != builder.matrix_content_hash(
+        as_of_times, {"features0": ["f2", "f1"]}, metadata, "train"
+    )
+    assert content_hash != builder.matrix_content_hash(
+        as_of_times, feature_dictionary, dict(metadata, label_timespan="2 months"), "train"
+    )
+    assert content_hash != builder.matrix_content_hash(
+        as_of_times,
+        feature_dictionary,
+        dict(metadata, feature_start_time=datetime.datetime(2000, 1, 1)),
+        "train",
+    )
+
+    # a feature table rebuilt from another feature aggregation config
+    builder.feature_table_hashes["features0"] = "abc"
+    with_hash = builder.matrix_content_hash(as_of_times, feature_dictionary, metadata, "train")
+    assert with_hash != content_hash
+    builder.feature_table_hashes["features0"] = "def"
+    assert with_hash != builder.matrix_content_hash(
+        as_of_times, feature_dictionary, metadata, "train"
+    )
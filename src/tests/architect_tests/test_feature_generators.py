@@ -194,7 +194,9 @@ def test_feature_generation(test_engine):
         state_table="states",
     )
 
-    for output_table in output_tables:
+    # the tables are read through the views under their legacy names
+    assert len(output_tables) == len(expected_output)
+    for output_table in expected_output:
         records = pd.read_sql(
             "select * from {}.{} order by entity_id, as_of_date".format(
                 features_schema_name,
@@ -306,7 +308,8 @@ def test_feature_generation_feature_start_time(test_engine):
         state_table="states",
     )
 
-    for output_table in output_tables:
+    assert len(output_tables) == len(expected_output)
+    for output_table in expected_output:
         records = pd.read_sql(
             "select * from {}.{} order by as_of_date, entity_id".format(
                 features_schema_name,
@@ -392,7 +395,8 @@ def test_dynamic_categoricals(test_engine):
         state_table="states",
     )
 
-    for output_table in output_tables:
+    assert len(output_tables) == len(expected_output)
+    for output_table in expected_output:
         records = pd.read_sql(
             "select * from {}.{} order by as_of_date, entity_id".format(
                 features_schema_name, output_table
@@ -510,7 +514,8 @@ def test_array_categoricals(db_engine):
         state_table="states",
     )
 
-    for output_table in output_tables:
+    assert len(output_tables) == len(expected_output)
+    for output_table in expected_output:
         records = pd.read_sql(
             "select * from {}.{} order by as_of_date, entity_id".format(
                 features_schema_name, output_table
@@ -659,18 +664,24 @@ def test_replace(test_engine):
     ]
 
     features_schema_name = "features"
-    feature_tables = FeatureGenerator(
+    feature_generator = FeatureGenerator(
         db_engine=test_engine,
         features_schema_name=features_schema_name,
         replace=False,
-    ).create_all_tables(
+    )
+    feature_tables = feature_generator.create_all_tables(
         feature_dates=["2013-09-30", "2014-09-30", "2015-01-01"],
         feature_aggregation_config=aggregate_config,
         state_table="states",
     )
 
-    assert len(feature_tables) == 1
-    assert list(feature_tables)[0] == "aprefix_aggregation_imputed"
+    # the tables are named after the content hash of the aggregation, and the
+    # imputed one can still be read under its legacy name
+    content_hash = feature_generator._aggregation_hash(aggregate_config[0], "states")
+    suffix = content_hash[:12]
+    assert list(feature_tables) == [f"aprefix_{suffix}_imputed"]
+    assert feature_generator._table_hash(f"aprefix_{suffix}_imputed") == content_hash
+    assert feature_generator._relation_kind("aprefix_aggregation_imputed") == "v"
 
     # now try and run feature generation with replace=False. We should
     # be able to see that the entire cohort is there and reuse the features
@@ -684,36 +695,164 @@ def test_replace(test_engine):
         feature_aggregation_config=aggregate_config,
         state_table="states",
     )
+    feature_generator.prepare_imputed_tables(aggregations)
     table_tasks = feature_generator.generate_all_table_tasks(
         aggregations,
         task_type="aggregation",
     )
 
-    assert len(table_tasks["aprefix_entity_id"]) == 0
-    assert len(table_tasks["aprefix_aggregation"]) == 0
+    assert len(table_tasks[f"aprefix_entity_id_{suffix}"]) == 0
+    assert len(table_tasks[f"aprefix_{suffix}"]) == 0
 
     imp_tasks = feature_generator.generate_all_table_tasks(
         aggregations,
         task_type="imputation",
     )
 
-    assert len(imp_tasks["aprefix_aggregation_imputed"]) == 0
+    assert len(imp_tasks[f"aprefix_{suffix}_imputed"]) == 0
 
-    # add a new member of the cohort. now we should need to rebuild everything
+    # group and aggregation tables kept from an earlier build
+    for table in (f"aprefix_entity_id_{suffix}", f"aprefix_{suffix}"):
+        test_engine.execute(
+            f"create table features.{table} as "
+            f"select entity_id, as_of_date from features.aprefix_{suffix}_imputed"
+        )
+
+    # add a new member of the cohort. now we should need to rebuild the
+    # features for its as_of_date, and only that one
     test_engine.execute("insert into states values (%s, %s)", 999, "2015-01-01")
     table_tasks = feature_generator.generate_all_table_tasks(
         aggregations,
         task_type="aggregation",
     )
-    assert len(table_tasks["aprefix_entity_id"]) == 3
-    assert len(table_tasks["aprefix_aggregation"]) == 3
+    assert list(table_tasks) == [
+        f"aprefix_entity_id_{suffix}_new",
+        f"aprefix_{suffix}_new",
+    ]
+    assert len(table_tasks[f"aprefix_entity_id_{suffix}_new"]) == 3
+    assert len(table_tasks[f"aprefix_entity_id_{suffix}_new"]["inserts"]) == 1
+    assert len(table_tasks[f"aprefix_{suffix}_new"]) == 3
     feature_generator.process_table_tasks(table_tasks)
     imp_tasks = feature_generator.generate_all_table_tasks(
         aggregations,
         task_type="imputation",
     )
 
-    assert len(imp_tasks["aprefix_aggregation_imputed"]) == 3
+    assert len(imp_tasks[f"aprefix_{suffix}_imputed"]) == 3
+    feature_generator.process_table_tasks(imp_tasks)
+
+    rows = list(
+        test_engine.execute(
+            "select entity_id, as_of_date from features.aprefix_aggregation_imputed "
+            "order by entity_id, as_of_date"
+        )
+    )
+    assert len(rows) == len(INPUT_STATES) + 1
+    assert rows[-1] == (999, date(2015, 1, 1))
+    assert not feature_generator._table_exists(f"aprefix_{suffix}_new_imputed")
+    # the new as_of_date was built into tables of its own
+    for table in (f"aprefix_entity_id_{suffix}", f"aprefix_{suffix}"):
+        assert [
+            row[0] for row in test_engine.execute(f"select count(*) from features.{table}")
+        ] == [len(INPUT_STATES)]
+        test_engine.execute(f"drop table features.{table}")
+    assert feature_generator._missing_feature_dates(aggregations[0]) == []
+
+    # a changed config gets tables of its own, so all as_of_dates are built
+    # and the table built from the original config is left alone
+    original_config = copy.deepcopy(aggregate_config)
+    aggregate_config[0]["aggregates"][0]["metrics"].append("max")
+    aggregations = feature_generator.aggregations(
+        feature_dates=["2013-09-30", "2014-09-30", "2015-01-01"],
+        feature_aggregation_config=aggregate_config,
+        state_table="states",
+    )
+    max_suffix = feature_generator._aggregation_hash(aggregate_config[0], "states")[:12]
+    feature_generator.prepare_imputed_tables(aggregations)
+    table_tasks = feature_generator.generate_all_table_tasks(
+        aggregations,
+        task_type="aggregation",
+    )
+    assert len(table_tasks[f"aprefix_entity_id_{max_suffix}"]["inserts"]) == 3
+    assert len(table_tasks[f"aprefix_{max_suffix}"]) == 3
+    feature_generator.process_table_tasks(table_tasks)
+    feature_generator.process_table_tasks(
+        feature_generator.generate_all_table_tasks(aggregations, task_type="imputation")
+    )
+    assert feature_generator._missing_feature_dates(aggregations[0]) == []
+    assert feature_generator._table_exists(f"aprefix_{suffix}_imputed")
+    assert "aprefix_entity_id_all_quantity_one_max" in feature_generator._table_columns(
+        "aprefix_aggregation_imputed"
+    )
+
+    # switching back to the original config reuses the table built from it
+    aggregations = feature_generator.aggregations(
+        feature_dates=["2013-09-30", "2014-09-30", "2015-01-01"],
+        feature_aggregation_config=original_config,
+        state_table="states",
+    )
+    feature_generator.prepare_imputed_tables(aggregations)
+    table_tasks = feature_generator.generate_all_table_tasks(
+        aggregations,
+        task_type="aggregation",
+    )
+    assert len(table_tasks[f"aprefix_entity_id_{suffix}"]) == 0
+    assert len(table_tasks[f"aprefix_{suffix}"]) == 0
+    columns = feature_generator._table_columns("aprefix_aggregation_imputed")
+    assert "aprefix_entity_id_all_quantity_one_max" not in columns
+
+    # tables built before tables were named after their content hash are
+    # renamed, and an untagged one is tagged with the current hash
+    test_engine.execute("drop view features.aprefix_aggregation_imputed")
+    test_engine.execute(
+        f"alter table features.aprefix_{suffix}_imputed "
+        f"rename to aprefix_aggregation_imputed"
+    )
+    test_engine.execute("comment on table features.aprefix_aggregation_imputed is null")
+    test_engine.execute(
+        f"alter table features.aprefix_{max_suffix}_imputed "
+        f"rename to aprefix_aggregation_imputed_{max_suffix}"
+    )
+    feature_generator.prepare_imputed_tables(aggregations)
+    assert feature_generator._table_hash(f"aprefix_{suffix}_imputed") == content_hash
+    assert feature_generator._table_exists(f"aprefix_{max_suffix}_imputed")
+    assert feature_generator._relation_kind("aprefix_aggregation_imputed") == "v"
+    assert feature_generator._missing_feature_dates(aggregations[0]) == []
+
+    # replacing rebuilds the table the view is on
+    feature_generator.replace = True
+    feature_tables = feature_generator.create_all_tables(
+        feature_dates=["2013-09-30", "2014-09-30", "2015-01-01"],
+        feature_aggregation_config=original_config,
+        state_table="states",
+    )
+    assert list(feature_tables) == [f"aprefix_{suffix}_imputed"]
+    assert feature_generator._relation_kind("aprefix_aggregation_imputed") == "v"
+
+
+def test_aggregation_hash():
+    feature_generator = FeatureGenerator(db_engine=None, features_schema_name="features")
+    aggregation_config = {
+        "prefix": "aprefix",
+        "aggregates": [{"quantity": "quantity_one", "metrics": ["sum", "count"]}],
+        "groups": ["entity_id"],
+        "intervals": ["1y", "all"],
+        "knowledge_date_column": "knowledge_date",
+        "from_obj": "data",
+    }
+    aggregation_hash = feature_generator._aggregation_hash(aggregation_config, "states")
+
+    # how the features are computed doesn't change them
+    assert aggregation_hash == feature_generator._aggregation_hash(
+        dict(aggregation_config, query_strategy="single_scan", rollup_intervals=False),
+        "states",
+    )
+    # but rolled up sums of integers have another type
+    assert aggregation_hash != feature_generator._aggregation_hash(
+        dict(aggregation_config, rollup_intervals=True), "states"
+    )
+    assert aggregation_hash != feature_generator._aggregation_hash(aggregation_config, "cohort")
+
 
 def test_aggregations_materialize_off(test_engine):
     aggregate_config = {
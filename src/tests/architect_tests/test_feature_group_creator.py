@@ -20,6 +20,20 @@ def test_table_group():
     assert subsets[1].names == ["tables: three"]
 
 
+def test_table_group_hashed_imputed_table():
+    # imputed feature tables are matched by the name they had before hashing
+    group = FeatureGroupCreator(definition={"tables": ["one_aggregation_imputed"]})
+
+    subsets = group.subsets(
+        {
+            "one_0123456789ab_imputed": ["col_a", "col_b"],
+            "two_0123456789ab_imputed": ["col_c"],
+        }
+    )
+    assert subsets == [{"one_0123456789ab_imputed": ["col_a", "col_b"]}]
+    assert subsets[0].names == ["tables: one_aggregation_imputed"]
+
+
 def test_prefix_group():
     # ensure we test prefixes with underscores
     group = FeatureGroupCreator(definition={"prefix": ["major_viol", "severe_viol"]})
@@ -132,3 +132,32 @@ def test_Planner():
         )
         == 8
     )
+
+
+def test_Planner_shared_feature_blocks():
+    dates = [datetime.datetime(2010, 1, day, 0, 0) for day in range(1, 5)]
+    build_tasks = {
+        "train": {
+            "as_of_times": dates[:3],
+            "feature_dictionary": {"cats": ["cat_a", "cat_b"], "dogs": ["dog_a"]},
+        },
+        "test_cats": {
+            "as_of_times": dates[2:],
+            "feature_dictionary": {"cats": ["cat_c", "cat_a"]},
+        },
+        "test_dogs": {
+            "as_of_times": dates[3:],
+            "feature_dictionary": {"dogs": ["dog_a"]},
+        },
+    }
+    planner = Planner(
+        feature_start_time=datetime.datetime(2010, 1, 1, 0, 0),
+        label_names=["booking"],
+        label_types=["binary"],
+        cohort_names=["prior_bookings"],
+        user_metadata={},
+    )
+    # only cats as of the third date is needed by two matrices
+    assert planner.shared_feature_blocks(build_tasks) == {
+        "cats": {"columns": ["cat_a", "cat_b", "cat_c"], "as_of_dates": [dates[2]]}
+    }
@@ -8,6 +8,7 @@ from triage.component.catwalk.evaluation import (
 from triage.component.catwalk.metrics import Metric
 import testing.postgresql
 import datetime
+import itertools
 import re
 
 import factory
@@ -770,3 +771,92 @@ def test_generate_binary_at_x():
         generate_binary_at_x(np.array([]), 2),
         np.array([])
     )
+
+
+def test_compute_evaluations_matches_metric_functions():
+    metric_groups = [
+        {
+            "metrics": [
+                "precision@",
+                "recall@",
+                "accuracy",
+                "f1",
+                "true positives@",
+                "false positives@",
+                "true negatives@",
+                "false negatives@",
+                "fpr@",
+            ],
+            "thresholds": {"percentiles": [5.0, 10.0, 50.0, 100.0], "top_n": [0, 1, 7, 500]},
+        },
+        {
+            "metrics": ["fbeta@"],
+            "parameters": [{"beta": 0.75}, {"beta": 1.25}],
+            "thresholds": {"percentiles": [10.0], "top_n": [3]},
+        },
+    ]
+    model_evaluator = ModelEvaluator(metric_groups, [], None)
+    metric_defs = model_evaluator._flatten_metric_config_groups(metric_groups)
+
+    random_state = np.random.RandomState(1234)
+    predictions_proba = np.sort(random_state.randint(0, 10, 200) / 10)[::-1]
+    labels = random_state.choice([0, 1, np.nan], 200).astype(float)
+
+    for evaluation, metric_def in zip(
+        model_evaluator._compute_evaluations(predictions_proba, labels, metric_defs),
+        metric_defs
+    ):
+        predicted_classes, present_labels = model_evaluator._filter_nan_labels(
+            generate_binary_at_x(
+                predictions_proba, metric_def.threshold_value, unit=metric_def.threshold_unit
+            ),
+            labels
+        )
+        expected = ModelEvaluator.available_metrics[metric_def.metric](
+            predictions_proba,
+            predicted_classes,
+            present_labels,
+            metric_def.parameter_combination,
+        )
+        assert evaluation.metric == metric_def.metric
+        assert evaluation.parameter == metric_def.parameter_string
+        assert_almost_equal(evaluation.value, expected, decimal=12)
+        assert evaluation.num_labeled_examples == len(present_labels)
+        assert evaluation.num_labeled_above_threshold == np.count_nonzero(predicted_classes)
+        assert evaluation.num_positive_labels == np.count_nonzero(present_labels)
+
+
+def test_compute_expected_evaluations_matches_all_tie_orderings():
+    metric_groups = [
+        {
+            "metrics": ["precision@", "recall@", "accuracy", "false positives@", "fpr@"],
+            "thresholds": {"top_n": [2, 4, 5]},
+        },
+        {
+            "metrics": ["fbeta@"],
+            "parameters": [{"beta": 0.5}],
+            "thresholds": {"top_n": [4]},
+        },
+    ]
+    model_evaluator = ModelEvaluator(metric_groups, [], None, random_tiebreaking="analytic")
+    metric_defs = model_evaluator._flatten_metric_config_groups(metric_groups)
+
+    predictions_proba = np.array([0.9, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.1])
+    labels = np.array([1, 1, 0, np.nan, 1, 0, np.nan, 0])
+
+    values_per_ordering = []
+    for ordering in itertools.permutations(range(1, 7)):
+        reordered_labels = labels[[0, *ordering, 7]]
+        values_per_ordering.append([
+            evaluation.value for evaluation in
+            model_evaluator._compute_evaluations(predictions_proba, reordered_labels, metric_defs)
+        ])
+    values_per_ordering = np.array(values_per_ordering, dtype=float)
+
+    moments = model_evaluator._compute_expected_evaluations(
+        predictions_proba, labels, metric_defs
+    )
+    for i, metric_def in enumerate(metric_defs):
+        mean, standard_deviation = moments[(metric_def.metric, metric_def.parameter_string)]
+        assert_almost_equal(mean, values_per_ordering[:, i].mean())
+        assert_almost_equal(standard_deviation, values_per_ordering[:, i].std())
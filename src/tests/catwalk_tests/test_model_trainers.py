@@ -191,6 +191,32 @@ def test_model_trainer(grid_config, default_model_trainer):
     assert model_ids == sorted([model_id for model_id in new_model_ids])
 
 
+def test_model_hash_ignores_derived_metadata(project_storage):
+    trainer = ModelTrainer(
+        experiment_hash=None,
+        model_storage_engine=project_storage.model_storage_engine(),
+        db_engine=None,
+    )
+    metadata = {"matrix_id": "train", "label_timespan": "1y"}
+    model_hash = trainer._model_hash(metadata, "sklearn.tree.DecisionTreeClassifier", {}, 5)
+    assert model_hash == trainer._model_hash(
+        dict(
+            metadata,
+            columns=["f1", "f2"],
+            as_of_dates=[],
+            num_observations=10,
+            num_entities=5,
+            content_hash="abc",
+        ),
+        "sklearn.tree.DecisionTreeClassifier",
+        {},
+        5,
+    )
+    assert model_hash != trainer._model_hash(
+        dict(metadata, label_timespan="2y"), "sklearn.tree.DecisionTreeClassifier", {}, 5
+    )
+
+
 def test_baseline_exception_handling(default_model_trainer):
     grid_config = {
         "triage.component.catwalk.baselines.rankers.PercentileRankOneFeature": {
@@ -7,7 +7,7 @@ from numpy.testing import assert_array_almost_equal
 import pandas as pd
 
 from triage.component.results_schema import TestPrediction, Matrix, Model
-from triage.component.catwalk.storage import TestMatrixType
+from triage.component.catwalk.storage import PredictionsStorageEngine, TestMatrixType
 from triage.component.catwalk.db import ensure_db
 from tests.results_tests.factories import (
     MatrixFactory,
@@ -157,6 +157,52 @@ def test_predictor_save_predictions(matrix_type, predict_setup_args):
     assert not table_has_data(f"{matrix_type}_predictions", db_engine)
 
 
+@with_matrix_types
+def test_predictor_save_predictions_to_file(matrix_type, predict_setup_args):
+    """Predictions saved to a file, with only a pointer in the prediction metadata"""
+    (project_storage, db_engine, model_id) = predict_setup_args
+    predictor = Predictor(
+        project_storage.model_storage_engine(),
+        db_engine,
+        rank_order='worst',
+        predictions_storage_engine=project_storage.predictions_storage_engine(),
+    )
+
+    metadata = matrix_metadata_creator(matrix_type=matrix_type)
+    matrix_store = get_matrix_store(project_storage, metadata=metadata)
+    train_matrix_columns = matrix_store.columns()
+
+    assert predictor.needs_predictions(matrix_store, model_id)
+    predict_proba = predictor.predict(
+        model_id,
+        matrix_store,
+        misc_db_parameters=dict(),
+        train_matrix_columns=train_matrix_columns,
+    )
+    assert not predictor.needs_predictions(matrix_store, model_id)
+    assert not table_has_data(f"{matrix_type}_results.predictions", db_engine)
+
+    (predictions_path,) = db_engine.execute(
+        f"select predictions_path from {matrix_type}_results.prediction_metadata"
+    ).fetchone()
+    saved = PredictionsStorageEngine.load(predictions_path)
+    assert len(saved) == len(predict_proba)
+    assert set(PredictionsStorageEngine.columns) == set(saved.columns)
+
+    # without replace, the saved predictions are read back in matrix order
+    predictor.replace = False
+    predictor.load_model = Mock(side_effect=AssertionError("should not load the model"))
+    assert_array_almost_equal(
+        predictor.predict(
+            model_id,
+            matrix_store,
+            misc_db_parameters=dict(),
+            train_matrix_columns=train_matrix_columns,
+        ),
+        predict_proba,
+    )
+
+
 @with_matrix_types
 def test_predictor_needs_predictions(matrix_type, predict_setup_args):
     """Test that the logic that figures out if predictions are needed for a given model/matrix"""
@@ -293,3 +339,28 @@ def test_predictor_retrieve(predict_setup_args):
     )
     assert_array_almost_equal(new_predict_proba, predict_proba, decimal=5)
     assert not predictor.load_model.called
+
+
+def test_predictor_align_saved_predictions():
+    predictor = Predictor(None, None, rank_order='worst')
+    dayone = datetime.datetime(2011, 1, 1)
+    matrix_store = Mock(
+        index=pd.MultiIndex.from_tuples(
+            [(1, dayone), (2, dayone), (3, dayone)], names=["entity_id", "as_of_date"]
+        ),
+        num_observations=3,
+    )
+    saved = pd.DataFrame({
+        "entity_id": [3, 1, 2],
+        "as_of_date": [dayone] * 3,
+        "score": [0.3, 0.1, 0.2],
+    })
+    assert_array_almost_equal(
+        predictor._align_saved_predictions(saved, matrix_store), [0.1, 0.2, 0.3]
+    )
+
+    # predictions for other entities, or too few of them, can't be reused
+    assert predictor._align_saved_predictions(
+        saved.assign(entity_id=[4, 1, 2]), matrix_store
+    ) is None
+    assert predictor._align_saved_predictions(saved.iloc[:2], matrix_store) is None
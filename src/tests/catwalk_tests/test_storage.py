@@ -4,6 +4,7 @@ import tempfile
 from collections import OrderedDict
 
 import boto3
+import numpy as np
 import pandas as pd
 import pytest
 import yaml
@@ -15,10 +16,15 @@ from unittest import mock
 from triage.component.catwalk.storage import (
     MatrixStore,
     CSVMatrixStore,
+    MemmapMatrixStore,
+    ParquetMatrixStore,
+    SparseMatrixStore,
     FSStore,
     S3Store,
+    Store,
     ProjectStorage,
     ModelStorageEngine,
+    PredictionsStorageEngine,
 )
 
 from tests.utils import CallSpy
@@ -141,6 +147,33 @@ def test_ModelStorageEngine_caching(project_storage):
     assert 'myhash' not in mse.cache
 
 
+def test_PredictionsStorageEngine(project_storage):
+    engine = project_storage.predictions_storage_engine()
+    predictions = pd.DataFrame({
+        "entity_id": [1, 2, 3],
+        "as_of_date": pd.to_datetime(["2017-01-01"] * 3),
+        "score": [0.9, 0.5, 0.5],
+        "label_value": [1.0, np.nan, 0.0],
+        "rank_abs_no_ties": [1, 2, 3],
+        "rank_abs_with_ties": [1, 2, 2],
+        "rank_pct_no_ties": [1 / 3, 2 / 3, 1.0],
+        "rank_pct_with_ties": [0.5, 1.0, 1.0],
+        "model_id": 5,
+    })
+    predictions_path = engine.write(predictions, "myhash", "myuuid")
+    assert engine.get_store("myhash", "myuuid").exists()
+
+    # reading only needs the path, and drops the columns not meant for the file
+    assert_frame_equal(
+        PredictionsStorageEngine.load(predictions_path),
+        predictions[PredictionsStorageEngine.columns],
+    )
+    assert_frame_equal(
+        PredictionsStorageEngine.load(predictions_path, columns=["entity_id", "score"]),
+        predictions[["entity_id", "score"]],
+    )
+
+
 DATA_DICT = OrderedDict(
     [
         ("entity_id", [1, 2]),
@@ -165,12 +198,26 @@ def matrix_stores():
             yaml.dump(METADATA, outfile, default_flow_style=False)
         df.to_csv(tmpcsv, compression="gzip")
         csv = CSVMatrixStore(project_storage, [], "df")
-        # first test with caching
-        with csv.cache():
-            yield csv
-        # with the caching out of scope they will be nuked
-        # and this last version will not have any cache
-        yield csv
+        for matrix_store_class in (ParquetMatrixStore, MemmapMatrixStore, SparseMatrixStore):
+            matrix_store_class(
+                project_storage,
+                [],
+                "df",
+                matrix=df.reset_index().assign(as_of_date=lambda d: pd.to_datetime(d.as_of_date)),
+                metadata=METADATA,
+            ).save()
+        for matrix_store in (
+            csv,
+            ParquetMatrixStore(project_storage, [], "df"),
+            MemmapMatrixStore(project_storage, [], "df"),
+            SparseMatrixStore(project_storage, [], "df"),
+        ):
+            # first test with caching
+            with matrix_store.cache():
+                yield matrix_store
+            # with the caching out of scope they will be nuked
+            # and this last version will not have any cache
+            yield matrix_store
 
 
 def test_MatrixStore_empty():
@@ -294,15 +341,285 @@ def test_s3_save():
         client = boto3.client("s3")
         client.create_bucket(Bucket="fake-matrix-bucket", ACL="public-read-write")
         for example in matrix_stores():
-            if not isinstance(example, CSVMatrixStore):
-                continue
             project_storage = ProjectStorage("s3://fake-matrix-bucket")
 
-            tosave = CSVMatrixStore(project_storage, [], "test")
+            tosave = example.__class__(project_storage, [], "test")
             tosave.metadata = example.metadata
             tosave.matrix_label_tuple = example.matrix_label_tuple
             tosave.save()
 
-            tocheck = CSVMatrixStore(project_storage, [], "test")
+            tocheck = example.__class__(project_storage, [], "test")
             assert tocheck.metadata == example.metadata
             assert tocheck.design_matrix.to_dict() == example.design_matrix.to_dict()
+
+
+def test_MatrixStore_copy_from():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        project_storage = ProjectStorage(tmpdir)
+        for source in matrix_stores():
+            copy = source.__class__(
+                project_storage, ["copies"], "copy", metadata={"label_name": "label", "copied": True}
+            )
+            copy.copy_from(source)
+
+            copied = source.__class__(project_storage, ["copies"], "copy")
+            assert copied.metadata == dict(METADATA, copied=True)
+            assert_frame_equal(copied.design_matrix, source.design_matrix)
+            # the files are hard-linked, but saving over the copy leaves the source alone
+            assert os.path.samefile(copied.matrix_base_store.path, source.matrix_base_store.path)
+            copied.matrix_label_tuple = (
+                source.design_matrix.head(1), source.labels.head(1)
+            )
+            copied.save()
+            assert not os.path.samefile(copied.matrix_base_store.path, source.matrix_base_store.path)
+            source.clear_cache()
+            assert len(source.design_matrix) == len(DATA_DICT["entity_id"])
+
+        with pytest.raises(ValueError):
+            CSVMatrixStore(project_storage, [], "csv", metadata=METADATA).copy_from(
+                ParquetMatrixStore(project_storage, [], "df")
+            )
+
+
+def test_ParquetMatrixStore_column_projection(project_storage):
+    data = {
+        "entity_id": [1, 2, 1, 2],
+        "as_of_date": [
+            pd.Timestamp(2016, 1, 1),
+            pd.Timestamp(2016, 1, 1),
+            pd.Timestamp(2017, 1, 1),
+            pd.Timestamp(2017, 1, 1),
+        ],
+        "feature_one": [0.5, 0.6, 0.7, 0.8],
+        "feature_two": [0.1, 0.2, 0.3, 0.4],
+        "label": [1, 0, 1, 0]
+    }
+    ParquetMatrixStore(
+        project_storage,
+        [],
+        "test",
+        matrix=pd.DataFrame.from_dict(data),
+        metadata={"indices": ["entity_id", "as_of_date"], "label_name": "label"}
+    ).save()
+
+    matrix_store = ParquetMatrixStore(project_storage, [], "test")
+    assert matrix_store.columns() == ["feature_one", "feature_two"]
+    assert not matrix_store.empty
+
+    with mock.patch.object(matrix_store, "_load") as load_mock:
+        design_matrix = matrix_store.matrix_with_sorted_columns(["feature_two", "feature_one"])
+        assert not load_mock.called
+    assert design_matrix.columns.tolist() == ["feature_two", "feature_one"]
+    assert design_matrix.dtypes.tolist() == ["float32", "float32"]
+    # rows come back in index order even though they are stored by as-of-date
+    assert design_matrix.index.get_level_values("entity_id").tolist() == [1, 1, 2, 2]
+
+    design_matrix, labels = matrix_store.load_subset(
+        as_of_dates=[datetime.date(2017, 1, 1)],
+        columns=["feature_one"]
+    )
+    assert design_matrix.columns.tolist() == ["feature_one"]
+    assert_almost_equal(design_matrix["feature_one"].tolist(), [0.7, 0.8])
+    assert labels.tolist() == [1, 0]
+
+
+def test_MemmapMatrixStore_shares_memory(project_storage):
+    data = {
+        "entity_id": [1, 2],
+        "as_of_date": [pd.Timestamp(2017, 1, 1), pd.Timestamp(2017, 1, 1)],
+        "feature_one": [0.5, 0.6],
+        "feature_two": [0.1, 0.2],
+        "label": [1, 0]
+    }
+    MemmapMatrixStore(
+        project_storage,
+        [],
+        "test",
+        matrix=pd.DataFrame.from_dict(data),
+        metadata={"indices": ["entity_id", "as_of_date"], "label_name": "label"}
+    ).save()
+
+    matrix_store = MemmapMatrixStore(project_storage, [], "test")
+    assert matrix_store.columns() == ["feature_one", "feature_two"]
+    design_matrix = matrix_store.matrix_with_sorted_columns(["feature_one", "feature_two"])
+    base = design_matrix.values
+    while not isinstance(base, np.memmap) and isinstance(base.base, np.ndarray):
+        base = base.base
+    assert isinstance(base, np.memmap)
+    assert not design_matrix.values.flags.writeable
+    assert_almost_equal(design_matrix.values.tolist(), [[0.5, 0.1], [0.6, 0.2]])
+    assert matrix_store.labels.tolist() == [1, 0]
+    assert matrix_store.as_of_dates == [datetime.date(2017, 1, 1)]
+
+
+def test_SparseMatrixStore_sparse_columns(project_storage):
+    data = {
+        "entity_id": [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11],
+        "as_of_date": [pd.Timestamp(2017, 1, 1)] * 11,
+        "feature_dense": [0.5, 0.6, 0.7, 0.8, 0.9, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6],
+        "category_a": [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+        "category_b": [0] * 11,
+        "label": [1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1],
+    }
+    SparseMatrixStore(
+        project_storage,
+        [],
+        "test",
+        matrix=pd.DataFrame.from_dict(data),
+        metadata={"indices": ["entity_id", "as_of_date"], "label_name": "label"}
+    ).save()
+
+    matrix_store = SparseMatrixStore(project_storage, [], "test")
+    design_matrix = matrix_store.design_matrix
+    assert design_matrix.columns.tolist() == ["feature_dense", "category_a", "category_b"]
+    # columns with at most one non-zero value in ten are kept sparse
+    assert design_matrix.dtypes["feature_dense"] == np.float32
+    assert design_matrix.dtypes["category_a"] == pd.SparseDtype(np.float32, 0)
+    assert design_matrix.dtypes["category_b"] == pd.SparseDtype(np.float32, 0)
+    assert_almost_equal(design_matrix["feature_dense"].tolist(), data["feature_dense"])
+    assert design_matrix["category_a"].sparse.to_dense().tolist() == data["category_a"]
+    assert design_matrix["category_b"].sparse.density == 0
+    assert matrix_store.labels.tolist() == data["label"]
+
+
+def test_MatrixStore_shape_from_metadata(project_storage):
+    data = {
+        "entity_id": [1, 2, 1],
+        "as_of_date": [
+            pd.Timestamp(2016, 1, 1),
+            pd.Timestamp(2016, 1, 1),
+            pd.Timestamp(2017, 1, 1),
+        ],
+        "feature_one": [0.5, 0.6, 0.7],
+        "feature_two": [0.1, 0.2, 0.3],
+        "label": [1, 0, 1]
+    }
+    metadata = {"indices": ["entity_id", "as_of_date"], "label_name": "label"}
+    to_save = CSVMatrixStore(
+        project_storage,
+        [],
+        "test",
+        matrix=pd.DataFrame.from_dict(data),
+        metadata=metadata
+    )
+    to_save.metadata = dict(metadata, **to_save.shape_metadata(to_save.design_matrix))
+    to_save.save()
+
+    matrix_store = CSVMatrixStore(project_storage, [], "test")
+    with mock.patch.object(matrix_store, "_load") as load_mock, \
+            mock.patch.object(matrix_store, "_columns_in_storage") as columns_mock:
+        assert matrix_store.columns() == ["feature_one", "feature_two"]
+        assert matrix_store.columns(include_label=True) == ["feature_one", "feature_two", "label"]
+        assert matrix_store.as_of_dates == [datetime.date(2016, 1, 1), datetime.date(2017, 1, 1)]
+        assert matrix_store.num_entities == 2
+        assert matrix_store.num_observations == 3
+        assert not matrix_store.empty
+        assert not load_mock.called
+        assert not columns_mock.called
+
+
+@pytest.mark.parametrize(
+    "matrix_store_class,num_rows",
+    [
+        (CSVMatrixStore, 4),
+        (ParquetMatrixStore, 4),
+        (MemmapMatrixStore, 4),
+        # without the number of rows, the chunks are gathered and saved at once
+        (MemmapMatrixStore, None),
+        (SparseMatrixStore, 4),
+    ],
+)
+def test_MatrixStore_chunk_writer(project_storage, matrix_store_class, num_rows):
+    index = pd.MultiIndex.from_tuples(
+        [
+            (1, pd.Timestamp(2016, 1, 1)),
+            (1, pd.Timestamp(2017, 1, 1)),
+            (2, pd.Timestamp(2016, 1, 1)),
+            (3, pd.Timestamp(2017, 1, 1)),
+        ],
+        names=MatrixStore.indices,
+    )
+    design_matrix = pd.DataFrame(
+        {"feature_one": [0.5, 0.6, 0.7, 0.8], "feature_two": [0.1, 0.2, 0.3, 0.4]},
+        index=index,
+        dtype="float32",
+    )
+    labels = pd.Series([1, 0, 1, 0], index=index, name="label", dtype="float32")
+    metadata = {"indices": MatrixStore.indices, "label_name": "label"}
+
+    to_save = matrix_store_class(project_storage, [], "test", metadata=metadata)
+    with to_save.chunk_writer(num_rows=num_rows) as write_chunk:
+        # a matrix isn't there until all of its chunks are written
+        assert not to_save.exists
+        for rows in (slice(0, 2), slice(2, 3), slice(3, 4)):
+            write_chunk(design_matrix[rows], labels[rows])
+
+    matrix_store = matrix_store_class(project_storage, [], "test")
+    assert matrix_store.exists
+    assert_frame_equal(matrix_store.design_matrix, design_matrix, check_dtype=False)
+    assert matrix_store.labels.tolist() == [1, 0, 1, 0]
+    design_matrix_subset, labels_subset = matrix_store.load_subset(
+        as_of_dates=[datetime.date(2017, 1, 1)]
+    )
+    assert design_matrix_subset.index.get_level_values("entity_id").tolist() == [1, 3]
+    assert labels_subset.tolist() == [0, 0]
+
+
+@pytest.mark.parametrize(
+    "matrix_store_class",
+    [CSVMatrixStore, ParquetMatrixStore, MemmapMatrixStore, SparseMatrixStore],
+)
+def test_MatrixStore_chunk_writer_interrupted_rebuild(project_storage, matrix_store_class):
+    index = pd.MultiIndex.from_tuples(
+        [(1, pd.Timestamp(2016, 1, 1)), (2, pd.Timestamp(2016, 1, 1))],
+        names=MatrixStore.indices,
+    )
+    design_matrix = pd.DataFrame({"feature_one": [0.5, 0.6]}, index=index, dtype="float32")
+    labels = pd.Series([1, 0], index=index, name="label", dtype="float32")
+    metadata = {"indices": MatrixStore.indices, "label_name": "label"}
+
+    to_save = matrix_store_class(project_storage, [], "test", metadata=metadata)
+    with to_save.chunk_writer(num_rows=2) as write_chunk:
+        write_chunk(design_matrix, labels)
+    assert matrix_store_class(project_storage, [], "test").exists
+
+    # the previous metadata doesn't make a partially rewritten matrix exist
+    with pytest.raises(RuntimeError):
+        with to_save.chunk_writer(num_rows=2) as write_chunk:
+            write_chunk(design_matrix[:1], labels[:1])
+            raise RuntimeError("interrupted")
+    assert not matrix_store_class(project_storage, [], "test").exists
+
+
+def test_MemmapMatrixStore_head_of_matrix_reads_one_row(project_storage):
+    index = pd.MultiIndex.from_tuples(
+        [(1, pd.Timestamp(2016, 1, 1)), (2, pd.Timestamp(2016, 2, 1))],
+        names=MatrixStore.indices,
+    )
+    design_matrix = pd.DataFrame(
+        {"feature_one": [0.5, 0.6], "feature_two": [1.0, 2.0]}, index=index, dtype="float32"
+    )
+    labels = pd.Series([1, 0], index=index, name="label", dtype="float32")
+    to_save = MemmapMatrixStore(
+        project_storage, [], "test", metadata={"indices": MatrixStore.indices, "label_name": "label"}
+    )
+    to_save.matrix_label_tuple = design_matrix, labels
+    to_save.save()
+
+    class StreamedStore(Store):
+        """A local file that is read as a stream, like files on S3"""
+
+        def __init__(self, path):
+            self.path = path
+
+        def open(self, *args, **kwargs):
+            return open(self.path, *args, **kwargs)
+
+    matrix_store = MemmapMatrixStore(project_storage, [], "test")
+    matrix_store.matrix_base_store = StreamedStore(matrix_store.matrix_base_store.path)
+    with mock.patch.object(matrix_store, "_load_array") as load_array_mock:
+        head_of_matrix = matrix_store.head_of_matrix
+        assert not load_array_mock.called
+    assert head_of_matrix.index.tolist() == [(1, pd.Timestamp(2016, 1, 1))]
+    assert head_of_matrix.columns.tolist() == ["feature_one", "feature_two", "label"]
+    assert head_of_matrix.values.tolist() == [[0.5, 1.0, 1.0]]
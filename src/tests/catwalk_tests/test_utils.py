@@ -6,16 +6,24 @@ from triage.component.catwalk.utils import (
     missing_model_hashes,
     missing_matrix_uuids,
     sort_predictions_and_labels,
+    _write_csv,
+    _write_dataframe_csv,
+    save_db_objects,
+    call_with_design_matrix,
 )
-from triage.component.results_schema.schema import Matrix, Model
+from triage.component.results_schema.schema import Matrix, Model, TestAequitas
 from triage.component.catwalk.db import ensure_db
 from sqlalchemy import create_engine
 import testing.postgresql
 import datetime
+import io
 import re
 import numpy as np
+import pandas as pd
 from numpy.testing import assert_array_equal
 import pytest
+import sqlalchemy
+from unittest import mock
 
 
 def test_filename_friendly_hash():
@@ -153,4 +161,116 @@ def test_sort_predictions_and_labels():
         sort_seed=24376234
     )
     assert_array_equal(sorted_predictions, np.array([0.6, 0.6, 0.5, 0.5, 0.4]))
-    assert_array_equal(sorted_labels, np.array([None, 1, 0, 1, 0]))
+    assert_array_equal(sorted_labels, np.array([1, None, 1, 0, 0]))
+
+
+def test_sort_predictions_and_labels_matches_dataframe_sort():
+    rng = np.random.default_rng(5)
+    predictions = rng.integers(0, 20, 1000) / 20
+    labels = rng.choice([0.0, 1.0, np.nan], 1000)
+    df = pd.DataFrame({"score": predictions, "label_value": labels})
+
+    worst = df.sort_values(
+        by=["score", "label_value"], ascending=[False, True], na_position="first", kind="mergesort"
+    )
+    sorted_predictions, sorted_labels = sort_predictions_and_labels(
+        predictions, labels, tiebreaker='worst'
+    )
+    assert_array_equal(sorted_predictions, worst["score"].to_numpy())
+    assert_array_equal(sorted_labels, worst["label_value"].to_numpy())
+
+    # sorting already sorted predictions only moves rows within tied scores
+    best = df.sort_values(
+        by=["score", "label_value"], ascending=[False, False], na_position="last", kind="mergesort"
+    )
+    sorted_predictions, sorted_labels = sort_predictions_and_labels(
+        sorted_predictions, sorted_labels, tiebreaker='best'
+    )
+    assert_array_equal(sorted_predictions, best["score"].to_numpy())
+    assert_array_equal(sorted_labels, best["label_value"].to_numpy())
+
+    # a random sort keeps the same labels inside each block of tied scores
+    random_predictions, random_labels = sort_predictions_and_labels(
+        predictions, labels, tiebreaker='random', sort_seed=1234
+    )
+    assert_array_equal(random_predictions, sorted_predictions)
+    for score in np.unique(predictions):
+        in_block = random_predictions == score
+        assert_array_equal(
+            np.sort(random_labels[in_block]), np.sort(sorted_labels[in_block])
+        )
+
+
+def test_write_csv_keeps_empty_strings_apart_from_nulls():
+    aequitas_row = TestAequitas(
+        model_id=1,
+        subset_hash='',
+        tie_breaker='worst',
+        parameter='10_abs',
+        for_=0.5,
+        tpr_ref_group_value='say "hi"',
+    )
+    attribute_keys = ['model_id', 'subset_hash', 'matrix_uuid', 'for_', 'tpr_ref_group_value']
+    output = io.StringIO()
+    _write_csv(output, [aequitas_row], TestAequitas, attribute_keys)
+    assert output.getvalue() == '"1","",,"0.5","say ""hi"""\n'
+
+    with pytest.raises(TypeError):
+        _write_csv(io.StringIO(), [aequitas_row, Model()], TestAequitas, attribute_keys)
+
+
+def test_write_dataframe_csv_in_chunks():
+    df = pd.DataFrame({
+        "entity_id": [1, 2, 3],
+        "as_of_date": pd.to_datetime(["2016-01-01", "2016-01-01", "2016-02-01"]),
+        "label_value": pd.array([1, None, 0], dtype="Int64"),
+        "score": [0.5, 0.25, 0.125],
+    })
+    output = io.StringIO()
+    _write_dataframe_csv(output, df, chunksize=2)
+    assert output.getvalue() == (
+        "1,2016-01-01,1,0.5\n"
+        "2,2016-01-01,,0.25\n"
+        "3,2016-02-01,0,0.125\n"
+    )
+
+
+def test_save_db_objects_does_not_retry_in_a_transaction():
+    connection = mock.create_autospec(sqlalchemy.engine.Connection, instance=True)
+    error = sqlalchemy.exc.OperationalError("copy", {}, Exception("server closed the connection"))
+    with mock.patch(
+        "triage.component.catwalk.utils.postgres_copy.copy_from", side_effect=error
+    ) as copy_mock:
+        with pytest.raises(sqlalchemy.exc.OperationalError):
+            save_db_objects(connection, [Matrix(matrix_uuid="abcd")])
+    # the error aborted the connection's transaction, so retrying is left to the caller
+    assert copy_mock.call_count == 1
+
+
+def sparse_design_matrix():
+    return pd.DataFrame(
+        {"f1": pd.arrays.SparseArray([0.0, 1.0, 0.0], fill_value=0.0), "f2": [1.0, 2.0, 3.0]}
+    )
+
+
+def test_call_with_design_matrix_densifies_rejected_sparse_input():
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    # requires dense data, and says so before fitting
+    estimator = HistGradientBoostingClassifier(max_iter=1)
+    call_with_design_matrix(estimator.fit, sparse_design_matrix(), [0, 1, 0])
+    assert estimator.n_features_in_ == 2
+
+
+def test_call_with_design_matrix_raises_other_type_errors():
+    calls = []
+
+    class Estimator:
+        def fit(self, X, y):
+            calls.append(X)
+            raise TypeError("bad hyperparameter")
+
+    Estimator.__module__ = "sklearn.fake"
+    with pytest.raises(TypeError, match="bad hyperparameter"):
+        call_with_design_matrix(Estimator().fit, sparse_design_matrix(), [0, 1, 0])
+    # not retried with a dense matrix
+    assert len(calls) == 1
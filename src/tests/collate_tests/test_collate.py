@@ -116,6 +116,35 @@ def test_aggregate_format_kwargs():
     ) == ["min('2012-01-01' - date)"]
 
 
+def test_aggregate_rollup():
+    agg = Aggregate("x", ["sum", "avg", "count"], {}, coltype="real")
+    assert agg.can_roll_up()
+
+    partials = {}
+    columns = list(
+        agg.get_rollup_columns(
+            lambda partial: partials.setdefault(partial, "p%d" % len(partials)),
+            when="in_1y",
+            prefix="prefix_",
+        )
+    )
+    assert partials == {"sum(x)": "p0", "count(x)": "p1"}
+    assert [c.name for c in columns] == ["prefix_x_sum", "prefix_x_avg", "prefix_x_count"]
+    assert list(map(str, columns)) == [
+        "(sum(p0) FILTER (WHERE in_1y))::real",
+        "(sum(p0) FILTER (WHERE in_1y) / nullif(sum(p1) FILTER (WHERE in_1y), 0)::numeric)::real",
+        "(coalesce(sum(p1) FILTER (WHERE in_1y), 0)::bigint)::real",
+    ]
+
+
+def test_aggregate_cannot_roll_up():
+    assert not Aggregate("x", ["sum", "stddev"], {}).can_roll_up()
+    assert not Aggregate("x", "percentile_cont", {}, order="x").can_roll_up()
+    assert not Aggregate("distinct x", "count", {}).can_roll_up()
+    assert not Aggregate(("x", "y"), "corr", {}).can_roll_up()
+    assert not (Aggregate("x", "sum", {}) / Aggregate("y", "sum", {})).can_roll_up()
+
+
 def test_aggregation_table_name_no_schema():
     # no schema
     assert (
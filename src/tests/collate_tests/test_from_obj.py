@@ -57,6 +57,67 @@ def test_materialized_from_obj_drop():
     )
     assert materialized_query.drop_materialized_table_sql == 'drop table if exists myquery_from_obj'
 
+def test_materialized_from_obj_create_unlogged_clustered():
+    materialized_query = FromObj(
+        from_obj='events where event_date < "2016-01-01"',
+        name="myquery",
+        knowledge_date_column='knowledge_date',
+        unlogged=True,
+        cluster=True,
+    )
+    assert materialized_query.create_materialized_table_sql == 'create unlogged table myquery_from_obj as ' +\
+        '(select * from events where event_date < "2016-01-01" order by entity_id, knowledge_date)'
+
+def test_materialized_from_obj_entity_index():
+    materialized_query = FromObj(
+        from_obj='events where event_date < "2016-01-01"',
+        name="myquery",
+        knowledge_date_column='knowledge_date'
+    )
+    assert materialized_query.entity_index_materialized_table_sql == \
+        'create index on myquery_from_obj (entity_id, knowledge_date)'
+
+def test_materialized_from_obj_partitions():
+    materialized_query = FromObj(
+        from_obj='events where event_date < "2016-01-01"',
+        name="myquery",
+        knowledge_date_column='knowledge_date',
+        partition_interval="1year",
+    )
+    assert materialized_query.partitioned_table_sql(date(2014, 1, 1), date(2015, 6, 1)) == [
+        "create table myquery_from_obj (like myquery_from_obj_load) partition by range (knowledge_date)",
+        "create table myquery_from_obj_p0 partition of myquery_from_obj "
+        "for values from ('2014-01-01') to ('2015-01-01')",
+        "create table myquery_from_obj_p1 partition of myquery_from_obj "
+        "for values from ('2015-01-01') to ('2016-01-01')",
+        "create table myquery_from_obj_default partition of myquery_from_obj default",
+        "insert into myquery_from_obj select * from myquery_from_obj_load",
+        "drop table myquery_from_obj_load",
+    ]
+
+def test_materialized_from_obj_partitions_no_rows():
+    materialized_query = FromObj(
+        from_obj='events where event_date < "2016-01-01"',
+        name="myquery",
+        knowledge_date_column='knowledge_date',
+        partition_interval="1year",
+    )
+    statements = materialized_query.partitioned_table_sql(None, None)
+    assert len(statements) == 4
+    assert statements[1] == "create table myquery_from_obj_default partition of myquery_from_obj default"
+
+def test_materialized_from_obj_content_hash():
+    def from_obj(**kwargs):
+        return FromObj(
+            from_obj='events where event_date < "2016-01-01"',
+            name="myquery",
+            knowledge_date_column='knowledge_date',
+            **kwargs
+        )
+    assert from_obj().content_hash == from_obj(analyze=True, reuse=True).content_hash
+    assert from_obj().content_hash != from_obj(partition_interval="1year").content_hash
+    assert from_obj().content_hash != from_obj(cluster=True).content_hash
+
 
 @pytest.fixture(name="db_engine_with_events_table", scope='function')
 def db_engine_with_events_table(db_engine):
@@ -145,3 +206,46 @@ def test_materialized_from_obj_maybe_materialize(db_engine_with_events_table):
     from_obj.should_materialize = lambda: True
     from_obj.maybe_materialize(db_engine_with_events_table)
     assert table_exists(from_obj.table, db_engine_with_events_table)
+
+
+def test_materialized_from_obj_maybe_materialize_partitioned(db_engine_with_events_table):
+    from_obj = FromObj(
+        from_obj="(select * from events) events",
+        name="myquery",
+        knowledge_date_column='event_date',
+        partition_interval="1year",
+        entity_index=True,
+        cluster=True,
+    )
+    from_obj.maybe_materialize(db_engine_with_events_table)
+    assert [row[0] for row in db_engine_with_events_table.execute(
+        f"select count(*) from {from_obj.table}"
+    )] == [len(events_data)]
+    assert table_exists("myquery_from_obj_p3", db_engine_with_events_table)
+    assert not table_exists("myquery_from_obj_load", db_engine_with_events_table)
+    assert from_obj.is_materialized(db_engine_with_events_table)
+
+
+def test_materialized_from_obj_reuse(db_engine_with_events_table):
+    def from_obj(**kwargs):
+        return FromObj(
+            from_obj="(select * from events) events",
+            name="myquery",
+            knowledge_date_column='event_date',
+            reuse=True,
+            **kwargs
+        )
+    from_obj().maybe_materialize(db_engine_with_events_table)
+    db_engine_with_events_table.execute("insert into myquery_from_obj values (5, '2016-01-01', true)")
+
+    # same from_obj and options, so the table (with the extra row) is kept
+    from_obj().maybe_materialize(db_engine_with_events_table)
+    assert db_engine_with_events_table.execute(
+        "select count(*) from myquery_from_obj"
+    ).scalar() == len(events_data) + 1
+
+    # different options, so the table is rebuilt
+    from_obj(entity_index=True).maybe_materialize(db_engine_with_events_table)
+    assert db_engine_with_events_table.execute(
+        "select count(*) from myquery_from_obj"
+    ).scalar() == len(events_data)
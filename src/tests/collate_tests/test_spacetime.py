@@ -327,3 +327,118 @@ def test_join_with_cohort_table(db_engine):
     assert rows[3]["date"] == date(2016, 1, 1)
     assert rows[3]["events_entity_id_all_outcome::int_sum"] == 1
     assert rows[3]["events_entity_id_all_outcome::int_avg"] == 0.5
+
+
+def _outcome_aggregation(**kwargs):
+    agg = Aggregate(
+        "outcome::int",
+        ["sum", "avg"],
+        {
+            "coltype": "aggregate",
+            "avg": {"type": "mean"},
+            "sum": {"type": "constant", "value": 3},
+        },
+    )
+    return SpacetimeAggregation(
+        aggregates=[agg],
+        from_obj="events",
+        groups=["entity_id"],
+        intervals=["1y", "2y", "all"],
+        dates=["2016-01-01", "2015-01-01"],
+        state_table="states",
+        state_group="entity_id",
+        date_column="event_date",
+        output_date_column="as_of_date",
+        **kwargs
+    )
+
+
+def test_single_scan_selects():
+    st = _outcome_aggregation(query_strategy="single_scan")
+    selects = st.get_selects()
+    assert list(selects.keys()) == ["entity_id"]
+    assert len(selects["entity_id"]) == 1
+
+    query = str(selects["entity_id"][0])
+    assert "('2016-01-01'::date), ('2015-01-01'::date)" in query
+    assert "event_date >= collate_as_of_date - interval '1y'" in query
+    assert "GROUP BY entity_id, collate_as_of_date" in query
+
+
+def test_rollup_intervals_selects():
+    st = _outcome_aggregation(rollup_intervals=True)
+    selects = st.get_selects()
+    assert len(selects["entity_id"]) == 2
+
+    query = str(selects["entity_id"][0])
+    assert "event_date >= '2016-01-01'::date - interval '1y' AS collate_in_0" in query
+    assert "event_date >= '2016-01-01'::date - interval '2y' AS collate_in_1" in query
+    assert "sum(outcome::int) AS collate_partial_0" in query
+    assert "count(outcome::int) AS collate_partial_1" in query
+    assert "GROUP BY entity_id, collate_in_0, collate_in_1" in query
+    assert [column.name for column in selects["entity_id"][0].columns] == [
+        column.name for column in _outcome_aggregation().get_selects()["entity_id"][0].columns
+    ]
+
+    with pytest.raises(ValueError):
+        SpacetimeAggregation(
+            aggregates=[Aggregate("outcome::int", "stddev", {})],
+            from_obj="events",
+            groups=["entity_id"],
+            intervals=["1y", "all"],
+            dates=["2016-01-01"],
+            state_table="states",
+            date_column="event_date",
+            rollup_intervals=True,
+        )
+
+
+def test_invalid_query_strategy():
+    with pytest.raises(ValueError):
+        _outcome_aggregation(query_strategy="bogus")
+
+    with pytest.raises(ValueError):
+        SpacetimeAggregation(
+            aggregates=[Aggregate("'{collate_date}'::date - event_date", "min", {})],
+            from_obj="events",
+            groups=["entity_id"],
+            intervals=["all"],
+            dates=["2016-01-01"],
+            state_table="states",
+            date_column="event_date",
+            query_strategy="single_scan",
+        )
+
+
+@pytest.mark.parametrize("join_with_cohort_table", [False, True])
+def test_query_variants_match(db_engine, join_with_cohort_table):
+    db_engine.execute(
+        "create table events (entity_id int, event_date date, outcome bool)"
+    )
+    for event in events_data:
+        db_engine.execute("insert into events values (%s, %s, %s::bool)", event)
+
+    db_engine.execute("create table states (entity_id int, as_of_date date)")
+    for state in state_data:
+        db_engine.execute("insert into states values (%s, %s)", state)
+
+    results = {}
+    for query_strategy, rollup_intervals in product(
+        ("per_date", "single_scan"), (False, True)
+    ):
+        st = _outcome_aggregation(
+            join_with_cohort_table=join_with_cohort_table,
+            query_strategy=query_strategy,
+            rollup_intervals=rollup_intervals,
+        )
+        st.execute(db_engine.connect())
+        results[query_strategy, rollup_intervals] = [
+            tuple(row)
+            for row in db_engine.execute(
+                "select * from events_aggregation_imputed order by entity_id, as_of_date"
+            )
+        ]
+
+    assert len(results["per_date", False]) == 8
+    for result in results.values():
+        assert result == results["per_date", False]
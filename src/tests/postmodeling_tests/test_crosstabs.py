@@ -1,4 +1,11 @@
-from triage.component.postmodeling.crosstabs import run_crosstabs
+import pandas as pd
+
+from triage.component.catwalk.storage import PredictionsStorageEngine
+from triage.component.postmodeling.crosstabs import (
+    CrosstabsConfigLoader,
+    _crosstabs_data_from_files,
+    run_crosstabs,
+)
 from triage.database_reflection import table_has_data
 
 
@@ -8,3 +15,63 @@ def test_run_crosstabs(finished_experiment, crosstabs_config):
         crosstabs_config.output["schema"] + "." + crosstabs_config.output["table"]
     )
     table_has_data(expected_table_name, finished_experiment.db_engine)
+
+
+def test_crosstabs_data_from_files(db_engine, project_storage):
+    predictions = pd.DataFrame({
+        "entity_id": [1, 2, 3, 1, 2, 3],
+        "as_of_date": pd.to_datetime(["2012-06-01"] * 3 + ["2012-07-01"] * 3),
+        "score": [0.9, 0.5, 0.1, 0.8, 0.4, 0.2],
+        "label_value": [1, 0, 0, 1, 1, 0],
+        "rank_abs_no_ties": [1, 2, 3, 1, 2, 3],
+        "rank_abs_with_ties": [1, 2, 3, 1, 2, 3],
+        "rank_pct_no_ties": [0.0, 0.5, 1.0, 0.0, 0.5, 1.0],
+        "rank_pct_with_ties": [0.0, 0.5, 1.0, 0.0, 0.5, 1.0],
+    })
+    predictions_path = PredictionsStorageEngine(project_storage).write(
+        predictions, "a_model_hash", "a_matrix_uuid"
+    )
+    db_engine.execute("create schema test_results")
+    db_engine.execute(
+        "create table test_results.prediction_metadata "
+        "(model_id int, matrix_uuid text, predictions_path text)"
+    )
+    db_engine.execute(
+        "insert into test_results.prediction_metadata values (%s, %s, %s)",
+        1, "a_matrix_uuid", predictions_path,
+    )
+    db_engine.execute(
+        "create table entity_features (entity_id int, as_of_date date, feature_one float)"
+    )
+    for entity_id, as_of_date, feature_one in [
+        (1, "2012-06-01", 10.0),
+        (2, "2012-06-01", 20.0),
+        (3, "2012-06-01", 30.0),
+        (1, "2012-07-01", 11.0),
+    ]:
+        db_engine.execute(
+            "insert into entity_features values (%s, %s, %s)",
+            entity_id, as_of_date, feature_one,
+        )
+    crosstabs_config = CrosstabsConfigLoader(config={
+        "predictions_from_files": True,
+        "entity_id_list": [1, 2],
+        "models_list_query": "select 1 as model_id",
+        "as_of_dates_query": "select '2012-06-01'::date as as_of_date",
+        "models_dates_join_query": """
+    select model_id, as_of_date
+    from models_list_query cross join as_of_dates_query""",
+        "features_query": """
+select m.model_id, f.*
+ from entity_features f join models_dates_join_query m using (as_of_date)""",
+    })
+
+    df = _crosstabs_data_from_files(db_engine, crosstabs_config)
+
+    # only the as_of_dates of the as_of_dates_query and the listed entities
+    assert df["as_of_date"].tolist() == [pd.Timestamp("2012-06-01")] * 2
+    assert df["entity_id"].tolist() == [1, 2]
+    assert df["model_id"].tolist() == [1, 1]
+    assert df["rank_abs"].tolist() == [1, 2]
+    assert df["rank_pct"].tolist() == [0.0, 50.0]
+    assert df["feature_one"].tolist() == [10.0, 20.0]
@@ -1,5 +1,6 @@
 from triage.component.postmodeling.contrast.model_evaluator import ModelEvaluator
 from triage.component.postmodeling.crosstabs import run_crosstabs
+from triage.component.catwalk.storage import PredictionsStorageEngine
 from tests.utils import sample_config, populate_source_data, assert_plot_figures_added
 from triage.experiments import SingleThreadedExperiment
 import pandas as pd
@@ -140,3 +141,67 @@ def test_ModelEvaluator_plot_feature_group_aggregate_importances(
         model_evaluator.plot_feature_group_aggregate_importances(
             path=shared_project_storage.project_path
         )
+
+
+def test_ModelEvaluator_predictions_from_files(project_storage):
+    predictions = pd.DataFrame({
+        "entity_id": [1, 2, 3],
+        "as_of_date": pd.to_datetime(["2012-06-01"] * 3),
+        "score": [0.9, 0.5, 0.1],
+        "label_value": [1, None, 0],
+        "rank_abs_no_ties": [1, 2, 3],
+        "rank_abs_with_ties": [1, 2, 3],
+        "rank_pct_no_ties": [0.0, 0.5, 1.0],
+        "rank_pct_with_ties": [0.0, 0.5, 1.0],
+    })
+    predictions_path = PredictionsStorageEngine(project_storage).write(
+        predictions, "a_model_hash", "a_matrix_uuid"
+    )
+    predictions_files = pd.DataFrame({
+        "predictions_path": [predictions_path],
+        "test_label_timespan": [pd.Timedelta(days=30)],
+    })
+
+    preds = ModelEvaluator(1, 1, None)._predictions_from_files(predictions_files)
+
+    # same columns as the predictions table query, without the null labels
+    assert list(preds.columns) == [
+        "model_id",
+        "entity_id",
+        "as_of_date",
+        "score",
+        "label_value",
+        "rank_abs",
+        "rank_pct",
+        "test_label_timespan",
+    ]
+    assert preds["entity_id"].tolist() == [1, 3]
+    assert preds["model_id"].tolist() == [1, 1]
+    assert preds["rank_abs"].tolist() == [1, 3]
+    assert preds["rank_pct"].tolist() == [0.0, 100.0]
+    assert preds["test_label_timespan"].tolist() == [pd.Timedelta(days=30)] * 2
+
+
+def test_ModelEvaluator_predictions_from_files_match_db(model_evaluator, project_storage):
+    db_predictions = pd.read_sql(
+        "select * from test_results.predictions "
+        f"where model_id = {model_evaluator.model_id}",
+        model_evaluator.engine,
+    )
+    predictions_path = PredictionsStorageEngine(project_storage).write(
+        db_predictions, "a_model_hash", "a_matrix_uuid"
+    )
+    predictions_files = pd.DataFrame({
+        "predictions_path": [predictions_path],
+        "test_label_timespan": model_evaluator.predictions["test_label_timespan"][:1],
+    })
+
+    sort_columns = ["entity_id", "as_of_date"]
+    from_files = model_evaluator._predictions_from_files(predictions_files)
+    from_db = model_evaluator.predictions
+    assert list(from_files.columns) == list(from_db.columns)
+    pd.testing.assert_frame_equal(
+        from_files.sort_values(sort_columns, ignore_index=True),
+        from_db.sort_values(sort_columns, ignore_index=True),
+        check_dtype=False,
+    )
@@ -205,6 +205,7 @@ class ExperimentRunFactory(factory.alchemy.SQLAlchemyModelFactory):
     matrices_made = 0
     matrices_skipped = 0
     matrices_errored = 0
+    matrices_reused = 0
     model_building_started = factory.fuzzy.FuzzyNaiveDateTime(datetime(2008, 1, 1))
     models_made = 0
     models_skipped = 0
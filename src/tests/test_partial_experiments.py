@@ -112,12 +112,16 @@ class PreimputationFeatures(TestCase):
     def test_run(self):
         with prepare_experiment(self.config) as experiment:
             experiment.run()
+            aggregation_tables = {
+                f"{experiment.features_schema_name}.{table[:-len('_imputed')]}"
+                for table in experiment.feature_generator.aggregation_hashes
+            }
             generated_tables = [
                 table
                 for table in schema_tables(
                     experiment.features_schema_name, experiment.db_engine
                 ).keys()
-                if "_aggregation" in table
+                if table in aggregation_tables
             ]
 
             assert len(generated_tables) == len(sample_config()["feature_aggregations"])
@@ -151,7 +155,7 @@ class PostimputationFeatures(TestCase):
                 for table in schema_tables(
                     experiment.features_schema_name, experiment.db_engine
                 ).keys()
-                if "_aggregation_imputed" in table
+                if table.endswith("_imputed")
             ]
 
             assert len(generated_tables) == len(sample_config()["feature_aggregations"])
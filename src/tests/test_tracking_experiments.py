@@ -49,6 +49,7 @@ def test_experiment_tracker(test_engine, project_path):
     assert experiment_run.start_method == "run"
     assert experiment_run.matrices_made == len(experiment.matrix_build_tasks)
     assert experiment_run.matrices_skipped == 0
+    assert experiment_run.matrices_reused == 0
     assert experiment_run.matrices_errored == 0
     assert experiment_run.models_skipped == 0
     assert experiment_run.models_errored == 0
@@ -1,4 +1,8 @@
-from triage.util.pandas import downcast_matrix
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from triage.util.pandas import downcast_matrix, densify_matrix, from_csr, to_csr
 from triage.component.catwalk.storage import MatrixStore
 from .utils import matrix_creator
 
@@ -12,3 +16,50 @@ def test_downcast_matrix():
 
     # make sure the memory usage is lower because there would be no point of this otherwise
     assert downcasted_df.memory_usage().sum() < df.memory_usage().sum()
+
+
+def test_downcast_matrix_dtypes():
+    df = pd.DataFrame({
+        "float": [0.5, 1.5, 2.5],
+        "already_float32": np.array([1, 2, 3], dtype=np.float32),
+        "flag": [0, 1, 1],
+        "negative": [-1, 0, 1],
+        "count": [0, 1000, 5],
+        "boolean": [True, False, True],
+    })
+    downcasted_df = downcast_matrix(df)
+
+    assert downcasted_df.dtypes.to_dict() == {
+        "float": np.float32,
+        "already_float32": np.float32,
+        "flag": np.uint8,
+        "negative": np.int8,
+        "count": np.float32,
+        "boolean": np.uint8,
+    }
+    assert (downcasted_df == df).all().all()
+    # popping a column of the result leaves the original as it was
+    already_downcasted_df = df[["already_float32"]]
+    downcast_matrix(already_downcasted_df).pop("already_float32")
+    assert "already_float32" in already_downcasted_df.columns
+
+
+def test_csr_round_trip():
+    df = pd.DataFrame(
+        {
+            "dense": np.array([0.5, 0.0, 0.25, 1.0], dtype=np.float32),
+            "sparse": pd.arrays.SparseArray(
+                np.array([0, 0, 1, 0], dtype=np.float32), fill_value=0
+            ),
+        },
+        index=pd.Index([10, 11, 12, 13], name="entity_id"),
+    )
+    csr = to_csr(df)
+    assert csr.shape == (4, 2)
+    assert csr.nnz == 4
+    assert csr.toarray().tolist() == [[0.5, 0], [0, 0], [0.25, 1], [1, 0]]
+
+    rebuilt = from_csr(csr, df.index, ["dense", "sparse"], np.array([False, True]))
+    assert rebuilt.columns.tolist() == ["dense", "sparse"]
+    assert rebuilt.dtypes["sparse"] == pd.SparseDtype(np.float32, 0)
+    assert_frame_equal(densify_matrix(rebuilt), densify_matrix(df))
@@ -1,10 +1,11 @@
+import pytest
 from sqlalchemy import create_engine
 import testing.postgresql
 
 from triage.component.catwalk.db import ensure_db
 
 from tests.utils import sample_config, populate_source_data
-from triage.experiments.validate import ExperimentValidator
+from triage.experiments.validate import ExperimentValidator, MatrixFormatValidator
 
 
 def test_experiment_validator():
@@ -13,3 +14,9 @@ def test_experiment_validator():
         ensure_db(db_engine)
         populate_source_data(db_engine)
         ExperimentValidator(db_engine).run(sample_config())
+
+
+def test_matrix_format_validator():
+    MatrixFormatValidator().run("parquet")
+    with pytest.raises(ValueError):
+        MatrixFormatValidator().run("hdf")
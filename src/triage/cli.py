@@ -14,7 +14,11 @@ from triage.component.architect.entity_date_table_generators import EntityDateTa
 from triage.component.audition import AuditionRunner
 from triage.component.results_schema import upgrade_db, stamp_db, db_history, downgrade_db
 from triage.component.timechop.plotting import visualize_chops
-from triage.component.catwalk.storage import CSVMatrixStore, Store, ProjectStorage
+from triage.component.catwalk.storage import (
+    MATRIX_STORAGE_CLASSES,
+    Store,
+    ProjectStorage,
+)
 from triage.experiments import (
     CONFIG_VERSION,
     MultiCoreExperiment,
@@ -152,10 +156,7 @@ class FeatureTest(Command):
 class Experiment(Command):
     """Run a full modeling experiment"""
 
-    matrix_storage_map = {
-        "csv": CSVMatrixStore,
-    }
-    matrix_storage_default = "csv"
+    matrix_storage_map = MATRIX_STORAGE_CLASSES
 
     def __init__(self, parser):
         parser.add_argument(
@@ -173,6 +174,30 @@ class Experiment(Command):
             default=1,
             help="number of concurrent database connections to use",
         )
+        parser.add_argument(
+            "--n-feature-workers",
+            type=natural_number,
+            default=1,
+            dest="n_feature_workers",
+            help="number of feature tables to extract concurrently, each over its own "
+            "database connection, when building a matrix",
+        )
+        parser.add_argument(
+            "--feature-memory-budget",
+            type=natural_number,
+            default=None,
+            dest="feature_memory_budget",
+            help="megabytes of feature data to extract concurrently when building a matrix; "
+            "only used with --n-feature-workers above 1 [default: no limit]",
+        )
+        parser.add_argument(
+            "--matrix-chunk-entities",
+            type=natural_number,
+            default=None,
+            dest="matrix_chunk_entities",
+            help="build and save each matrix this many entities at a time, to hold only "
+            "one chunk of it in memory [default: build matrices at once]",
+        )
         parser.add_argument(
             "--n-processes",
             type=natural_number,
@@ -182,8 +207,9 @@ class Experiment(Command):
         parser.add_argument(
             "--matrix-format",
             choices=self.matrix_storage_map.keys(),
-            default=self.matrix_storage_default,
-            help=f"The matrix storage format to use. [default: {self.matrix_storage_default}]"
+            default=None,
+            help="The matrix storage format to use, overriding the matrix_format "
+                 "of the experiment config. [default: the config's, or csv]"
         )
         parser.add_argument("--replace", dest="replace", action="store_true")
         parser.add_argument(
@@ -233,6 +259,33 @@ class Experiment(Command):
             help="Skip saving predictions to the database to save time",
         )
 
+        parser.add_argument(
+            "--save-predictions-to-file",
+            action="store_true",
+            default=False,
+            dest="save_predictions_to_file",
+            help="Save predictions to files in the project path, with only a pointer "
+            "to each file in the database, instead of the predictions tables [default: False]",
+        )
+
+        parser.add_argument(
+            "--cache-feature-blocks",
+            action="store_true",
+            default=False,
+            dest="cache_feature_blocks",
+            help="Extract each (feature table, as-of-date) block shared by several matrices "
+            "once, into a local temporary cache, instead of once per matrix [default: False]",
+        )
+
+        parser.add_argument(
+            "--extend-matrices",
+            action="store_true",
+            default=False,
+            dest="extend_matrices",
+            help="Build a train matrix that only adds as-of-dates to a stored train matrix "
+            "from that matrix's rows plus the new as-of-dates [default: False]",
+        )
+
         parser.add_argument(
             "--features-ignore-cohort",
             action="store_true",
@@ -269,9 +322,15 @@ class Experiment(Command):
             "replace": self.args.replace,
             "materialize_subquery_fromobjs": self.args.materialize_fromobjs,
             "features_ignore_cohort": self.args.features_ignore_cohort,
-            "matrix_storage_class": self.matrix_storage_map[self.args.matrix_format],
+            "matrix_storage_class": self.matrix_storage_map.get(self.args.matrix_format),
             "profile": self.args.profile,
             "save_predictions": self.args.save_predictions,
+            "save_predictions_to_file": self.args.save_predictions_to_file,
+            "n_feature_workers": self.args.n_feature_workers,
+            "feature_memory_budget": self.args.feature_memory_budget,
+            "cache_feature_blocks": self.args.cache_feature_blocks,
+            "extend_matrices": self.args.extend_matrices,
+            "matrix_chunk_entities": self.args.matrix_chunk_entities,
             "skip_validation": not self.args.validate
         }
         logger.info(f"Setting up the experiment")
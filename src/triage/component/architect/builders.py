@@ -1,17 +1,117 @@
-import io
 import json
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+import numpy as np
 import pandas as pd
+from ohio import PipeTextIO
 
 from sqlalchemy.orm import sessionmaker
 
+from triage.component.catwalk.utils import filename_friendly_hash
 from triage.component.results_schema import Matrix
 from triage.database_reflection import table_has_data
-from triage.tracking import built_matrix, skipped_matrix, errored_matrix
-from triage.util.pandas import downcast_matrix
+from triage.tracking import built_matrix, skipped_matrix, errored_matrix, reused_matrix
+
+
+MATRIX_INDICES = ["entity_id", "as_of_date"]
+
+ENTITY_DATE_TABLE_PREFIX = "entity_dates_"
+
+# matrix metadata that may differ between a train matrix and a stored matrix
+# it extends: its temporal extent and shape, but not what each row holds
+EXTENSIBLE_METADATA_KEYS = {
+    "matrix_id",
+    "end_time",
+    "matrix_info_end_time",
+    "first_as_of_time",
+    "last_as_of_time",
+    "as_of_times",
+    "max_training_history",
+    "columns",
+    "as_of_dates",
+    "num_observations",
+    "num_entities",
+    "content_hash",
+}
+
+# matrix metadata that, with its as-of-dates, features and source tables,
+# determines what a matrix holds
+CONTENT_METADATA_KEYS = (
+    "indices",
+    "label_name",
+    "label_type",
+    "label_timespan",
+    "state",
+    "matrix_type",
+    "feature_start_time",
+)
+
+
+def read_matrix_csv(file_like, num_rows=None, chunksize=10000):
+    """Read CSV rows of entity_id, as_of_date and numeric columns into a float32
+    dataframe indexed by entity_id and as_of_date
+
+    The CSV is parsed chunksize rows at a time, so neither its whole text nor a
+    float64 copy of its values is ever held in memory. If the number of rows is
+    known up front, each chunk is written straight into preallocated arrays and
+    the peak memory stays close to the size of the returned dataframe.
+
+    :param file_like: a readable text stream with a header row
+    :param num_rows: the number of rows in the CSV, if known
+    :param chunksize: the number of rows to parse at a time
+    :type num_rows: int
+    :type chunksize: int
+
+    :return: the parsed data
+    :rtype: pandas.DataFrame
+    """
+    chunks = pd.read_csv(file_like, parse_dates=["as_of_date"], chunksize=chunksize)
+    entity_ids, as_of_dates, values = [], [], []
+    columns = None
+    filled = 0
+    for chunk in chunks:
+        if columns is None:
+            columns = [column for column in chunk.columns if column not in MATRIX_INDICES]
+            if num_rows is not None:
+                entity_ids = np.empty(num_rows, dtype="int64")
+                as_of_dates = np.empty(num_rows, dtype="datetime64[ns]")
+                values = np.empty((num_rows, len(columns)), dtype=np.float32)
+        chunk_values = chunk[columns].to_numpy(dtype=np.float32)
+        if num_rows is None:
+            entity_ids.append(chunk["entity_id"].to_numpy(dtype="int64"))
+            as_of_dates.append(chunk["as_of_date"].to_numpy(dtype="datetime64[ns]"))
+            values.append(chunk_values)
+        else:
+            end = filled + len(chunk)
+            if end > num_rows:
+                raise ValueError(
+                    f"Query returned more than the expected {num_rows} rows, "
+                    "are there duplicate entity-dates?"
+                )
+            entity_ids[filled:end] = chunk["entity_id"]
+            as_of_dates[filled:end] = chunk["as_of_date"]
+            values[filled:end] = chunk_values
+        filled += len(chunk)
+
+    if columns is None:
+        # no chunk at all: not even a header was returned
+        return pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=MATRIX_INDICES))
+    if num_rows is None:
+        entity_ids = np.concatenate(entity_ids)
+        as_of_dates = np.concatenate(as_of_dates)
+        values = np.concatenate(values)
+    else:
+        entity_ids, as_of_dates, values = entity_ids[:filled], as_of_dates[:filled], values[:filled]
+    return pd.DataFrame(
+        values,
+        index=pd.MultiIndex.from_arrays([entity_ids, as_of_dates], names=MATRIX_INDICES),
+        columns=columns,
+    )
 
 
 class BuilderBase:
@@ -24,7 +124,15 @@ class BuilderBase:
         replace=True,
         include_missing_labels_in_train_as=None,
         run_id=None,
+        n_feature_workers=1,
+        feature_memory_budget=None,
+        feature_block_cache=None,
+        extend_matrices=False,
+        matrix_chunk_entities=None,
+        feature_table_hashes=None,
     ):
+        if n_feature_workers < 1:
+            raise ValueError("n_feature_workers must be 1 or greater")
         self.db_config = db_config
         self.matrix_storage_engine = matrix_storage_engine
         self.db_engine = engine
@@ -32,6 +140,17 @@ class BuilderBase:
         self.replace = replace
         self.include_missing_labels_in_train_as = include_missing_labels_in_train_as
         self.run_id = run_id
+        # scopes the entity-date tables to this run, so that other runs of the
+        # same experiment never drop the tables it is reading from
+        self.build_id = f"r{run_id}" if run_id is not None else uuid.uuid4().hex[:8]
+        self.n_feature_workers = n_feature_workers
+        self.feature_memory_budget = feature_memory_budget
+        self.feature_block_cache = feature_block_cache
+        self.extend_matrices = extend_matrices
+        self.matrix_chunk_entities = matrix_chunk_entities
+        # feature table name -> hash of the feature aggregation config it was
+        # built from; the dict is filled in as the aggregations are created
+        self.feature_table_hashes = {} if feature_table_hashes is None else feature_table_hashes
 
     @property
     def sessionmaker(self):
@@ -146,20 +265,64 @@ class BuilderBase:
         else:
             raise ValueError(f"Unknown matrix type passed: {matrix_type}")
 
-        table_name = "_".join([matrix_uuid, "matrix_entity_date"])
-        query = f"""
-            DROP TABLE IF EXISTS {self.db_config["features_schema_name"]}."{table_name}";
-            CREATE TABLE {self.db_config["features_schema_name"]}."{table_name}"
-            AS ({indices_query})
-        """
+        table_name = self._entity_date_table_name(indices_query)
+        qualified_table_name = f'{self.db_config["features_schema_name"]}."{table_name}"'
         logger.debug(
-            f"Creating matrix-specific entity-date table for matrix {matrix_uuid} ",
+            f"Making entity-date table {table_name} for matrix {matrix_uuid} if not made yet",
         )
-        logger.spam(f"with query {query}")
-        self.db_engine.execute(query)
+        logger.spam(f"with query {indices_query}")
+        with self.db_engine.begin() as connection:
+            # matrices built concurrently may need the same table: whoever
+            # gets the lock first creates it, and the others then find it there
+            connection.execute(
+                f"SELECT pg_advisory_xact_lock(hashtext('{qualified_table_name}'))"
+            )
+            if connection.execute(f"SELECT to_regclass('{qualified_table_name}')").scalar() is None:
+                connection.execute(f"""
+                    CREATE TABLE {qualified_table_name} AS ({indices_query});
+                    CREATE INDEX ON {qualified_table_name} (entity_id, as_of_date);
+                    ANALYZE {qualified_table_name};
+                """)
+            else:
+                logger.debug(f"Reusing entity-date table {table_name}")
 
         return table_name
 
+    def _entity_date_table_name(self, indices_query):
+        """The name of the entity-date table defined by a query
+
+        Matrices with the same cohort state, as-of-times and label filter share the
+        table. Its name starts with the experiment hash and the build id (the run
+        id, if any), so that a run only uses (and drops, see
+        drop_entity_date_tables) its own tables, even while another run of the
+        same experiment is building matrices.
+        """
+        return "".join([
+            self._entity_date_table_prefix,
+            filename_friendly_hash(indices_query)[:24],
+        ])
+
+    @property
+    def _entity_date_table_prefix(self):
+        return f"{ENTITY_DATE_TABLE_PREFIX}{(self.experiment_hash or 'none')[:12]}_{self.build_id}_"
+
+    def drop_entity_date_tables(self):
+        """Drop the entity-date tables made for this run's matrices"""
+        features_schema_name = self.db_config["features_schema_name"]
+        table_prefix = self._entity_date_table_prefix
+        table_names = [
+            row[0]
+            for row in self.db_engine.execute(f"""
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = '{features_schema_name}'
+                AND left(table_name, {len(table_prefix)}) = '{table_prefix}'
+            """)
+        ]
+        for table_name in table_names:
+            self.db_engine.execute(f'DROP TABLE IF EXISTS {features_schema_name}."{table_name}"')
+        if table_names:
+            logger.debug(f"Dropped {len(table_names)} entity-date tables")
+
     def _all_labeled_entity_dates_query(
         self, as_of_time_strings, state, label_name, label_type, label_timespan
     ):
@@ -248,33 +411,259 @@ class MatrixBuilder(BuilderBase):
                 skipped_matrix(self.run_id, self.db_engine)
             return
 
+        matrix_metadata = dict(
+            matrix_metadata,
+            content_hash=self.matrix_content_hash(
+                as_of_times, feature_dictionary, matrix_metadata, matrix_type
+            ),
+        )
+        if not self.replace:
+            source_store = self._find_matrix_with_content(
+                matrix_uuid, matrix_metadata["content_hash"]
+            )
+            if source_store is not None:
+                logger.notice(
+                    f"Reusing stored matrix {source_store.uuid} for {matrix_uuid} "
+                    "because their content is the same"
+                )
+                matrix_store.metadata = matrix_metadata
+                matrix_store.copy_from(source_store)
+                self._save_matrix_row(matrix_store, matrix_metadata, matrix_type, feature_dictionary)
+                if self.run_id:
+                    reused_matrix(self.run_id, self.db_engine)
+                return
+
         logger.debug(
             f'Storing matrix {matrix_metadata["matrix_id"]} in {matrix_store.matrix_base_store.path}'
         )
-        # make the entity time table and query the labels and features tables
-        logger.debug(f"Making entity date table for matrix {matrix_uuid}")
-        try:
-            entity_date_table_name = self.make_entity_date_table(
-                as_of_times,
+        # with extend_matrices, reuse the rows of a stored train matrix that only
+        # differs by its as-of-dates, and only extract the as-of-dates it lacks
+        base_store, reused_as_of_times = None, []
+        if self.extend_matrices and matrix_type == "train":
+            base_store, reused_as_of_times = self._find_base_matrix(
+                matrix_uuid, matrix_metadata, as_of_times, feature_dictionary
+            )
+        as_of_times_to_build = [
+            as_of_time for as_of_time in as_of_times
+            if pd.Timestamp(as_of_time) not in set(map(pd.Timestamp, reused_as_of_times))
+        ]
+
+        entity_date_table_name = None
+        if as_of_times_to_build:
+            # make the entity time table and query the labels and features tables
+            logger.debug(f"Making entity date table for matrix {matrix_uuid}")
+            try:
+                entity_date_table_name = self.make_entity_date_table(
+                    as_of_times_to_build,
+                    label_name,
+                    label_type,
+                    matrix_metadata["state"],
+                    matrix_type,
+                    matrix_uuid,
+                    matrix_metadata["label_timespan"],
+                )
+            except ValueError as e:
+                logger.exception(
+                    "Not able to build entity-date table,  will not build matrix",
+                )
+                if self.run_id:
+                    errored_matrix(self.run_id, self.db_engine)
+                return
+
+        if entity_date_table_name is not None and self.matrix_chunk_entities and base_store is None:
+            self._build_matrix_in_chunks(
+                matrix_store,
+                matrix_metadata,
+                entity_date_table_name,
+                as_of_times_to_build,
+                feature_dictionary,
                 label_name,
                 label_type,
-                matrix_metadata["state"],
-                matrix_type,
                 matrix_uuid,
-                matrix_metadata["label_timespan"],
-            )
-        except ValueError as e:
-            logger.exception(
-                "Not able to build entity-date table,  will not build matrix",
             )
-            if self.run_id:
-                errored_matrix(self.run_id, self.db_engine)
-            return
+        else:
+            output = None
+            if entity_date_table_name is not None:
+                output = self._extract_matrix(
+                    entity_date_table_name,
+                    as_of_times_to_build,
+                    feature_dictionary,
+                    label_name,
+                    label_type,
+                    matrix_metadata["label_timespan"],
+                    matrix_uuid,
+                )
+            if base_store is not None:
+                output = self._extend_matrix(
+                    base_store, reused_as_of_times, output, matrix_metadata["label_name"]
+                )
+
+            # store the matrix, recording its shape so that the columns, as-of-dates and
+            # sizes can later be read without loading the matrix itself
+            labels = output.pop(matrix_metadata["label_name"])
+            matrix_store.metadata = dict(matrix_metadata, **matrix_store.shape_metadata(output))
+            matrix_store.matrix_label_tuple = output, labels
+            matrix_store.save()
+        logger.info(f"Matrix {matrix_uuid} saved in {matrix_store.matrix_base_store.path}")
+        self._save_matrix_row(matrix_store, matrix_metadata, matrix_type, feature_dictionary)
+        if self.run_id:
+            built_matrix(self.run_id, self.db_engine)
+
+    def _save_matrix_row(self, matrix_store, matrix_metadata, matrix_type, feature_dictionary):
+        """Save the information of a stored matrix to the matrices table
+
+        :param matrix_store: the store of the matrix
+        :param matrix_metadata: the metadata of the matrix
+        :param matrix_type: the type (train/test) of matrix
+        :param feature_dictionary: the feature tables and features of the matrix
+        :type matrix_store: triage.component.catwalk.storage.MatrixStore
+        :type matrix_metadata: dict
+        :type matrix_type: str
+        :type feature_dictionary: dict
+        """
+        # If completely archived, save its information to matrices table
+        # At this point, existence of matrix already tested, so no need to delete from db
+        if matrix_type == "train":
+            lookback = matrix_metadata["max_training_history"]
+        else:
+            lookback = matrix_metadata["test_duration"]
+
+        matrix = Matrix(
+            matrix_id=matrix_metadata["matrix_id"],
+            matrix_uuid=matrix_store.uuid,
+            matrix_type=matrix_type,
+            labeling_window=matrix_metadata["label_timespan"],
+            num_observations=matrix_store.metadata["num_observations"],
+            lookback_duration=lookback,
+            feature_start_time=matrix_metadata["feature_start_time"],
+            feature_dictionary=feature_dictionary,
+            matrix_metadata=matrix_metadata,
+            built_by_experiment=self.experiment_hash
+        )
+        session = self.sessionmaker()
+        session.merge(matrix)
+        session.commit()
+        session.close()
+
+    def matrix_content_hash(self, as_of_times, feature_dictionary, matrix_metadata, matrix_type):
+        """Hash the inputs that determine what a matrix holds
+
+        Unlike the matrix uuid, which hashes all of the matrix metadata, this leaves
+        out what doesn't change the data (e.g. user metadata, feature group names or
+        the matrix id), so matrices planned by different experiments from the same
+        cohort, labels and features share it. Feature tables are identified by
+        the hash of the feature aggregation config they were built from, where
+        known, so a table rebuilt from another config changes it. As when
+        skipping an existing matrix, the tables it is built from are otherwise
+        assumed unchanged since it was stored.
+
+        :param as_of_times: datetimes to be included in the matrix
+        :param feature_dictionary: the feature tables and features of the matrix
+        :param matrix_metadata: the metadata of the matrix
+        :param matrix_type: the type (train/test) of matrix
+        :type as_of_times: list
+        :type feature_dictionary: dict
+        :type matrix_metadata: dict
+        :type matrix_type: str
+
+        :return: the content hash
+        :rtype: str
+        """
+        return filename_friendly_hash({
+            "as_of_times": sorted(pd.Timestamp(as_of_time).isoformat() for as_of_time in as_of_times),
+            "features": [
+                [
+                    feature_table_name,
+                    self.feature_table_hashes.get(feature_table_name),
+                    list(feature_names),
+                ]
+                for feature_table_name, feature_names in feature_dictionary.items()
+            ],
+            "metadata": {key: matrix_metadata.get(key) for key in CONTENT_METADATA_KEYS},
+            "matrix_type": matrix_type,
+            "cohort_table_name": self.db_config["cohort_table_name"],
+            "labels_table_name": self.db_config["labels_table_name"],
+            "labels_schema_name": self.db_config["labels_schema_name"],
+            "features_schema_name": self.db_config["features_schema_name"],
+            "include_missing_labels_in_train_as": (
+                self.include_missing_labels_in_train_as if matrix_type == "train" else None
+            ),
+        })
+
+    def _find_matrix_with_content(self, matrix_uuid, content_hash):
+        """Find a stored matrix, other than this one, with the given content hash
+
+        :param matrix_uuid: the uuid of the matrix to build
+        :param content_hash: its content hash (see matrix_content_hash)
+        :type matrix_uuid: str
+        :type content_hash: str
+
+        :return: the store of a matrix with the same content, or None
+        :rtype: triage.component.catwalk.storage.MatrixStore
+        """
+        session = self.sessionmaker()
+        try:
+            candidate_uuids = [
+                row.matrix_uuid
+                for row in session.query(Matrix.matrix_uuid).filter(
+                    Matrix.matrix_uuid != matrix_uuid,
+                    Matrix.matrix_metadata["content_hash"].astext == content_hash,
+                )
+            ]
+        finally:
+            session.close()
+        for candidate_uuid in candidate_uuids:
+            candidate_store = self.matrix_storage_engine.get_store(candidate_uuid)
+            if candidate_store.exists:
+                return candidate_store
+        return None
+
+
+    def _extract_matrix(
+        self,
+        entity_date_table_name,
+        as_of_times,
+        feature_dictionary,
+        label_name,
+        label_type,
+        label_timespan,
+        matrix_uuid,
+        entity_id_range=None,
+    ):
+        """Extract the labels and features of an entity-date table and merge them
+
+        :param entity_date_table_name: the name of the entity date table
+        :param as_of_times: the times included in the entity date table
+        :param feature_dictionary: the feature tables and features of the matrix
+        :param label_name: name of the label to be used
+        :param label_type: the type of label to be used
+        :param label_timespan: the timespan of the labels
+        :param matrix_uuid: a unique id for the matrix
+        :param entity_id_range: the first entity id and the one after the last
+            (None if unbounded) that the entity date table holds, if restricted
+        :type entity_date_table_name: str
+        :type as_of_times: list
+        :type feature_dictionary: dict
+        :type label_name: str
+        :type label_type: str
+        :type label_timespan: str
+        :type matrix_uuid: str
+        :type entity_id_range: tuple
+
+        :return: the merged matrix, with the label as its last column
+        :rtype: pandas.DataFrame
+        """
+        num_rows = self._count_entity_dates(entity_date_table_name)
         logger.spam(
             f"Extracting feature group data from database into file  for matrix {matrix_uuid}"
         )
         dataframes = self.load_features_data(
-            as_of_times, feature_dictionary, entity_date_table_name, matrix_uuid
+            as_of_times,
+            feature_dictionary,
+            entity_date_table_name,
+            matrix_uuid,
+            num_rows=num_rows,
+            entity_id_range=entity_id_range,
         )
         logger.debug(f"Feature data extracted for matrix {matrix_uuid}")
         logger.spam(
@@ -285,7 +674,9 @@ class MatrixBuilder(BuilderBase):
             label_type,
             entity_date_table_name,
             matrix_uuid,
-            matrix_metadata["label_timespan"],
+            label_timespan,
+            num_rows=num_rows,
+            entity_id_range=entity_id_range,
         )
         dataframes.insert(0, labels_df)
 
@@ -294,39 +685,238 @@ class MatrixBuilder(BuilderBase):
         logger.spam(f"Merging feature files for matrix {matrix_uuid}")
         output = self.merge_feature_csvs(dataframes, matrix_uuid)
         logger.debug(f"Features data merged for matrix {matrix_uuid}")
+        return output
 
-        matrix_store.metadata = matrix_metadata
-        # store the matrix
-        labels = output.pop(matrix_store.label_column_name)
-        matrix_store.matrix_label_tuple = output, labels
-        matrix_store.save()
-        logger.info(f"Matrix {matrix_uuid} saved in {matrix_store.matrix_base_store.path}")
-        # If completely archived, save its information to matrices table
-        # At this point, existence of matrix already tested, so no need to delete from db
-        if matrix_type == "train":
-            lookback = matrix_metadata["max_training_history"]
-        else:
-            lookback = matrix_metadata["test_duration"]
+    def _build_matrix_in_chunks(
+        self,
+        matrix_store,
+        matrix_metadata,
+        entity_date_table_name,
+        as_of_times,
+        feature_dictionary,
+        label_name,
+        label_type,
+        matrix_uuid,
+    ):
+        """Build and save a matrix matrix_chunk_entities entities at a time
 
-        matrix = Matrix(
-            matrix_id=matrix_metadata["matrix_id"],
-            matrix_uuid=matrix_uuid,
-            matrix_type=matrix_type,
-            labeling_window=matrix_metadata["label_timespan"],
-            num_observations=len(output),
-            lookback_duration=lookback,
-            feature_start_time=matrix_metadata["feature_start_time"],
-            feature_dictionary=feature_dictionary,
-            matrix_metadata=matrix_metadata,
-            built_by_experiment=self.experiment_hash
+        Each chunk of entities gets its own entity date table, which its labels
+        and features are extracted against, and is written to the matrix store
+        before the next one is extracted, so only one chunk is held in memory.
+
+        :param matrix_store: the store to save the matrix in
+        :param matrix_metadata: the metadata of the matrix
+        :param entity_date_table_name: the name of the entity date table
+        :param as_of_times: the times included in the entity date table
+        :param feature_dictionary: the feature tables and features of the matrix
+        :param label_name: name of the label to be used
+        :param label_type: the type of label to be used
+        :param matrix_uuid: a unique id for the matrix
+        :type matrix_store: triage.component.catwalk.storage.MatrixStore
+        :type matrix_metadata: dict
+        :type entity_date_table_name: str
+        :type as_of_times: list
+        :type feature_dictionary: dict
+        :type label_name: str
+        :type label_type: str
+        :type matrix_uuid: str
+        """
+        features_schema_name = self.db_config["features_schema_name"]
+        # the entity date table may be shared by matrices built concurrently, its chunks aren't
+        chunk_table_name = f"{matrix_uuid}_entity_date_chunk"
+        entity_id_ranges = self._entity_id_ranges(entity_date_table_name)
+        logger.debug(
+            f"Building matrix {matrix_uuid} in {len(entity_id_ranges)} chunks "
+            f"of up to {self.matrix_chunk_entities} entities"
         )
+        shape_metadata = None
+        matrix_store.metadata = matrix_metadata
+        try:
+            with matrix_store.chunk_writer(
+                num_rows=self._count_entity_dates(entity_date_table_name)
+            ) as write_chunk:
+                for i, entity_id_range in enumerate(entity_id_ranges, start=1):
+                    logger.spam(f"Building chunk {i}/{len(entity_id_ranges)} of matrix {matrix_uuid}")
+                    self.db_engine.execute(f"""
+                        DROP TABLE IF EXISTS {features_schema_name}."{chunk_table_name}";
+                        CREATE TABLE {features_schema_name}."{chunk_table_name}" AS (
+                            SELECT * FROM {features_schema_name}."{entity_date_table_name}" ed
+                            WHERE {self._entity_id_range_condition("ed", entity_id_range) or "true"}
+                        )
+                    """)
+                    output = self._extract_matrix(
+                        chunk_table_name,
+                        as_of_times,
+                        feature_dictionary,
+                        label_name,
+                        label_type,
+                        matrix_metadata["label_timespan"],
+                        matrix_uuid,
+                        entity_id_range=entity_id_range,
+                    )
+                    labels = output.pop(matrix_metadata["label_name"])
+                    chunk_shape = matrix_store.shape_metadata(output)
+                    if shape_metadata is None:
+                        shape_metadata = chunk_shape
+                    else:
+                        # chunks hold disjoint entities, so their counts add up
+                        shape_metadata = dict(
+                            shape_metadata,
+                            as_of_dates=sorted(
+                                set(shape_metadata["as_of_dates"]) | set(chunk_shape["as_of_dates"])
+                            ),
+                            num_observations=shape_metadata["num_observations"]
+                            + chunk_shape["num_observations"],
+                            num_entities=shape_metadata["num_entities"]
+                            + chunk_shape["num_entities"],
+                        )
+                    write_chunk(output, labels)
+                    del output, labels
+                matrix_store.metadata = dict(matrix_metadata, **shape_metadata)
+        finally:
+            self.db_engine.execute(
+                f'DROP TABLE IF EXISTS {features_schema_name}."{chunk_table_name}"'
+            )
+
+    def _entity_id_ranges(self, entity_date_table_name):
+        """Split the entities of an entity date table into ranges of
+        matrix_chunk_entities entities
+
+        :return: (first entity id, first entity id of the next range or None)
+            tuples; a single unbounded range if the table is empty
+        :rtype: list
+        """
+        range_starts = [
+            row[0]
+            for row in self.db_engine.execute(f"""
+                SELECT entity_id
+                FROM (
+                    SELECT entity_id, row_number() OVER (ORDER BY entity_id) AS entity_number
+                    FROM (
+                        SELECT DISTINCT entity_id
+                        FROM {self.db_config["features_schema_name"]}."{entity_date_table_name}"
+                    ) entities
+                ) numbered_entities
+                WHERE (entity_number - 1) % {int(self.matrix_chunk_entities)} = 0
+                ORDER BY entity_id
+            """)
+        ]
+        if not range_starts:
+            return [(None, None)]
+        return list(zip(range_starts, range_starts[1:] + [None]))
+
+    @classmethod
+    def _entity_id_range_condition_clause(cls, entity_id_range):
+        """The entity id range condition of the right table of an outer join
+        query, to add to its join conditions; restricting the feature or
+        labels table as well as the entity date table lets an index on
+        entity_id be used"""
+        condition = cls._entity_id_range_condition("r", entity_id_range)
+        return f"AND {condition}" if condition else ""
+
+    @staticmethod
+    def _entity_id_range_condition(alias, entity_id_range):
+        """SQL restricting the entity ids of a table alias to a range, or an
+        empty string if there is no range"""
+        if entity_id_range is None:
+            return ""
+        first, after_last = entity_id_range
+        conditions = []
+        if first is not None:
+            conditions.append(f"{alias}.entity_id >= {int(first)}")
+        if after_last is not None:
+            conditions.append(f"{alias}.entity_id < {int(after_last)}")
+        return " AND ".join(conditions)
+
+    def _find_base_matrix(self, matrix_uuid, matrix_metadata, as_of_times, feature_dictionary):
+        """Find a stored train matrix whose rows can be reused for this one
+
+        A stored matrix can be extended if all of its metadata but its temporal
+        extent and shape (see EXTENSIBLE_METADATA_KEYS) is the same as this
+        matrix's, and its features are in the same order. This assumes that the
+        labels and features of the as-of-dates they share haven't changed since
+        it was built. Of those, the one sharing the most as-of-dates is picked.
+
+        :param matrix_uuid: the uuid of the matrix to build
+        :param matrix_metadata: the metadata of the matrix to build
+        :param as_of_times: the as-of-dates of the matrix to build
+        :param feature_dictionary: the feature tables and features of the matrix
+        :type matrix_uuid: str
+        :type matrix_metadata: dict
+        :type as_of_times: list
+        :type feature_dictionary: dict
+
+        :return: the store of the matrix to extend and the as-of-dates to reuse
+            from it, or None and no as-of-dates
+        :rtype: tuple
+        """
+        columns = [
+            feature_name
+            for feature_names in feature_dictionary.values()
+            for feature_name in feature_names
+        ]
+        as_of_times = set(map(pd.Timestamp, as_of_times))
         session = self.sessionmaker()
-        session.merge(matrix)
-        session.commit()
-        session.close()
-        if self.run_id:
-            built_matrix(self.run_id, self.db_engine)
+        try:
+            candidate_uuids = [
+                row.matrix_uuid
+                for row in session.query(Matrix.matrix_uuid).filter(
+                    Matrix.matrix_type == "train",
+                    Matrix.matrix_uuid != matrix_uuid,
+                    Matrix.matrix_metadata["label_name"].astext == matrix_metadata["label_name"],
+                    Matrix.matrix_metadata["label_timespan"].astext
+                    == matrix_metadata["label_timespan"],
+                )
+            ]
+        finally:
+            session.close()
+
+        base_store, reused_as_of_times = None, []
+        for candidate_uuid in candidate_uuids:
+            candidate_store = self.matrix_storage_engine.get_store(candidate_uuid)
+            if not candidate_store.exists:
+                continue
+            candidate_metadata = candidate_store.metadata
+            if candidate_metadata.get("columns") != columns or any(
+                candidate_metadata.get(key) != matrix_metadata.get(key)
+                for key in set(candidate_metadata) | set(matrix_metadata)
+                if key not in EXTENSIBLE_METADATA_KEYS
+            ):
+                continue
+            candidate_as_of_times = candidate_metadata.get("as_of_times") or candidate_store.as_of_dates
+            shared_as_of_times = sorted(as_of_times & set(map(pd.Timestamp, candidate_as_of_times)))
+            if len(shared_as_of_times) > len(reused_as_of_times):
+                base_store, reused_as_of_times = candidate_store, shared_as_of_times
 
+        if base_store is not None:
+            logger.notice(
+                f"Matrix {matrix_uuid} extends stored matrix {base_store.uuid}: reusing "
+                f"{len(reused_as_of_times)} of its {len(as_of_times)} as-of-dates"
+            )
+        return base_store, reused_as_of_times
+
+    def _extend_matrix(self, base_store, reused_as_of_times, output, label_name):
+        """Combine the reused rows of a stored matrix with the newly built ones
+
+        :param base_store: the store of the matrix being extended
+        :param reused_as_of_times: the as-of-dates to take from it
+        :param output: the merged matrix of the other as-of-dates, if any
+        :param label_name: the name of the label column
+        :type base_store: triage.component.catwalk.storage.MatrixStore
+        :type reused_as_of_times: list
+        :type output: pandas.DataFrame
+        :type label_name: str
+
+        :return: the matrix with the label as its last column, sorted by
+            entity_id and as_of_date as a matrix built at once would be
+        :rtype: pandas.DataFrame
+        """
+        design_matrix, labels = base_store.load_subset(as_of_dates=reused_as_of_times)
+        reused = design_matrix.assign(**{label_name: labels})
+        if output is None:
+            return reused
+        reused = reused.astype(output.dtypes.to_dict())
+        return pd.concat([reused, output]).sort_index()
 
     def load_labels_data(
         self,
@@ -335,6 +925,8 @@ class MatrixBuilder(BuilderBase):
         entity_date_table_name,
         matrix_uuid,
         label_timespan,
+        num_rows=None,
+        entity_id_range=None,
     ):
         """ Query the labels table and write the data to disk in csv format.
 
@@ -344,11 +936,16 @@ class MatrixBuilder(BuilderBase):
         :param entity_date_table_name: the name of the entity date table
         :param matrix_uuid: a unique id for the matrix
         :param label_timespan: the time timespan that labels in matrix will include
+        :param num_rows: the number of rows in the entity date table, if known
+        :param entity_id_range: the first entity id and the one after the last
+            (None if unbounded) that the entity date table holds, if restricted
         :type label_name: str
         :type label_type: str
         :type entity_date_table_name: str
         :type matrix_uuid: str
         :type label_timespan: str
+        :type num_rows: int
+        :type entity_id_range: tuple
 
         :return: name of csv containing labels
         :rtype: str
@@ -372,17 +969,26 @@ class MatrixBuilder(BuilderBase):
                 r.label_name = '{label_name}' AND
                 r.label_type = '{label_type}' AND
                 r.label_timespan = '{label_timespan}'
+                {self._entity_id_range_condition_clause(entity_id_range)}
             """
         )
 
-        return self.query_to_df(labels_query)
+        return self.query_to_df(labels_query, num_rows=num_rows)
 
     def load_features_data(
-        self, as_of_times, feature_dictionary, entity_date_table_name, matrix_uuid
+        self,
+        as_of_times,
+        feature_dictionary,
+        entity_date_table_name,
+        matrix_uuid,
+        num_rows=None,
+        entity_id_range=None,
     ):
-        """ Loop over tables in features schema, writing the data from each to a
-        csv. Return the full list of feature csv names and the list of all
-        features.
+        """ Loop over tables in features schema, loading the data from each into
+        a dataframe. With more than one n_feature_workers, the tables are
+        extracted concurrently (see _load_features_concurrently). Tables with
+        blocks in the feature_block_cache are assembled from those blocks
+        (see _load_features_from_blocks) instead of joined in the database.
 
         :param as_of_times: the times to be included in the matrix
         :param feature_dictionary: a dictionary of feature tables and features
@@ -390,96 +996,282 @@ class MatrixBuilder(BuilderBase):
         :param entity_date_table_name: the name of the entity date table
             for the matrix
         :param matrix_uuid: a human-readable id for the matrix
+        :param num_rows: the number of rows in the entity date table, if known
+        :param entity_id_range: the first entity id and the one after the last
+            (None if unbounded) that the entity date table holds, if restricted.
+            Feature blocks are then not used, as they hold every entity
         :type as_of_times: list
         :type feature_dictionary: dict
         :type entity_date_table_name: str
         :type matrix_uuid: str
+        :type num_rows: int
+        :type entity_id_range: tuple
 
         :return: list of csvs containing feature data
         :rtype: tuple
         """
-        # iterate! for each table, make query, write csv, save feature & file names
-        feature_dfs = []
+        entity_dates = None
+        feature_loaders = []
         for feature_table_name, feature_names in feature_dictionary.items():
-            logger.spam(f"Retrieving feature data from {feature_table_name}")
-            features_query = self._outer_join_query(
-                right_table_name=f'{self.db_config["features_schema_name"]}.{feature_table_name}',
-                entity_date_table_name=f'{self.db_config["features_schema_name"]}."{entity_date_table_name}"',
-                # collate imputation shouldn't leave any nulls and we double-check
-                # the imputed table in FeatureGenerator.create_all_tables() but as
-                # a final check, raise a divide by zero error on export if the
-                # database encounters any during the outer join
-                right_column_selections=[', "{0}"'.format(fn) for fn in feature_names],
-            )
-            feature_dfs.append(self.query_to_df(features_query))
+            if self.feature_block_cache is not None and entity_id_range is None and any(
+                self.feature_block_cache.is_shared(feature_table_name, as_of_time)
+                for as_of_time in as_of_times
+            ):
+                if entity_dates is None:
+                    entity_dates = self.query_to_df(
+                        f"""SELECT entity_id, as_of_date
+                        FROM {self.db_config["features_schema_name"]}."{entity_date_table_name}"
+                        ORDER BY entity_id, as_of_date""",
+                        num_rows=num_rows,
+                    ).index
+                load = partial(
+                    self._load_features_from_blocks,
+                    feature_table_name,
+                    feature_names,
+                    as_of_times,
+                    entity_dates,
+                )
+            else:
+                features_query = self._outer_join_query(
+                    right_table_name=f'{self.db_config["features_schema_name"]}.{feature_table_name}',
+                    entity_date_table_name=f'{self.db_config["features_schema_name"]}."{entity_date_table_name}"',
+                    # collate imputation shouldn't leave any nulls and we double-check
+                    # the imputed table in FeatureGenerator.create_all_tables() but as
+                    # a final check, raise a divide by zero error on export if the
+                    # database encounters any during the outer join
+                    right_column_selections=[', "{0}"'.format(fn) for fn in feature_names],
+                    additional_conditions=self._entity_id_range_condition_clause(entity_id_range),
+                )
+                load = partial(self.query_to_df, features_query, num_rows=num_rows)
+            feature_loaders.append((feature_table_name, load, len(feature_names)))
+
+        if self.n_feature_workers == 1:
+            feature_dfs = []
+            for feature_table_name, load, _ in feature_loaders:
+                logger.spam(f"Retrieving feature data from {feature_table_name}")
+                feature_dfs.append(load())
+            return feature_dfs
+
+        return self._load_features_concurrently(feature_loaders, num_rows)
+
+    def _load_features_concurrently(self, feature_loaders, num_rows):
+        """Extract feature tables on a pool of threads, each querying over its
+        own connection
+
+        At most n_feature_workers tables are extracted at once. If a
+        feature_memory_budget (in megabytes) is set, a table is only started
+        once the estimated size of the tables being extracted leaves room for
+        it, so a few wide tables don't get parsed side by side; a table bigger
+        than the whole budget is extracted on its own.
+
+        :param feature_loaders: (table name, function loading the table, number
+            of features) tuples
+        :param num_rows: the number of rows each table has, if known
+        :type feature_loaders: list
+        :type num_rows: int
+
+        :return: the feature dataframes, in the order of feature_loaders
+        :rtype: list
+        """
+        budget = None
+        if self.feature_memory_budget is not None and num_rows is not None:
+            budget = self.feature_memory_budget * 2 ** 20
+        feature_dfs = [None] * len(feature_loaders)
+        in_flight = {}
+        in_flight_bytes = 0
+
+        def collect_finished():
+            nonlocal in_flight_bytes
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                position, estimated_bytes = in_flight.pop(future)
+                feature_dfs[position] = future.result()
+                in_flight_bytes -= estimated_bytes
+
+        logger.spam(
+            f"Retrieving {len(feature_loaders)} feature tables with "
+            f"{self.n_feature_workers} workers"
+        )
+        with ThreadPoolExecutor(max_workers=self.n_feature_workers) as executor:
+            for position, (feature_table_name, load, num_features) in enumerate(
+                feature_loaders
+            ):
+                # float32 values plus the int64 entity ids and datetime64 as-of-dates
+                estimated_bytes = (num_rows or 0) * (4 * num_features + 16)
+                while in_flight and (
+                    len(in_flight) >= self.n_feature_workers
+                    or (budget is not None and in_flight_bytes + estimated_bytes > budget)
+                ):
+                    collect_finished()
+                logger.spam(f"Retrieving feature data from {feature_table_name}")
+                future = executor.submit(load)
+                in_flight[future] = (position, estimated_bytes)
+                in_flight_bytes += estimated_bytes
+            while in_flight:
+                collect_finished()
 
         return feature_dfs
 
-    def query_to_df(self, query_string, header="HEADER"):
-        """ Given a query, write the requested data to csv.
+    def _load_features_from_blocks(
+        self, feature_table_name, feature_names, as_of_times, entity_dates
+    ):
+        """Assemble a feature table's data for a matrix from per-as-of-date blocks
+
+        Blocks shared with other matrices are read from the feature block
+        cache, extracting and caching them first if no matrix has yet; the
+        others are extracted for this matrix alone. The blocks are then
+        aligned to the matrix's entity-dates, leaving nulls for the missing
+        rows as the outer join in load_features_data would.
+
+        :param feature_table_name: the name of the feature table
+        :param feature_names: the features of the table included in the matrix
+        :param as_of_times: the times to be included in the matrix
+        :param entity_dates: the entity-dates of the matrix, in order
+        :type feature_table_name: str
+        :type feature_names: list
+        :type as_of_times: list
+        :type entity_dates: pandas.MultiIndex
+
+        :return: the feature data, indexed by entity_id and as_of_date
+        :rtype: pandas.DataFrame
+        """
+        blocks = []
+        for as_of_time in sorted(set(as_of_times)):
+            if self.feature_block_cache.is_shared(feature_table_name, as_of_time):
+                block = self.feature_block_cache.get(
+                    feature_table_name, as_of_time, feature_names
+                )
+                if block is None:
+                    block = self._extract_feature_block(
+                        feature_table_name,
+                        self.feature_block_cache.columns(feature_table_name),
+                        as_of_time,
+                    )
+                    self.feature_block_cache.put(feature_table_name, as_of_time, block)
+                blocks.append(block[feature_names])
+            else:
+                blocks.append(
+                    self._extract_feature_block(feature_table_name, feature_names, as_of_time)
+                )
+        return pd.concat(blocks).reindex(entity_dates)
+
+    def _extract_feature_block(self, feature_table_name, feature_names, as_of_time):
+        logger.spam(f"Retrieving feature data from {feature_table_name} as of {as_of_time}")
+        return self.query_to_df(
+            f"""SELECT entity_id, as_of_date{"".join(f', "{fn}"' for fn in feature_names)}
+            FROM {self.db_config["features_schema_name"]}.{feature_table_name}
+            WHERE as_of_date = '{as_of_time}'::timestamp"""
+        )
+
+    def query_to_df(self, query_string, num_rows=None):
+        """ Given a query, load the requested data into a float32 dataframe.
+
+        The CSV output of COPY is streamed from the database and parsed as it
+        arrives (see read_matrix_csv), instead of being buffered whole first.
 
         :param query_string: query to send
-        :param file_name: name to save the file as
-        :header: text to include in query indicating if a header should be saved
-                 in output
+        :param num_rows: the number of rows the query returns, if known
         :type query_string: str
-        :type file_name: str
-        :type header: str
+        :type num_rows: int
 
-        :return: none
-        :rtype: none
+        :return: the requested data, indexed by entity_id and as_of_date
+        :rtype: pandas.DataFrame
         """
         logger.spam(f"Copying to CSV query {query_string}")
-        copy_sql = f"COPY ({query_string}) TO STDOUT WITH CSV {header}"
+        copy_sql = f"COPY ({query_string}) TO STDOUT WITH CSV HEADER"
         conn = self.db_engine.raw_connection()
-        cur = conn.cursor()
-        out = io.StringIO()
-        cur.copy_expert(copy_sql, out)
-        out.seek(0)
-        df = pd.read_csv(out, parse_dates=["as_of_date"])
-        df.set_index(["entity_id", "as_of_date"], inplace=True)
-        return downcast_matrix(df)
+        try:
+            cur = conn.cursor()
+            with PipeTextIO(partial(cur.copy_expert, copy_sql)) as pipe:
+                return read_matrix_csv(pipe, num_rows=num_rows)
+        finally:
+            conn.close()
+
+    def _count_entity_dates(self, entity_date_table_name):
+        return self.db_engine.execute(
+            f'SELECT count(*) FROM {self.db_config["features_schema_name"]}."{entity_date_table_name}"'
+        ).scalar()
 
     def merge_feature_csvs(self, dataframes, matrix_uuid):
-        """Horizontally merge a list of feature CSVs
+        """Horizontally merge a list of feature dataframes
         Assumptions:
-        - The first and second columns of each CSV are
-          the entity_id and date
-        - That the CSVs have the same list of entity_id/date combinations
-          in the same order.
-        - The first CSV is expected to be labels, and only have
-          entity_id, date, and label.
-        - All other CSVs do not have any labels (all non entity_id/date columns
+        - Each dataframe is indexed by entity_id and as_of_date
+        - The first dataframe is expected to be labels, and only have
+          the label column.
+        - All other dataframes do not have any labels (all columns
           will be treated as features)
-        - The label will be in the *last* column of the merged CSV
+        - The label will be in the *last* column of the merged dataframe
 
-        :param source_filenames: the filenames of each feature csv
-        :param out_filename: the desired filename of the merged csv
-        :type source_filenames: list
-        :type out_filename: str
+        As every query is ordered by entity_id and as_of_date against the same
+        entity-date table, the indexes are normally identical. In that case,
+        and if the features are all float32 (as query_to_df returns them), the
+        feature columns are copied side by side into one preallocated array
+        instead of being joined on the index. Otherwise the dataframes are
+        joined on their index.
 
-        :return: none
-        :rtype: none
+        :param dataframes: the labels dataframe followed by the feature dataframes
+        :param matrix_uuid: the uuid of the matrix being built
+        :type dataframes: list
+        :type matrix_uuid: str
 
-        :raises: ValueError if the first two columns in every CSV don't match
-        """
+        :return: the merged dataframe
+        :rtype: pandas.DataFrame
 
-        for i, df in enumerate(dataframes):
-            if df.index.names != ["entity_id", "as_of_date"]:
+        :raises: ValueError if a dataframe isn't indexed by entity_id and
+            as_of_date, or if any feature has nulls
+        """
+        for df in dataframes:
+            if df.index.names != MATRIX_INDICES:
                 raise ValueError(
                     f"index must be entity_id and as_of_date, value was {df.index}"
                 )
-            # check for any nulls. the labels, understood to be the first file,
-            # can have nulls but no features should. therefore, skip the first dataframe
-            if i > 0:
-                columns_with_nulls = [
-                    column for column in df.columns if df[column].isnull().values.any()
-                ]
-                if len(columns_with_nulls) > 0:
-                    raise ValueError(
-                        "Imputation failed for the following features: {columns_with_nulls}"
-                    )
-            i += 1
 
-        big_df = dataframes[1].join(dataframes[2:] + [dataframes[0]])
+        labels_df, feature_dfs = dataframes[0], dataframes[1:]
+        index = feature_dfs[0].index
+        if all(df.index.equals(index) for df in dataframes[1:] + [labels_df]) and all(
+            (df.dtypes == np.float32).all() for df in feature_dfs
+        ):
+            logger.spam(f"Merging feature dataframes for matrix {matrix_uuid} by position")
+            return self._merge_by_position(labels_df, feature_dfs)
+
+        logger.spam(f"Joining feature dataframes for matrix {matrix_uuid} on their index")
+        # check for any nulls. the labels, understood to be the first dataframe,
+        # can have nulls but no features should
+        for df in feature_dfs:
+            columns_with_nulls = [
+                column for column in df.columns if df[column].isnull().values.any()
+            ]
+            if len(columns_with_nulls) > 0:
+                raise ValueError(
+                    f"Imputation failed for the following features: {columns_with_nulls}"
+                )
+
+        big_df = feature_dfs[0].join(feature_dfs[1:] + [labels_df])
+        return big_df
+
+    def _merge_by_position(self, labels_df, feature_dfs):
+        columns = [column for df in feature_dfs for column in df.columns]
+        if len(set(columns)) != len(columns):
+            raise ValueError(
+                f"Feature dataframes have overlapping columns: "
+                f"{sorted(set(column for column in columns if columns.count(column) > 1))}"
+            )
+        # pandas keeps a float32 block as a (columns, rows) array, so filling one
+        # column-major array copies each dataframe contiguously and the result
+        # can wrap it without another copy
+        values = np.empty((len(columns), len(labels_df)), dtype=np.float32)
+        start = 0
+        for df in feature_dfs:
+            end = start + len(df.columns)
+            values[start:end] = df.to_numpy().T
+            nulls = np.isnan(values[start:end]).any(axis=1)
+            if nulls.any():
+                raise ValueError(
+                    f"Imputation failed for the following features: {list(df.columns[nulls])}"
+                )
+            start = end
+
+        big_df = pd.DataFrame(values.T, index=feature_dfs[0].index, columns=columns)
+        for column in labels_df.columns:
+            big_df[column] = labels_df[column].to_numpy()
         return big_df
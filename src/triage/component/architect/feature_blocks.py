@@ -0,0 +1,88 @@
+import os
+import shutil
+import uuid
+
+import verboselogs, logging
+logger = verboselogs.VerboseLogger(__name__)
+
+import pandas as pd
+import pyarrow
+import pyarrow.parquet as pq
+
+
+class FeatureBlockCache:
+    """A local columnar cache of (feature table, as-of-date) blocks
+
+    Each block holds every row of a feature table at one as-of-date, with all
+    of the columns that any matrix of the experiment selects from that table,
+    and is stored as a Parquet file so that a matrix only reads the columns it
+    needs. Only the blocks planned as shared (see
+    Planner.shared_feature_blocks) are cached.
+
+    The cache only holds a directory path and the plan, so it can be passed
+    to matrix building processes; blocks are written to a temporary file
+    and moved into place, so concurrent builders at worst extract a block twice.
+
+    :param directory: a local directory to store the blocks in
+    :param shared_blocks: feature table names mapped to the columns to extract
+        and the as-of-dates to cache
+    :type directory: str
+    :type shared_blocks: dict
+    """
+
+    def __init__(self, directory, shared_blocks):
+        self.directory = directory
+        self.shared_blocks = {
+            feature_table_name: {
+                "columns": list(blocks["columns"]),
+                "as_of_dates": set(pd.Timestamp(as_of_date) for as_of_date in blocks["as_of_dates"]),
+            }
+            for feature_table_name, blocks in shared_blocks.items()
+        }
+
+    def is_shared(self, feature_table_name, as_of_date):
+        blocks = self.shared_blocks.get(feature_table_name)
+        return blocks is not None and pd.Timestamp(as_of_date) in blocks["as_of_dates"]
+
+    def columns(self, feature_table_name):
+        return self.shared_blocks[feature_table_name]["columns"]
+
+    def _path(self, feature_table_name, as_of_date):
+        return os.path.join(
+            self.directory,
+            feature_table_name,
+            pd.Timestamp(as_of_date).strftime("%Y%m%dT%H%M%S") + ".parquet",
+        )
+
+    def get(self, feature_table_name, as_of_date, columns):
+        """Read some columns of a cached block
+
+        :return: the block indexed by entity_id and as_of_date, or None if it
+            hasn't been cached yet
+        :rtype: pandas.DataFrame
+        """
+        path = self._path(feature_table_name, as_of_date)
+        if not os.path.exists(path):
+            return None
+        logger.spam(f"Reading cached feature block {path}")
+        return (
+            pq.read_table(path, columns=["entity_id", "as_of_date"] + list(columns))
+            .to_pandas()
+            .set_index(["entity_id", "as_of_date"])
+        )
+
+    def put(self, feature_table_name, as_of_date, block):
+        """Store a block indexed by entity_id and as_of_date"""
+        path = self._path(feature_table_name, as_of_date)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        pq.write_table(
+            pyarrow.Table.from_pandas(block.reset_index(), preserve_index=False),
+            temporary_path,
+        )
+        os.replace(temporary_path, path)
+        logger.spam(f"Cached feature block {path}")
+
+    def clear(self):
+        """Remove the cache directory and every block in it"""
+        shutil.rmtree(self.directory, ignore_errors=True)
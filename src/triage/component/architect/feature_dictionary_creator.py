@@ -14,7 +14,7 @@ class FeatureDictionaryCreator:
         return [
             feature_table
             for feature_table in feature_table_names
-            if "aggregation_imputed" in feature_table
+            if feature_table.endswith("_imputed")
         ]
 
     def feature_dictionary(self, feature_table_names, index_column_lookup):
@@ -1,6 +1,7 @@
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+import copy
 from collections import OrderedDict
 
 import sqlalchemy
@@ -8,13 +9,17 @@ import sqlparse
 
 from triage.util.conf import convert_str_to_relativedelta
 from triage.database_reflection import table_exists
+from triage.component.catwalk.utils import filename_friendly_hash
 
 from triage.component.collate import (
     Aggregate,
     Categorical,
     Compare,
     SpacetimeAggregation,
-    FromObj
+    FromObj,
+    available_materialization_options,
+    available_query_strategies,
+    available_rollup_functions,
 )
 
 class FeatureGenerator:
@@ -50,6 +55,8 @@ class FeatureGenerator:
         self.features_ignore_cohort = features_ignore_cohort
         self.entity_id_column = "entity_id"
         self.from_objs = {}
+        # imputed feature table name -> content hash of the definition it is built from
+        self.aggregation_hashes = {}
 
     def _validate_keys(self, aggregation_config):
         for key in [
@@ -115,6 +122,40 @@ class FeatureGenerator:
                 "One of the aggregation groups is required to be entity_id"
             )
 
+    def _validate_query_strategy(self, aggregation_config):
+        logger.spam("Validating query strategy")
+        query_strategy = aggregation_config.get("query_strategy", "per_date")
+        if query_strategy not in available_query_strategies:
+            raise ValueError(
+                f"query_strategy must be one of {available_query_strategies}, "
+                f"got '{query_strategy}'"
+            )
+
+    def _validate_rollup_intervals(self, aggregation_config):
+        if not aggregation_config.get("rollup_intervals", False):
+            return
+        logger.spam("Validating metrics for rolled up intervals")
+        for agg_type in ["aggregates", "categoricals", "array_categoricals"]:
+            for agg in aggregation_config.get(agg_type, []):
+                for metric in agg["metrics"]:
+                    if metric.lower() not in available_rollup_functions:
+                        raise ValueError(
+                            f"rollup_intervals only supports the metrics "
+                            f"{sorted(available_rollup_functions)}, got '{metric}'"
+                        )
+
+    def _validate_from_obj_materialization(self, aggregation_config):
+        materialization = aggregation_config.get("from_obj_materialization", {})
+        logger.spam("Validating from_obj materialization options")
+        for option in materialization:
+            if option not in available_materialization_options:
+                raise ValueError(
+                    f"from_obj_materialization options must be among "
+                    f"{available_materialization_options}, got '{option}'"
+                )
+        if materialization.get("partition_interval"):
+            convert_str_to_relativedelta(materialization["partition_interval"])
+
     def _validate_imputation_rule(self, aggregate_type, impute_rule):
         """Validate the imputation rule for a given aggregation type."""
         logger.spam("Validating imputation rule")
@@ -190,6 +231,9 @@ class FeatureGenerator:
         self._validate_from_obj(aggregation_config["from_obj"])
         self._validate_time_intervals(aggregation_config["intervals"])
         self._validate_groups(aggregation_config["groups"])
+        self._validate_query_strategy(aggregation_config)
+        self._validate_rollup_intervals(aggregation_config)
+        self._validate_from_obj_materialization(aggregation_config)
         self._validate_imputations(aggregation_config)
 
     def validate(self, feature_aggregation_config):
@@ -303,7 +347,8 @@ class FeatureGenerator:
             aggregation_config.get("array_categoricals", []), arrcatimp
         )
         logger.debug(f"Found {len(array_categoricals)} array categorical aggregates")
-        return SpacetimeAggregation(
+        content_hash = self._aggregation_hash(aggregation_config, state_table)
+        aggregation = SpacetimeAggregation(
             aggregates + categoricals + array_categoricals,
             from_obj=aggregation_config["from_obj"],
             intervals=aggregation_config["intervals"],
@@ -316,8 +361,42 @@ class FeatureGenerator:
             input_min_date=self.feature_start_time,
             schema=self.features_schema_name,
             prefix=aggregation_config["prefix"],
-            join_with_cohort_table=not self.features_ignore_cohort
+            # tables are named after the definition they are built from, so that
+            # experiments with different definitions never touch each other's tables
+            suffix=content_hash[:12],
+            join_with_cohort_table=not self.features_ignore_cohort,
+            query_strategy=aggregation_config.get("query_strategy", "per_date"),
+            rollup_intervals=aggregation_config.get("rollup_intervals", False),
         )
+        imputed_table = self._clean_table_name(aggregation.get_table_name(imputed=True))
+        self.aggregation_hashes[imputed_table] = content_hash
+        return aggregation
+
+    def _aggregation_hash(self, aggregation_config, state_table):
+        """Hash everything the imputed features of an aggregation depend on,
+        except for the as_of_dates, whose presence is checked row by row
+
+        The query strategy and from_obj materialization options only change
+        how the same features are computed, so they are left out. Rolled up
+        intervals can change the column types (the sum of an integer quantity
+        is numeric rather than bigint), so they are included when used. The
+        prefix is part of every feature column name, so it is included too, and
+        the same definition under two prefixes is built twice.
+        """
+        inputs = {
+            "aggregation": {
+                key: value
+                for key, value in aggregation_config.items()
+                if key
+                not in ("query_strategy", "rollup_intervals", "from_obj_materialization")
+            },
+            "state_table": state_table,
+            "feature_start_time": self.feature_start_time,
+            "features_ignore_cohort": self.features_ignore_cohort,
+        }
+        if aggregation_config.get("rollup_intervals", False):
+            inputs["rollup_intervals"] = True
+        return filename_friendly_hash(inputs)
 
     def aggregations(self, feature_aggregation_config, feature_dates, state_table):
         """Creates collate.SpacetimeAggregations from the given arguments
@@ -332,12 +411,23 @@ class FeatureGenerator:
         """
         return [
             self.preprocess_aggregation(
-                self._aggregation(aggregation_config, feature_dates, state_table)
+                self._aggregation(aggregation_config, feature_dates, state_table),
+                aggregation_config.get("from_obj_materialization", {}),
             )
             for aggregation_config in feature_aggregation_config
         ]
 
-    def preprocess_aggregation(self, aggregation):
+    def preprocess_aggregation(self, aggregation, materialization=None):
+        """Creates the aggregation's schema, and materializes its from_obj if
+        it is a subquery and materialize_subquery_fromobjs is set
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+            materialization (dict, optional) options for collate.FromObj, see
+                collate.available_materialization_options
+
+        Returns: (collate.SpacetimeAggregation) the aggregation
+        """
         create_schema = aggregation.get_create_schema()
 
         if create_schema is not None:
@@ -345,11 +435,15 @@ class FeatureGenerator:
                 conn.execute(create_schema)
 
         if self.materialize_subquery_fromobjs:
-            # materialize from obj
+            # materialize from obj, never reusing an earlier one when replacing
+            materialization = dict(materialization or {})
+            if self.replace:
+                materialization["reuse"] = False
             from_obj = FromObj(
                 from_obj=aggregation.from_obj.text,
                 name=f"{aggregation.schema}.{aggregation.prefix}",
-                knowledge_date_column=aggregation.date_column
+                knowledge_date_column=aggregation.date_column,
+                **materialization
             )
             from_obj.maybe_materialize(self.db_engine)
             aggregation.from_obj = from_obj.table
@@ -388,12 +482,11 @@ class FeatureGenerator:
         self, feature_aggregation_config, feature_dates, state_table=None
     ):
         """Create features before imputation for a set of dates"""
-        all_tasks = self.generate_all_table_tasks(
-            self.aggregations(
-                feature_aggregation_config, feature_dates, state_table=state_table
-            ),
-            task_type="aggregation",
+        aggregations = self.aggregations(
+            feature_aggregation_config, feature_dates, state_table=state_table
         )
+        self.prepare_imputed_tables(aggregations)
+        all_tasks = self.generate_all_table_tasks(aggregations, task_type="aggregation")
         logger.debug(f"Generated a total of {len(all_tasks)} table tasks")
         for task_num, task in enumerate(all_tasks.values(), 1):
             prepares = task.get("prepare", [])
@@ -443,6 +536,7 @@ class FeatureGenerator:
 
         """
         aggs = self.aggregations(feature_aggregation_config, feature_dates, state_table)
+        self.prepare_imputed_tables(aggs)
 
         # first, generate and run table tasks for aggregations
         table_tasks_aggregate = self.generate_all_table_tasks(aggs, task_type="aggregation")
@@ -530,33 +624,303 @@ class FeatureGenerator:
             for aggregation in aggregations
         )
 
-    def _needs_features(self, aggregation):
+    def _table_columns(self, table_name):
+        return [
+            row[0]
+            for row in self.db_engine.execute(
+                f"select column_name from information_schema.columns "
+                f"where table_schema = '{self.features_schema_name}' "
+                f"and table_name = '{table_name}' order by ordinal_position"
+            )
+        ]
+
+    def _missing_feature_dates(self, aggregation):
+        """Find the as_of_dates whose cohort rows are missing from an
+        aggregation's imputed feature table
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+
+        Returns: (list) of as_of_date strings with at least one cohort row
+            missing, or None if the imputed feature table does not exist or
+            was not built from the aggregation's definition
+        """
         imputed_table = self._clean_table_name(
             aggregation.get_table_name(imputed=True)
         )
 
-        if self._table_exists(imputed_table):
-            check_query = (
-                f"select 1 from {aggregation.state_table} "
-                f"left join {self.features_schema_name}.{imputed_table} "
-                f"using (entity_id, as_of_date) "
-                f"where {self.features_schema_name}.{imputed_table}.entity_id is null limit 1"
-            )
-            if self.db_engine.execute(check_query).scalar():
-                logger.notice(
-                    f"Imputed feature table {imputed_table} did not contain rows from the "
-                    f"entire cohort, need to rebuild features"
-                )
-                return True
-        else:
+        if not self._table_exists(imputed_table):
             logger.notice(
                 f"Imputed feature table {imputed_table} did not exist, "
                 f"need to build features"
             )
-            return True
-        logger.notice(f"Imputed feature table {imputed_table} looks good, "
-                      f"skipping feature building!")
-        return False
+            return None
+
+        check_query = (
+            f"select distinct as_of_date from {aggregation.state_table} "
+            f"left join {self.features_schema_name}.{imputed_table} "
+            f"using (entity_id, as_of_date) "
+            f"where {self.features_schema_name}.{imputed_table}.entity_id is null "
+            f"order by as_of_date"
+        )
+        content_hash = self.aggregation_hashes.get(imputed_table)
+        table_hash = self._table_hash(imputed_table)
+        # tables built before imputed tables were tagged with a content hash
+        # have no comment, for those the columns and cohort rows are checked
+        if content_hash is not None and table_hash is None:
+            if not self._can_add_dates(aggregation):
+                return None
+        elif content_hash is not None and table_hash != content_hash:
+            logger.notice(
+                f"Imputed feature table {imputed_table} was not built from the "
+                f"current feature aggregation config, need to build features"
+            )
+            return None
+
+        missing_dates = [str(row[0]) for row in self.db_engine.execute(check_query)]
+        if missing_dates:
+            logger.notice(
+                f"Imputed feature table {imputed_table} did not contain rows from the "
+                f"entire cohort for {len(missing_dates)} as_of_dates, need to build "
+                f"features for them"
+            )
+        else:
+            logger.notice(f"Imputed feature table {imputed_table} looks good, "
+                          f"skipping feature building!")
+        return missing_dates
+
+    def _needs_features(self, aggregation):
+        missing_dates = self._missing_feature_dates(aggregation)
+        return missing_dates is None or len(missing_dates) > 0
+
+    def _can_add_dates(self, aggregation, imputed_table=None):
+        """Whether the existing imputed feature table of an aggregation has the
+        columns the aggregation would build, so new as_of_dates can be added to it
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+            imputed_table (string, optional) the table to check, defaults to the
+                imputed feature table of the aggregation
+        """
+        if imputed_table is None:
+            imputed_table = self._clean_table_name(
+                aggregation.get_table_name(imputed=True)
+            )
+        existing_columns = set(self._table_columns(imputed_table))
+        key_columns = set(aggregation.groups.values()) | {aggregation.output_date_column}
+        feature_columns = set(aggregation.get_imputation_rules().keys())
+        extra_columns = existing_columns - key_columns - feature_columns
+        if not feature_columns <= existing_columns or any(
+            not column.endswith("_imp") for column in extra_columns
+        ):
+            logger.notice(
+                f"Imputed feature table {imputed_table} does not have the configured "
+                f"feature columns, need to rebuild features for all as_of_dates"
+            )
+            return False
+        return True
+
+    def _table_hash(self, table_name):
+        return self.db_engine.execute(
+            f"select obj_description(to_regclass('\"{self.features_schema_name}\".\"{table_name}\"'), 'pg_class')"
+        ).scalar()
+
+    def _relation_kind(self, table_name):
+        """The pg_class relkind of a relation in the features schema ('r' for a
+        table, 'v' for a view), or None if there is no such relation"""
+        return self.db_engine.execute(
+            f"select c.relkind from pg_class c "
+            f"join pg_namespace n on n.oid = c.relnamespace "
+            f"where n.nspname = '{self.features_schema_name}' and c.relname = '{table_name}'"
+        ).scalar()
+
+    def _legacy_table_name(self, aggregation):
+        """The name imputed feature tables had before they were named after the
+        content hash of their definition, now used for a view on the current one"""
+        return f"{aggregation.prefix}_aggregation_imputed"
+
+    def _legacy_tables(self, aggregation):
+        """Names of the imputed feature tables of an aggregation's prefix built
+        before tables were named after the content hash of their definition: the
+        table under the legacy name and the copies of it kept for reuse"""
+        legacy_table = self._legacy_table_name(aggregation)
+        return [
+            row[0]
+            for row in self.db_engine.execute(
+                f"select c.relname from pg_class c "
+                f"join pg_namespace n on n.oid = c.relnamespace "
+                f"where n.nspname = '{self.features_schema_name}' and c.relkind = 'r' "
+                f"and (c.relname = '{legacy_table}' "
+                f"or c.relname ~ '^{legacy_table[:50]}_[0-9a-f]{{12}}$')"
+            )
+        ]
+
+    def _adopt_legacy_tables(self, aggregation):
+        """Rename the imputed feature tables of an aggregation's prefix built
+        before tables were named after the content hash of their definition, to
+        the names they have now
+
+        A table tagged with a content hash gets the name of its hash. An untagged
+        table gets the name of the current one, and is tagged with it, if it has
+        the columns the aggregation would build. Tables whose new name is taken
+        are left alone.
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+        """
+        imputed_table = self._clean_table_name(aggregation.get_table_name(imputed=True))
+        content_hash = self.aggregation_hashes.get(imputed_table)
+        if content_hash is None:
+            return
+        for table in self._legacy_tables(aggregation):
+            table_hash = self._table_hash(table)
+            if table_hash is None:
+                if table != self._legacy_table_name(aggregation) or not self._can_add_dates(
+                    aggregation, table
+                ):
+                    continue
+                table_hash = content_hash
+            hashed_table = f"{aggregation.prefix}_{table_hash[:12]}_imputed"
+            if self._relation_kind(hashed_table) is not None:
+                continue
+            logger.notice(f"Renaming imputed feature table {table} to {hashed_table}")
+            with self.db_engine.begin() as conn:
+                conn.execute(
+                    f'ALTER TABLE "{self.features_schema_name}"."{table}" '
+                    f'RENAME TO "{hashed_table}"'
+                )
+                conn.execute(
+                    f'COMMENT ON TABLE "{self.features_schema_name}"."{hashed_table}" '
+                    f"IS '{table_hash}'"
+                )
+
+    def _legacy_view_queries(self, aggregation):
+        """Generate SQL statements pointing the view under the legacy name of an
+        aggregation's imputed feature table at the current one
+
+        The view is left out if a table has the legacy name, or if the
+        aggregation's tables are not named after its content hash.
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+
+        Returns: (list) of SQL statements, starting with the drop of the view
+        """
+        imputed_table = self._clean_table_name(aggregation.get_table_name(imputed=True))
+        if imputed_table not in self.aggregation_hashes:
+            return []
+        legacy_table = self._legacy_table_name(aggregation)
+        if self._relation_kind(legacy_table) not in (None, "v"):
+            logger.notice(
+                f"{legacy_table} is a table, not replacing it with a view on {imputed_table}"
+            )
+            return []
+        view = f'"{self.features_schema_name}"."{legacy_table}"'
+        return [
+            f"DROP VIEW IF EXISTS {view}",
+            f"CREATE VIEW {view} AS SELECT * FROM {aggregation.get_table_name(imputed=True)}",
+        ]
+
+    def prepare_imputed_tables(self, aggregations):
+        """Get the existing imputed feature tables of the aggregations in place
+        before their table tasks are generated
+
+        Renames the tables built before tables were named after the content hash
+        of their definition, see _adopt_legacy_tables, and points the views under
+        their legacy names at the existing tables.
+
+        Args:
+            aggregations (list) collate.SpacetimeAggregation objects
+        """
+        for aggregation in aggregations:
+            self._adopt_legacy_tables(aggregation)
+            imputed_table = self._clean_table_name(aggregation.get_table_name(imputed=True))
+            if self._table_exists(imputed_table):
+                self.run_commands(self._legacy_view_queries(aggregation))
+
+    def _aggregation_to_build(self, aggregation):
+        """Decide how much of an aggregation needs to be built
+
+        Features are built for every as_of_date when replacing, when the imputed
+        feature table does not exist or when its columns no longer match the
+        aggregation. Otherwise only the as_of_dates with missing cohort rows are
+        built, into group and aggregation tables suffixed with 'new' so that the
+        existing ones are left alone, and added to the existing imputed feature
+        table.
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+
+        Returns: (collate.SpacetimeAggregation) the aggregation to build, the
+            given one or a copy restricted to the missing as_of_dates, or None
+            if no features need to be built
+        """
+        if self.replace:
+            return aggregation
+        missing_dates = self._missing_feature_dates(aggregation)
+        if missing_dates is None:
+            return aggregation
+        if not missing_dates:
+            return None
+        if not self._can_add_dates(aggregation):
+            return aggregation
+        logger.notice(
+            f"Building features for as_of_dates {missing_dates} only, "
+            f"the other as_of_dates are kept"
+        )
+        new_dates = copy.copy(aggregation)
+        new_dates.dates = missing_dates
+        new_dates.suffix = f"{aggregation.suffix}_new"
+        return new_dates
+
+    def _add_dates_queries(self, aggregation, new_dates, impute_cols, nonimpute_cols):
+        """Generate SQL statements moving the imputed features of new as_of_dates
+        into the existing imputed feature table of an aggregation
+
+        Imputation flag columns only present in one of the two tables are
+        added to the existing table, and filled with 0 where they are missing.
+
+        Args:
+            aggregation (collate.SpacetimeAggregation) the full aggregation
+            new_dates (collate.SpacetimeAggregation) the aggregation restricted
+                to the new as_of_dates
+            impute_cols (list) columns of new_dates with null values
+            nonimpute_cols (list) columns of new_dates without null values
+
+        Returns: (list) of SQL statements
+        """
+        imputed_table = aggregation.get_table_name(imputed=True)
+        existing_columns = self._table_columns(self._clean_table_name(imputed_table))
+        with self.db_engine.begin() as conn:
+            new_columns = list(
+                conn.execute(
+                    f"select * from ({new_dates.get_impute_select(impute_cols, nonimpute_cols)}) "
+                    f"new_dates limit 0"
+                ).keys()
+            )
+        added_columns = [col for col in new_columns if col not in existing_columns]
+        columns = existing_columns + added_columns
+        dates = ", ".join(f"'{date}'::date" for date in new_dates.dates)
+
+        queries = [
+            f"DELETE FROM {imputed_table} "
+            f"WHERE {aggregation.output_date_column} IN ({dates})"
+        ]
+        queries += [
+            f'ALTER TABLE {imputed_table} ADD COLUMN "{col}" SMALLINT NOT NULL DEFAULT 0'
+            for col in added_columns
+        ]
+        insert_columns = ", ".join(f'"{col}"' for col in columns)
+        select_columns = ", ".join(
+            f'"{col}"' if col in new_columns else f'0::SMALLINT AS "{col}"'
+            for col in columns
+        )
+        queries.append(
+            f"INSERT INTO {imputed_table} ({insert_columns}) "
+            f"SELECT {select_columns} FROM {new_dates.get_table_name(imputed=True)}"
+        )
+        queries.append(new_dates.get_drop(imputed=True))
+        return queries
 
     def _generate_agg_table_tasks_for(self, aggregation):
         """Generates SQL commands for preparing, populating, and finalizing
@@ -571,38 +935,41 @@ class FeatureGenerator:
             'finalize': list of commands to finalize table after population
         }
         """
-        creates = aggregation.get_creates()
-        drops = aggregation.get_drops()
-        indexes = aggregation.get_indexes()
-        inserts = aggregation.get_inserts()
         table_tasks = OrderedDict()
+        to_build = self._aggregation_to_build(aggregation)
 
-        needs_features = self._needs_features(aggregation)
-
-        for group in aggregation.groups:
-            group_table = self._clean_table_name(
-                aggregation.get_table_name(group=group)
-            )
-            if self.replace or needs_features:
-                table_tasks[group_table] = {
-                    "prepare": [drops[group], creates[group]],
-                    "inserts": inserts[group],
-                    "finalize": [indexes[group]],
-                }
-                logger.debug(f"Created task for table {group_table}")
-            else:
+        if to_build is None:
+            for group in aggregation.groups:
+                group_table = self._clean_table_name(
+                    aggregation.get_table_name(group=group)
+                )
                 logger.debug(f"Skipping feature creation for table {group_table}")
                 table_tasks[group_table] = {}
-        if self.replace or needs_features:
-            table_tasks[self._clean_table_name(aggregation.get_table_name())] = {
-                "prepare": [aggregation.get_drop(), aggregation.get_create()],
-                "inserts": [],
-                "finalize": [self._aggregation_index_query(aggregation)],
-            }
-            logger.debug(f"Created tasks for aggregation {self._clean_table_name(aggregation.get_table_name())}" )
-        else:
             logger.debug(f"Skipping feature creation for table {self._clean_table_name(aggregation.get_table_name())}")
             table_tasks[self._clean_table_name(aggregation.get_table_name())] = {}
+            return table_tasks
+
+        creates = to_build.get_creates()
+        drops = to_build.get_drops()
+        indexes = to_build.get_indexes()
+        inserts = to_build.get_inserts()
+
+        for group in to_build.groups:
+            group_table = self._clean_table_name(
+                to_build.get_table_name(group=group)
+            )
+            table_tasks[group_table] = {
+                "prepare": [drops[group], creates[group]],
+                "inserts": inserts[group],
+                "finalize": [indexes[group]],
+            }
+            logger.debug(f"Created task for table {group_table}")
+        table_tasks[self._clean_table_name(to_build.get_table_name())] = {
+            "prepare": [to_build.get_drop(), to_build.get_create()],
+            "inserts": [],
+            "finalize": [self._aggregation_index_query(to_build)],
+        }
+        logger.debug(f"Created tasks for aggregation {self._clean_table_name(to_build.get_table_name())}" )
 
         return table_tasks
 
@@ -629,7 +996,8 @@ class FeatureGenerator:
         table_tasks = OrderedDict()
         imp_tbl_name = self._clean_table_name(aggregation.get_table_name(imputed=True))
 
-        if not self.replace and not self._needs_features(aggregation):
+        to_build = self._aggregation_to_build(aggregation)
+        if to_build is None:
             logger.debug("Skipping imputation table creation for %s", imp_tbl_name)
             table_tasks[imp_tbl_name] = {}
             return table_tasks
@@ -651,33 +1019,52 @@ class FeatureGenerator:
         # excute query to find columns with null values and create lists of columns
         # that do and do not need imputation when creating the imputation table
         with self.db_engine.begin() as conn:
-            results = conn.execute(aggregation.find_nulls())
+            results = conn.execute(to_build.find_nulls())
             null_counts = results.first().items()
         impute_cols = [col for (col, val) in null_counts if val > 0]
         nonimpute_cols = [col for (col, val) in null_counts if val == 0]
 
         # table tasks for imputed aggregation table, most of the work is done here
         # by collate's get_impute_create()
+        legacy_view_queries = self._legacy_view_queries(aggregation)
         table_tasks[imp_tbl_name] = {
             "prepare": [
-                aggregation.get_drop(imputed=True),
-                aggregation.get_impute_create(
+                to_build.get_drop(imputed=True),
+                to_build.get_impute_create(
                     impute_cols=impute_cols, nonimpute_cols=nonimpute_cols
                 ),
             ],
             "inserts": [],
-            "finalize": [self._aggregation_index_query(aggregation, imputed=True)],
+            "finalize": [],
         }
+        if to_build is aggregation:
+            # the view depends on the table that is dropped
+            table_tasks[imp_tbl_name]["prepare"][:0] = legacy_view_queries[:1]
+            table_tasks[imp_tbl_name]["finalize"].append(
+                self._aggregation_index_query(aggregation, imputed=True)
+            )
+            content_hash = self.aggregation_hashes.get(imp_tbl_name)
+            if content_hash is not None:
+                table_tasks[imp_tbl_name]["finalize"].append(
+                    f"COMMENT ON TABLE {aggregation.get_table_name(imputed=True)} "
+                    f"IS '{content_hash}'"
+                )
+        else:
+            # only new as_of_dates were imputed, add them to the existing table
+            table_tasks[imp_tbl_name]["finalize"] += self._add_dates_queries(
+                aggregation, to_build, impute_cols, nonimpute_cols
+            )
         logger.debug("Created table tasks for imputation: %s", imp_tbl_name)
 
         # do some cleanup:
         # drop the group-level and aggregation tables, just leaving the
         # imputation table if drop_preagg=True
         if drop_preagg:
-            drops = aggregation.get_drops()
+            drops = to_build.get_drops()
             table_tasks[imp_tbl_name]["finalize"] += list(drops.values()) + [
-                aggregation.get_drop()
+                to_build.get_drop()
             ]
             logger.debug("Added drop table cleanup tasks: %s", imp_tbl_name)
 
+        table_tasks[imp_tbl_name]["finalize"] += legacy_view_queries
         return table_tasks
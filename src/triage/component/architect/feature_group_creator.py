@@ -1,8 +1,14 @@
+import re
+
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
 from triage.util.structs import FeatureNameList
 
+# imputed feature tables are named after the content hash of their definition,
+# feature groups refer to them by the name they had before, prefix_aggregation_imputed
+HASHED_IMPUTED_TABLE = re.compile(r"^(?P<prefix>.+)_[0-9a-f]{12}_imputed$")
+
 
 class FeatureGroup(dict):
     def __init__(self, *args, **kwargs):
@@ -27,7 +33,10 @@ class FeatureGroup(dict):
 
 def table_subsetter(config_item, table, features):
     "Return features matching a given table"
-    if table == config_item:
+    hashed_table = HASHED_IMPUTED_TABLE.match(table)
+    if table == config_item or (
+        hashed_table and f"{hashed_table['prefix']}_aggregation_imputed" == config_item
+    ):
         return features
     else:
         return []
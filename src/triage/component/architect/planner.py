@@ -1,5 +1,6 @@
 import copy
 import itertools
+from collections import defaultdict
 
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
@@ -207,3 +208,42 @@ class Planner:
         )
         logger.debug("Associated all tasks with experiment in database")
         return updated_definitions, build_tasks
+
+    def shared_feature_blocks(self, build_tasks):
+        """Find the (feature table, as-of-date) blocks that more than one matrix needs
+
+        Matrices built on the same split for different labels, cohorts or
+        feature group mixes, and test matrices with overlapping as-of-dates,
+        all outer join the same rows of a feature table. Each block returned
+        here can be extracted once and sliced for every matrix that uses it.
+
+        :param build_tasks: the matrix build tasks, as returned by generate_plans
+        :type build_tasks: dict
+
+        :return: for each feature table with shared blocks, the columns any matrix
+            selects from it and the as-of-dates needed by more than one matrix
+        :rtype: dict
+        """
+        uses = defaultdict(int)
+        columns = defaultdict(set)
+        for build_task in build_tasks.values():
+            for feature_table_name, feature_names in build_task["feature_dictionary"].items():
+                columns[feature_table_name].update(feature_names)
+                for as_of_time in set(build_task["as_of_times"]):
+                    uses[(feature_table_name, as_of_time)] += 1
+
+        shared_blocks = {}
+        for (feature_table_name, as_of_time), num_uses in uses.items():
+            if num_uses > 1:
+                shared_blocks.setdefault(
+                    feature_table_name,
+                    {"columns": sorted(columns[feature_table_name]), "as_of_dates": []},
+                )["as_of_dates"].append(as_of_time)
+        for blocks in shared_blocks.values():
+            blocks["as_of_dates"].sort()
+
+        logger.debug(
+            "%s feature blocks are shared between matrices",
+            sum(len(blocks["as_of_dates"]) for blocks in shared_blocks.values()),
+        )
+        return shared_blocks
@@ -10,6 +10,8 @@ import pandas as pd
 import statistics
 import typing
 from collections import defaultdict
+from scipy.stats import hypergeom
+import sqlalchemy
 from sqlalchemy.orm import sessionmaker
 
 from aequitas.bias import Bias
@@ -20,6 +22,7 @@ from aequitas.preprocessing import preprocess_input_df
 from . import metrics
 from .utils import (
     db_retry,
+    save_db_objects,
     sort_predictions_and_labels,
     get_subset_table_name,
     filename_friendly_hash
@@ -30,6 +33,7 @@ from triage.component.catwalk.storage import MatrixStore
 
 RELATIVE_TOLERANCE = 0.01
 SORT_TRIALS = 30
+RANDOM_TIEBREAKING_METHODS = ("trials", "analytic")
 
 
 
@@ -97,6 +101,24 @@ def query_subset_table(db_engine, as_of_dates, subset_table_name):
     return df
 
 
+def threshold_cutoff(len_predictions, x_value, unit="top_n"):
+    """The number of top-ranked predictions assigned to the positive class
+
+    Args:
+        len_predictions (int) The number of predictions
+        x_value (int) The percentile or absolute value desired
+        unit (string, default 'top_n') The thresholding method desired,
+            either percentile or top_n
+
+    Returns: (int) The number of predictions above the threshold
+    """
+    if unit == "percentile":
+        cutoff_index = int(len_predictions * (x_value / 100.00))
+    else:
+        cutoff_index = int(x_value)
+    return cutoff_index if cutoff_index <= len_predictions else len_predictions
+
+
 def generate_binary_at_x(test_predictions, x_value, unit="top_n"):
     """Assign predicted classes based based on top% or absolute rank of score
 
@@ -111,18 +133,105 @@ def generate_binary_at_x(test_predictions, x_value, unit="top_n"):
     len_predictions = len(test_predictions)
     if len_predictions == 0:
         return np.array([])
-    if unit == "percentile":
-        cutoff_index = int(len_predictions * (x_value / 100.00))
-    else:
-        cutoff_index = int(x_value)
-    num_ones = cutoff_index if cutoff_index <= len_predictions else len_predictions
-    num_zeroes = len_predictions - cutoff_index if cutoff_index <= len_predictions else 0
+    num_ones = threshold_cutoff(len_predictions, x_value, unit)
+    num_zeroes = len_predictions - num_ones
     test_predictions_binary = np.concatenate(
         (np.ones(num_ones, np.int8), np.zeros(num_zeroes, np.int8))
     )
     return test_predictions_binary
 
 
+def cumulative_label_counts(labels):
+    """Count labeled examples and positive labels among the top k sorted labels, for every k
+
+    Args:
+        labels (np.array) labels, sorted by score descending, maybe containing NaNs
+
+    Returns: (tuple of np.array) The number of labeled examples and of positive labels
+        among the first k labels, indexed by k (so both arrays start at 0 and have
+        one more element than the labels)
+    """
+    labeled = np.isfinite(labels)
+    positive = labeled & (np.nan_to_num(labels) != 0)
+    cumulative_labeled = np.zeros(len(labels) + 1, dtype=np.int64)
+    cumulative_positive = np.zeros(len(labels) + 1, dtype=np.int64)
+    np.cumsum(labeled, out=cumulative_labeled[1:])
+    np.cumsum(positive, out=cumulative_positive[1:])
+    return cumulative_labeled, cumulative_positive
+
+
+def moments_under_random_ties(metric_function, cumulative_labeled, cumulative_positive, tie_start, tie_end, cutoff):
+    """Exact mean and standard deviation of a metric when ties are broken at random
+
+    Only the tie group straddling the cutoff is affected by tiebreaking: of its
+    members, the `cutoff - tie_start` that end up above the threshold are a uniformly
+    random subset. The number of labeled examples (W) among them is hypergeometric, and
+    given W the number of positive labels among them (X) is hypergeometric too. Given W,
+    each supported metric is an affine function of X, so its conditional mean and
+    variance follow from those of X, and the overall moments from summing over W.
+
+    Args:
+        metric_function (callable) A function of (tp, fp, fn, tn), as returned by
+            metrics.confusion_matrix_metric
+        cumulative_labeled (np.array) Labeled examples among the top k, indexed by k
+        cumulative_positive (np.array) Positive labels among the top k, indexed by k
+        tie_start (int) The first position of the tie group straddling the cutoff
+        tie_end (int) One past the last position of that tie group
+        cutoff (int) The number of predictions above the threshold
+
+    Returns: (tuple) the expected value and the standard deviation of the metric
+    """
+    num_labeled = int(cumulative_labeled[-1])
+    num_positive = int(cumulative_positive[-1])
+    num_negative = num_labeled - num_positive
+    labeled_above = int(cumulative_labeled[tie_start])
+    positive_above = int(cumulative_positive[tie_start])
+    group_size = tie_end - tie_start
+    group_labeled = int(cumulative_labeled[tie_end]) - labeled_above
+    group_positive = int(cumulative_positive[tie_end]) - positive_above
+    group_negative = group_labeled - group_positive
+    num_drawn = cutoff - tie_start
+
+    def value(num_labeled_drawn, num_positive_drawn):
+        true_positives = positive_above + num_positive_drawn
+        false_positives = labeled_above - positive_above + num_labeled_drawn - num_positive_drawn
+        return metric_function(
+            true_positives,
+            false_positives,
+            num_positive - true_positives,
+            num_negative - false_positives,
+        )
+
+    labeled_drawn = np.arange(
+        max(0, num_drawn - (group_size - group_labeled)),
+        min(num_drawn, group_labeled) + 1
+    )
+    probabilities = hypergeom.pmf(labeled_drawn, group_size, group_labeled, num_drawn)
+    mean = 0.0
+    second_moment = 0.0
+    for num_labeled_drawn, probability in zip(labeled_drawn.tolist(), probabilities.tolist()):
+        if probability == 0:
+            continue
+        lowest = max(0, num_labeled_drawn - group_negative)
+        highest = min(num_labeled_drawn, group_positive)
+        conditional_mean = value(num_labeled_drawn, lowest)
+        conditional_variance = 0.0
+        if highest > lowest:
+            slope = value(num_labeled_drawn, lowest + 1) - conditional_mean
+            positive_fraction = group_positive / group_labeled
+            expected_positive = num_labeled_drawn * positive_fraction
+            conditional_mean += slope * (expected_positive - lowest)
+            conditional_variance = slope ** 2 * (
+                expected_positive
+                * (1 - positive_fraction)
+                * (group_labeled - num_labeled_drawn)
+                / (group_labeled - 1)
+            )
+        mean += probability * conditional_mean
+        second_moment += probability * (conditional_variance + conditional_mean ** 2)
+    return mean, math.sqrt(max(0.0, second_moment - mean ** 2))
+
+
 class MetricDefinition(typing.NamedTuple):
     """A single metric, bound to a particular threshold and parameter combination"""
     metric: str
@@ -175,6 +284,7 @@ class ModelEvaluator:
         db_engine,
         custom_metrics=None,
         bias_config=None,
+        random_tiebreaking="trials",
     ):
         """
         Args:
@@ -207,7 +317,20 @@ class ModelEvaluator:
                 Each function is expected take in the following params:
                 (predictions_proba, predictions_binary, labels, parameters)
                 and return a numeric score
+            random_tiebreaking (string) How to compute the stochastic value and standard
+                deviation of metrics whose best and worst tiebreaking values differ.
+                'trials' (the default) averages SORT_TRIALS random sorts.
+                'analytic' computes the exact expectation and standard deviation
+                from the label counts in tied groups, without any resorting, for
+                the metrics that are functions of the confusion matrix (other
+                metrics still use random trials)
         """
+        if random_tiebreaking not in RANDOM_TIEBREAKING_METHODS:
+            raise ValueError(
+                f"random_tiebreaking must be one of {RANDOM_TIEBREAKING_METHODS}, "
+                f"not {random_tiebreaking}"
+            )
+        self.random_tiebreaking = random_tiebreaking
         self.testing_metric_groups = testing_metric_groups
         self.training_metric_groups = training_metric_groups
         self.db_engine = db_engine
@@ -445,6 +568,12 @@ class ModelEvaluator:
     def _compute_evaluations(self, predictions_proba, labels, metric_definitions):
         """Compute evaluations for a set of predictions and labels
 
+        The labels are scanned once to count labeled examples and positive labels
+        cumulatively, so the confusion matrix at every threshold is read from those counts.
+        Metrics that have a closed form in terms of the confusion matrix (see
+        metrics.CONFUSION_MATRIX_METRICS) are computed from it directly; any other metric,
+        or a metric on labels that are all the same, falls back to its metric function.
+
         Args:
             predictions_proba (np.array) predictions, sorted by score descending
             labels (np.array) labels, sorted however the caller wishes to break ties
@@ -453,18 +582,22 @@ class ModelEvaluator:
         Returns: (list of MetricEvaluationResult objects) One result for each metric definition
         """
         evals = []
+        labels = np.asarray(labels, dtype=float)
+        cumulative_labeled, cumulative_positive = cumulative_label_counts(labels)
+        num_labeled_examples = int(cumulative_labeled[-1])
+        num_positive_labels = int(cumulative_positive[-1])
+        num_negative_labels = num_labeled_examples - num_positive_labels
+        # the closed forms match the metric functions only when both label values are present
+        use_confusion_matrix = 0 < num_positive_labels < num_labeled_examples
         for (threshold_unit, threshold_value), metrics_for_threshold, in \
                 itertools.groupby(metric_definitions, lambda m: (m.threshold_unit, m.threshold_value)):
-            predicted_classes = generate_binary_at_x(
-                predictions_proba, threshold_value, unit=threshold_unit
-            )
-            # filter out null labels
-            predicted_classes_with_labels, present_labels = self._filter_nan_labels(
-                predicted_classes, labels
-            )
-            num_labeled_examples = len(present_labels)
-            num_labeled_above_threshold = np.count_nonzero(predicted_classes_with_labels)
-            num_positive_labels = np.count_nonzero(present_labels)
+            cutoff = threshold_cutoff(len(labels), threshold_value, unit=threshold_unit)
+            num_labeled_above_threshold = int(cumulative_labeled[cutoff])
+            true_positives = int(cumulative_positive[cutoff])
+            false_positives = num_labeled_above_threshold - true_positives
+            false_negatives = num_positive_labels - true_positives
+            true_negatives = num_negative_labels - false_positives
+            predicted_classes_with_labels, present_labels = None, None
             for metric_def in metrics_for_threshold:
                 # using threshold configuration, convert probabilities to predicted classes
                 if len(predictions_proba) == 0:
@@ -474,13 +607,30 @@ class ModelEvaluator:
                     )
                     value = None
                 else:
+                    metric = self.available_metrics[metric_def.metric]
+                    from_confusion_matrix = metrics.confusion_matrix_metric(
+                        metric, metric_def.parameter_combination
+                    ) if use_confusion_matrix else None
                     try:
-                        value = self.available_metrics[metric_def.metric](
-                            predictions_proba,
-                            predicted_classes_with_labels,
-                            present_labels,
-                            metric_def.parameter_combination,
-                        )
+                        if from_confusion_matrix:
+                            value = from_confusion_matrix(
+                                true_positives, false_positives, false_negatives, true_negatives
+                            )
+                        else:
+                            if present_labels is None:
+                                predicted_classes = generate_binary_at_x(
+                                    predictions_proba, threshold_value, unit=threshold_unit
+                                )
+                                # filter out null labels
+                                predicted_classes_with_labels, present_labels = self._filter_nan_labels(
+                                    predicted_classes, labels
+                                )
+                            value = metric(
+                                predictions_proba,
+                                predicted_classes_with_labels,
+                                present_labels,
+                                metric_def.parameter_combination,
+                            )
 
                     except ValueError:
                         logger.warning(
@@ -500,6 +650,49 @@ class ModelEvaluator:
                 evals.append(result)
         return evals
 
+    def _compute_expected_evaluations(self, predictions_proba, labels, metric_definitions):
+        """Compute the exact mean and standard deviation of metrics under random tiebreaking
+
+        Args:
+            predictions_proba (np.array) predictions, sorted by score descending
+            labels (np.array) labels, sorted in the same order
+            metric_definitions (list of MetricDefinition objects) metrics to compute
+
+        Returns: (dict) (mean, standard deviation) tuples keyed on (metric, parameter string),
+            for each metric definition that can be computed from confusion matrix counts
+        """
+        labels = np.asarray(labels, dtype=float)
+        predictions_proba = np.asarray(predictions_proba)
+        cumulative_labeled, cumulative_positive = cumulative_label_counts(labels)
+        if not 0 < cumulative_positive[-1] < cumulative_labeled[-1]:
+            return {}
+        tie_starts = np.flatnonzero(
+            np.concatenate(([True], predictions_proba[1:] != predictions_proba[:-1]))
+        )
+        tie_ends = np.append(tie_starts[1:], len(predictions_proba))
+
+        moments = {}
+        for metric_def in metric_definitions:
+            metric_function = metrics.confusion_matrix_metric(
+                self.available_metrics[metric_def.metric],
+                metric_def.parameter_combination
+            )
+            if not metric_function:
+                continue
+            cutoff = threshold_cutoff(
+                len(predictions_proba), metric_def.threshold_value, unit=metric_def.threshold_unit
+            )
+            tie_group = max(np.searchsorted(tie_starts, cutoff, side="right") - 1, 0)
+            moments[(metric_def.metric, metric_def.parameter_string)] = moments_under_random_ties(
+                metric_function,
+                cumulative_labeled,
+                cumulative_positive,
+                tie_start=int(tie_starts[tie_group]),
+                tie_end=int(tie_ends[tie_group]),
+                cutoff=cutoff,
+            )
+        return moments
+
     def evaluate(self, predictions_proba, matrix_store, model_id, protected_df=None, subset=None):
         """Evaluate a model based on predictions, and save the results
 
@@ -580,13 +773,27 @@ class ModelEvaluator:
             else:
                 metric_defs_to_trial.append(metric_def)
 
-        # 4. get average of n random trials
+        # 4. compute the expected value under random tiebreaking analytically if asked to,
+        # and get average of n random trials for the rest
+        expected_evals = dict()
+        if self.random_tiebreaking == "analytic" and metric_defs_to_trial:
+            expected_evals = self._compute_expected_evaluations(
+                predictions_proba_worst, labels_worst, metric_defs_to_trial
+            )
+            metric_defs_to_trial = [
+                metric_def for metric_def in metric_defs_to_trial
+                if (metric_def.metric, metric_def.parameter_string) not in expected_evals
+            ]
+            logger.debug(
+                f"For model {model_id}, {len(expected_evals)} metric definitions computed analytically under random tiebreaking"
+            )
+
         logger.debug(
             f"For model {model_id}, {len(metric_defs_to_trial)} metric definitions need {SORT_TRIALS} random trials each as best/worst evals were different"
         )
 
         random_eval_accumulator = defaultdict(list)
-        for _ in range(0, SORT_TRIALS):
+        for _ in range(0, SORT_TRIALS if metric_defs_to_trial else 0):
             sort_seed = generate_python_random_seed()
             predictions_proba_random, labels_random = sort_predictions_and_labels(
                 predictions_proba=predictions_proba_worst,
@@ -614,6 +821,9 @@ class ModelEvaluator:
                 stochastic_value = evals_without_trials[metric_key]
                 standard_deviation = 0
                 num_sort_trials = 0
+            elif metric_key in expected_evals:
+                stochastic_value, standard_deviation = expected_evals[metric_key]
+                num_sort_trials = 0
             else:
                 trial_results = [value for value in random_eval_accumulator[metric_key] if value is not None]
                 stochastic_value = statistics.mean(trial_results)
@@ -747,20 +957,64 @@ class ModelEvaluator:
             Bias audit: aequitas_audit() failed.
             Returned empty dataframe for model_id = {model_id}, and subset_hash = {subset_hash}
             and matrix_type = {matrix_type}""")
+        aequitas_obj = matrix_type.aequitas_obj
+        aequitas_keys = [column_attr.key for column_attr in sqlalchemy.inspect(aequitas_obj).column_attrs]
+        group_value_df = group_value_df[[key for key in group_value_df.columns if key in aequitas_keys]]
+        self._save_audit(
+            aequitas_obj,
+            group_value_df,
+            model_id,
+            tie_breaker,
+            subset_hash,
+            evaluation_start_time,
+            evaluation_end_time,
+            matrix_uuid,
+        )
+
+    @db_retry
+    def _save_audit(
+        self,
+        aequitas_obj,
+        group_value_df,
+        model_id,
+        tie_breaker,
+        subset_hash,
+        evaluation_start_time,
+        evaluation_end_time,
+        matrix_uuid,
+    ):
+        """Replace the bias audit rows of a model evaluation in one transaction,
+        retried as a whole on database errors
+
+        Args:
+            aequitas_obj (results_schema table object) the bias table to write to
+            group_value_df (pandas.DataFrame) the audit rows, with the table's columns
+            model_id, tie_breaker, subset_hash, evaluation_start_time,
+                evaluation_end_time, matrix_uuid: the evaluation the rows belong to,
+                as for _write_audit_to_db
+        """
         with scoped_session(self.db_engine) as session:
-            for index, row in group_value_df.iterrows():
-                session.query(matrix_type.aequitas_obj).filter_by(
-                    model_id=row['model_id'],
-                    evaluation_start_time=row['evaluation_start_time'],
-                    evaluation_end_time=row['evaluation_end_time'],
-                    subset_hash=row['subset_hash'],
-                    parameter=row['parameter'],
-                    tie_breaker=row['tie_breaker'],
-                    matrix_uuid=row['matrix_uuid'],
-                    attribute_name=row['attribute_name'],
-                    attribute_value=row['attribute_value']
-                ).delete()
-            session.bulk_insert_mappings(matrix_type.aequitas_obj, group_value_df.to_dict(orient="records"))
+            session.query(aequitas_obj).filter_by(
+                model_id=model_id,
+                evaluation_start_time=evaluation_start_time,
+                evaluation_end_time=evaluation_end_time,
+                subset_hash=subset_hash,
+                tie_breaker=tie_breaker,
+                matrix_uuid=matrix_uuid,
+            ).filter(
+                sqlalchemy.tuple_(
+                    aequitas_obj.parameter,
+                    aequitas_obj.attribute_name,
+                    aequitas_obj.attribute_value,
+                ).in_(list(
+                    group_value_df[["parameter", "attribute_name", "attribute_value"]]
+                    .itertuples(index=False, name=None)
+                ))
+            ).delete(synchronize_session=False)
+            save_db_objects(
+                session.connection(),
+                (aequitas_obj(**record) for record in group_value_df.to_dict(orient="records"))
+            )
 
     @db_retry
     def _write_to_db(
@@ -810,4 +1064,4 @@ class ModelEvaluator:
                 evaluation.as_of_date_frequency = as_of_date_frequency
                 evaluation.matrix_uuid = matrix_uuid
                 evaluation.subset_hash = subset_hash
-                session.add(evaluation)
+            save_db_objects(session.connection(), evaluations)
@@ -137,6 +137,62 @@ def fpr(_, predictions_binary, labels, parameters):
     return float(fp / (len(labels) - np.count_nonzero(labels)))
 
 
+def _divide(numerator, denominator):
+    """Divide, returning 0.0 for a zero denominator as sklearn does"""
+    return numerator / denominator if denominator else 0.0
+
+
+def _fbeta_from_counts(tp, fp, fn, tn, beta):
+    # same order of operations as sklearn.metrics.precision_recall_fscore_support
+    beta2 = beta ** 2
+    precision = _divide(tp, tp + fp)
+    recall = _divide(tp, tp + fn)
+    denom = beta2 * precision + recall
+    if denom == 0.0:
+        denom = 1
+    return (1 + beta2) * precision * recall / denom
+
+
+# Closed-form versions of the thresholded metrics above, computed from the
+# confusion matrix counts (true positives, false positives, false negatives,
+# true negatives) at a threshold. Each metric maps to the function and the set
+# of parameter names it supports. The results are identical to the functions above
+# whenever both label values are present among the labeled examples.
+CONFUSION_MATRIX_METRICS = {
+    precision: (lambda tp, fp, fn, tn: _divide(tp, tp + fp), set()),
+    recall: (lambda tp, fp, fn, tn: _divide(tp, tp + fn), set()),
+    fbeta: (_fbeta_from_counts, {"beta"}),
+    f1: (lambda tp, fp, fn, tn: _fbeta_from_counts(tp, fp, fn, tn, beta=1), set()),
+    accuracy: (lambda tp, fp, fn, tn: (tp + tn) / (tp + fp + fn + tn), set()),
+    true_positives: (lambda tp, fp, fn, tn: int(tp), set()),
+    false_positives: (lambda tp, fp, fn, tn: int(fp), set()),
+    true_negatives: (lambda tp, fp, fn, tn: int(tn), set()),
+    false_negatives: (lambda tp, fp, fn, tn: int(fn), set()),
+    fpr: (lambda tp, fp, fn, tn: float(fp / (fp + tn)), set()),
+}
+
+
+def confusion_matrix_metric(metric, parameters):
+    """Look up the closed-form version of a metric for the given parameters
+
+    Args:
+        metric (callable) A metric function, as found in ModelEvaluator.available_metrics
+        parameters (dict) The parameters the metric is computed with
+
+    Returns: (callable or None) A function of (tp, fp, fn, tn) computing the metric,
+        or None if the metric can't be computed from confusion matrix counts alone
+    """
+    try:
+        function, parameter_names = CONFUSION_MATRIX_METRICS[metric]
+    except (KeyError, TypeError):
+        return None
+    if set(parameters) != parameter_names:
+        return None
+    if parameter_names:
+        return lambda tp, fp, fn, tn: function(tp, fp, fn, tn, **parameters)
+    return function
+
+
 class UnknownMetricError(ValueError):
     """Signifies that a metric name was passed, but no matching computation
     function is available
@@ -18,11 +18,13 @@ from sqlalchemy.orm import sessionmaker
 from triage.util.random import generate_python_random_seed
 from triage.component.results_schema import Model, FeatureImportance
 from triage.component.catwalk.exceptions import BaselineFeatureNotInMatrix
+from triage.component.catwalk.storage import DERIVED_METADATA_KEYS
 from triage.tracking import built_model, skipped_model, errored_model
 
 from .model_grouping import ModelGrouper
 from .feature_importances import get_feature_importances
 from .utils import (
+    call_with_design_matrix,
     filename_friendly_hash,
     retrieve_model_id_from_hash,
     db_retry,
@@ -97,7 +99,13 @@ class ModelTrainer:
             "className": class_path,
             "parameters": self.unique_parameters(parameters),
             "project_path": self.model_storage_engine.project_storage.project_path,
-            "training_metadata": matrix_metadata,
+            # leave out what was recorded after building the matrix, so models
+            # hash the same whether or not their matrix metadata has it
+            "training_metadata": {
+                key: value
+                for key, value in matrix_metadata.items()
+                if key not in DERIVED_METADATA_KEYS
+            },
             "random_seed": random_seed,
         }
         logger.spam(f"Creating model hash from unique data {unique}")
@@ -119,7 +127,9 @@ class ModelTrainer:
         cls = getattr(module, class_name)
         instance = cls(**parameters)
 
-        return instance.fit(matrix_store.design_matrix, matrix_store.labels)
+        return call_with_design_matrix(
+            instance.fit, matrix_store.design_matrix, matrix_store.labels
+        )
 
     @db_retry
     def _save_feature_importances(self, model_id, feature_importances, feature_names):
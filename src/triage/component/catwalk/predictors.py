@@ -1,13 +1,12 @@
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
-import math
-
 import numpy as np
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import or_
 
-from .utils import db_retry, retrieve_model_hash_from_id, save_db_objects, sort_predictions_and_labels, AVAILABLE_TIEBREAKERS
+from .utils import call_with_design_matrix, db_retry, retrieve_model_hash_from_id, save_dataframe, sort_predictions_and_labels, AVAILABLE_TIEBREAKERS
+from triage.component.catwalk.storage import MatrixStore, PredictionsStorageEngine, Store
 from triage.component.results_schema import Model
 from triage.util.db import scoped_session
 from triage.util.random import generate_python_random_seed
@@ -25,7 +24,8 @@ class Predictor:
         db_engine,
         rank_order,
         replace=True,
-        save_predictions=True
+        save_predictions=True,
+        predictions_storage_engine=None,
     ):
         """Encapsulates the task of generating predictions on an arbitrary
         dataset and storing the results
@@ -34,6 +34,9 @@ class Predictor:
             model_storage_engine (catwalk.storage.ModelStorageEngine)
             db_engine (sqlalchemy.engine)
             rank_order
+            predictions_storage_engine (catwalk.storage.PredictionsStorageEngine, optional)
+                If given, predictions are saved to files in project storage instead
+                of the predictions tables, which only get a pointer to each file
 
         """
         self.model_storage_engine = model_storage_engine
@@ -41,6 +44,7 @@ class Predictor:
         self.rank_order = rank_order
         self.replace = replace
         self.save_predictions = save_predictions
+        self.predictions_storage_engine = predictions_storage_engine
 
     @property
     def sessionmaker(self):
@@ -95,6 +99,8 @@ class Predictor:
         """
         if not self.save_predictions:
             return False
+        if self.predictions_storage_engine:
+            return self._saved_predictions_path(model_id, matrix_store) is None
         session = self.sessionmaker()
         prediction_obj = matrix_store.matrix_type.prediction_obj
         as_of_dates_in_db = set(
@@ -110,17 +116,68 @@ class Predictor:
         return needed
 
     @db_retry
-    def _load_saved_predictions(self, existing_predictions, matrix_store):
-        index = matrix_store.index
-        score_lookup = {}
-        for prediction in existing_predictions:
-            score_lookup[
-                (prediction.entity_id, prediction.as_of_date.date())
-            ] = prediction.score
-        score_iterator = (
-            score_lookup[(entity_id, dt.date())] for (entity_id, dt) in index
+    def _saved_predictions_path(self, model_id, matrix_store):
+        """The path of the predictions file saved for the given model and matrix, if
+        the prediction metadata points to one that exists"""
+        with scoped_session(self.db_engine) as session:
+            predictions_path = session.query(
+                matrix_store.matrix_type.prediction_metadata_obj.predictions_path
+            ).filter_by(model_id=model_id, matrix_uuid=matrix_store.uuid).scalar()
+        if predictions_path and Store.factory(predictions_path).exists():
+            return predictions_path
+        return None
+
+    def _align_saved_predictions(self, predictions, matrix_store):
+        """Line up saved scores with the rows of the matrix
+
+        Args:
+            predictions (pd.DataFrame) with entity_id, as_of_date and score columns
+            matrix_store (catwalk.storage.MatrixStore) the matrix the scores are for
+
+        Returns: (np.array) the scores in the order of the matrix index, or None if
+            the saved predictions do not cover exactly the rows of the matrix
+        """
+        if len(predictions) != matrix_store.num_observations:
+            logger.spam(f"Existing predictions length: {len(predictions)}, Length of matrix: {matrix_store.num_observations}")
+            return None
+        scores = (
+            predictions.set_index(MatrixStore.indices)["score"]
+            .reindex(matrix_store.index)
+            .to_numpy(dtype=float)
+        )
+        if np.isnan(scores).any():
+            logger.spam("Existing predictions do not match the entities and dates of the matrix")
+            return None
+        return scores
+
+    def _load_saved_predictions_from_file(self, predictions_path, matrix_store):
+        predictions = PredictionsStorageEngine.load(
+            predictions_path, columns=["entity_id", "as_of_date", "score"]
+        )
+        return self._align_saved_predictions(predictions, matrix_store)
+
+    @db_retry
+    def _load_saved_predictions(self, model_id, matrix_store):
+        """Load the scores saved in the predictions table for a model on the as-of-dates
+        of a matrix, with a single COPY
+
+        Returns: (np.array) the scores in the order of the matrix index, or None if
+            the saved predictions do not cover exactly the rows of the matrix
+        """
+        as_of_dates_sql = ", ".join(
+            f"'{as_of_date}'::timestamp" for as_of_date in matrix_store.as_of_dates
+        )
+        predictions = pd.DataFrame.pg_copy_from(
+            f"""
+            select entity_id, as_of_date, score
+            from {matrix_store.matrix_type.prediction_obj.__table__.fullname}
+            where model_id = {int(model_id)}
+            and as_of_date in ({as_of_dates_sql})
+            """,
+            connectable=self.db_engine,
+            parse_dates=["as_of_date"],
         )
-        return np.fromiter(score_iterator, float)
+        return self._align_saved_predictions(predictions, matrix_store)
 
     @db_retry
     def _write_predictions_to_db(
@@ -148,40 +205,52 @@ class Predictor:
             existing_predictions = self._existing_predictions(
                 Prediction_obj, session, model_id, matrix_store
             )
-            if existing_predictions.count() > 0:
-                existing_predictions.delete(synchronize_session=False)
+            if existing_predictions.delete(synchronize_session=False) > 0:
                 logger.info(f"Found old predictions for model {model_id} on {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid}. Those predictions were deleted.")
             session.expire_all()
             session.commit()
         finally:
             session.close()
-        test_label_timespan = matrix_store.metadata["label_timespan"]
-
-        record_stream = (
-            Prediction_obj(
-                model_id=int(model_id),
-                entity_id=int(row.entity_id),
-                as_of_date=row.as_of_date,
-                score=float(row.score),
-                label_value=int(row.label_value) if not math.isnan(row.label_value) else None,
-                rank_abs_no_ties = int(row.rank_abs_no_ties),
-                rank_abs_with_ties = int(row.rank_abs_with_ties),
-                rank_pct_no_ties = row.rank_pct_no_ties,
-                rank_pct_with_ties = row.rank_pct_with_ties,
-                matrix_uuid=matrix_store.uuid,
-                test_label_timespan=test_label_timespan,
-                **misc_db_parameters
-            ) for row in df.itertuples()
+        predictions = pd.DataFrame({
+            "model_id": int(model_id),
+            "entity_id": df["entity_id"].astype("int64"),
+            "as_of_date": df["as_of_date"],
+            "score": df["score"],
+            "label_value": df["label_value"].astype("Int64"),
+            "rank_abs_no_ties": df["rank_abs_no_ties"].astype("int64"),
+            "rank_abs_with_ties": df["rank_abs_with_ties"].astype("int64"),
+            "rank_pct_no_ties": df["rank_pct_no_ties"],
+            "rank_pct_with_ties": df["rank_pct_with_ties"],
+            "matrix_uuid": matrix_store.uuid,
+            "test_label_timespan": matrix_store.metadata["label_timespan"],
+        }).assign(**misc_db_parameters)
+        save_dataframe(self.db_engine, predictions, Prediction_obj)
+
+    def _write_predictions_to_file(self, model_id, matrix_store, df):
+        """Writes given predictions to a file in project storage
+
+        Args:
+            model_id (int) the id of the model associated with the given predictions
+            matrix_store (catwalk.storage.MatrixStore) the matrix and metadata
+            df (pd.DataFrame) with the following columns entity_id, as_of_date, score, label_value and rank_abs_no_ties, rank_abs_with_ties, rank_pct_no_ties, rank_pct_with_ties
+
+        Returns: (string) the path of the predictions file
+        """
+        model_hash = retrieve_model_hash_from_id(self.db_engine, model_id)
+        return self.predictions_storage_engine.write(
+            df.astype({"rank_abs_no_ties": "int64", "rank_abs_with_ties": "int64"}),
+            model_hash,
+            matrix_store.uuid,
         )
-        save_db_objects(self.db_engine, record_stream)
 
-    def _write_metadata_to_db(self, model_id, matrix_uuid, matrix_type, random_seed):
+    def _write_metadata_to_db(self, model_id, matrix_uuid, matrix_type, random_seed, predictions_path=None):
         orm_obj = matrix_type.prediction_metadata_obj(
             model_id=model_id,
             matrix_uuid=matrix_uuid,
             tiebreaker_ordering=self.rank_order,
             random_seed=random_seed,
             predictions_saved=self.save_predictions,
+            predictions_path=predictions_path,
         )
         session = self.sessionmaker()
         session.merge(orm_obj)
@@ -242,24 +311,31 @@ class Predictor:
         # Setting the Prediction object type - TrainPrediction or TestPrediction
         matrix_type = matrix_store.matrix_type
 
-        if not self.replace:
+        if not self.replace and self.predictions_storage_engine:
+            logger.info(
+                f"Replace flag not set, looking for an old predictions file for model id {model_id} "
+                f"on {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid}"
+            )
+            predictions_path = self._saved_predictions_path(model_id, matrix_store)
+            saved_predictions = None
+            if predictions_path:
+                saved_predictions = self._load_saved_predictions_from_file(predictions_path, matrix_store)
+            if saved_predictions is not None:
+                logger.info(
+                    f"Found old predictions for model id {model_id}, matrix {matrix_store.uuid} in {predictions_path}, returning saved versions"
+                )
+                return saved_predictions
+        elif not self.replace:
             logger.info(
                 f"Replace flag not set, looking for old predictions for model id {model_id} "
                 f"on {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid}"
             )
-            try:
-                session = self.sessionmaker()
-                existing_predictions = self._existing_predictions(
-                    matrix_type.prediction_obj, session, model_id, matrix_store
+            saved_predictions = self._load_saved_predictions(model_id, matrix_store)
+            if saved_predictions is not None:
+                logger.info(
+                    f"Found old predictions for model id {model_id}, matrix {matrix_store.uuid}, returning saved versions"
                 )
-                logger.spam(f"Existing predictions length: {existing_predictions.count()}, Length of matrix: {len(matrix_store.index)}")
-                if existing_predictions.count() == len(matrix_store.index):
-                    logger.info(
-                        f"Found old predictions for model id {model_id}, matrix {matrix_store.uuid}, returning saved versions"
-                    )
-                    return self._load_saved_predictions(existing_predictions, matrix_store)
-            finally:
-                session.close()
+                return saved_predictions
 
         model = self.load_model(model_id)
         if not model:
@@ -269,14 +345,16 @@ class Predictor:
         # Labels are popped from matrix (i.e. they are removed and returned)
         labels = matrix_store.labels
 
-        predictions = model.predict_proba(
-            matrix_store.matrix_with_sorted_columns(train_matrix_columns)
+        predictions = call_with_design_matrix(
+            model.predict_proba,
+            matrix_store.matrix_with_sorted_columns(train_matrix_columns),
         )[:, 1]  # Returning only the scores for the label == 1
 
 
         logger.debug(
             f"Generated predictions for model {model_id} on {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid}"
         )
+        predictions_path = None
         if self.save_predictions:
             df = pd.DataFrame(data=None, columns=None, index=matrix_store.index)
             df['label_value'] = matrix_store.labels
@@ -307,20 +385,26 @@ class Predictor:
             df.reset_index(inplace=True)
             logger.debug(f"Predictions on {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid} from model {model_id} sorted using {self.rank_order}")
 
-            logger.spam(
-                f"Writing predictions for model {model_id} on {matrix_store.matrix_type.string_name}  matrix {matrix_store.uuid} to database"
-            )
+            if self.predictions_storage_engine:
+                predictions_path = self._write_predictions_to_file(model_id, matrix_store, df)
+                logger.debug(
+                    f"Wrote predictions for model {model_id} on {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid} to {predictions_path}"
+                )
+            else:
+                logger.spam(
+                    f"Writing predictions for model {model_id} on {matrix_store.matrix_type.string_name}  matrix {matrix_store.uuid} to database"
+                )
 
-            self._write_predictions_to_db(
-                model_id,
-                matrix_store,
-                df,
-                misc_db_parameters,
-                matrix_type.prediction_obj,
-            )
-            logger.debug(
-                f"Wrote predictions for model {model_id} on  {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid} to database"
-            )
+                self._write_predictions_to_db(
+                    model_id,
+                    matrix_store,
+                    df,
+                    misc_db_parameters,
+                    matrix_type.prediction_obj,
+                )
+                logger.debug(
+                    f"Wrote predictions for model {model_id} on  {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid} to database"
+                )
         else:
             logger.notice(
                 f"Predictions for model {model_id} on {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid}  weren't written to the db because, because you asked not to do so"
@@ -332,6 +416,7 @@ class Predictor:
             matrix_uuid=matrix_store.uuid,
             matrix_type=matrix_type,
             random_seed=None,
+            predictions_path=predictions_path,
         )
 
         return predictions
@@ -7,13 +7,20 @@ logger = verboselogs.VerboseLogger(__name__)
 
 import os
 import pathlib
+import shutil
 from contextlib import contextmanager
 from os.path import dirname
 from urllib.parse import urlparse
 
 import gzip
+import io
+import json
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import s3fs
+import scipy.sparse
 import wrapt
 import yaml
 import joblib
@@ -28,7 +35,7 @@ from triage.component.results_schema import (
     TestAequitas,
     TrainAequitas
 )
-from triage.util.pandas import downcast_matrix
+from triage.util.pandas import downcast_matrix, from_csr, to_csr
 
 
 class Store:
@@ -77,6 +84,11 @@ class Store:
         with self.open("wb") as fd:
             fd.write(bytestream)
 
+    def copy_from(self, store):
+        """Copy the object of another store here"""
+        with store.open("rb") as source, self.open("wb") as destination:
+            shutil.copyfileobj(source, destination)
+
     def open(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -122,6 +134,10 @@ class S3Store(Store):
         )
         self.config = config
 
+    @property
+    def url(self):
+        return f"s3://{self.path}"
+
     @property
     def client(self):
         return s3fs.S3FileSystem(**self.config)
@@ -132,6 +148,12 @@ class S3Store(Store):
     def delete(self):
         self.client.rm(self.path)
 
+    def copy_from(self, store):
+        """Copy the object of another store here, within S3 if it is there too"""
+        if not isinstance(store, S3Store):
+            return super().copy_from(store)
+        self.client.copy(store.path, self.path)
+
     def open(self, *args, **kwargs):
         # NOTE: remove S3FileWrapper as soon as s3fs properly
         # NOTE: chunks out too-large writes
@@ -160,13 +182,33 @@ class FSStore(Store):
         self.path = pathlib.Path(*pathparts)
         os.makedirs(dirname(self.path), exist_ok=True)
 
+    @property
+    def url(self):
+        return str(self.path)
+
     def exists(self):
         return os.path.isfile(self.path)
 
     def delete(self):
         os.remove(self.path)
 
+    def copy_from(self, store):
+        """Hard-link the file of another local store here, or copy it if it can't be linked"""
+        if not isinstance(store, FSStore):
+            return super().copy_from(store)
+        if self.exists():
+            self.delete()
+        try:
+            os.link(store.path, self.path)
+        except OSError:
+            shutil.copyfile(store.path, self.path)
+
     def open(self, *args, **kwargs):
+        mode = args[0] if args else kwargs.get("mode", "r")
+        if "w" in mode and self.exists():
+            # replace the file rather than truncate it, so that the files
+            # hard-linked to it by copy_from keep their content
+            self.delete()
         return open(self.path, *args, **kwargs)
 
 
@@ -215,6 +257,16 @@ class ProjectStorage:
         """
         return ModelStorageEngine(self, model_directory)
 
+    def predictions_storage_engine(self, predictions_directory=None):
+        """Return a predictions storage engine bound to this project's storage
+
+        Args:
+            predictions_directory (string, optional) A directory to store predictions
+                If not passed will allow the PredictionsStorageEngine to decide
+        Returns: triage.component.catwalk.storage.PredictionsStorageEngine
+        """
+        return PredictionsStorageEngine(self, predictions_directory)
+
 
 class ModelStorageEngine:
     """Store arbitrary models in a given project storage using joblib
@@ -297,6 +349,80 @@ class ModelStorageEngine:
         return self.project_storage.get_store(self.directories, model_hash)
 
 
+class PredictionsStorageEngine:
+    """Store predictions in a given project storage, one Parquet file per model and matrix
+
+    An alternative to the predictions tables for large cohorts: the database only
+    keeps the path of each file, in the prediction_metadata tables.
+
+    Args:
+        project_storage (triage.component.catwalk.storage.ProjectStorage)
+            A project file storage engine
+        predictions_directory (string, optional) A directory name for predictions.
+            Defaults to 'predictions'
+    """
+    columns = [
+        "entity_id",
+        "as_of_date",
+        "score",
+        "label_value",
+        "rank_abs_no_ties",
+        "rank_abs_with_ties",
+        "rank_pct_no_ties",
+        "rank_pct_with_ties",
+    ]
+
+    def __init__(self, project_storage, predictions_directory=None):
+        self.project_storage = project_storage
+        self.directories = [predictions_directory or "predictions"]
+
+    def get_store(self, model_hash, matrix_uuid):
+        """Return a storage object for the predictions of a model on a matrix
+
+        Args:
+            model_hash (string) An identifier, unique within this project, for the model
+            matrix_uuid (string) A unique identifier within the project for a matrix.
+
+        Returns: (Store) a reference to the predictions file
+        """
+        return self.project_storage.get_store(
+            self.directories, f"{model_hash}_{matrix_uuid}.parquet"
+        )
+
+    def write(self, predictions, model_hash, matrix_uuid):
+        """Persist the predictions of a model on a matrix
+
+        Args:
+            predictions (pandas.DataFrame) The predictions, with (at least) the
+                entity_id, as_of_date, score, label_value and rank columns
+            model_hash (string) An identifier, unique within this project, for the model
+            matrix_uuid (string) A unique identifier within the project for a matrix.
+
+        Returns: (string) The path of the predictions file, to record in the database
+        """
+        store = self.get_store(model_hash, matrix_uuid)
+        table = pa.Table.from_pandas(predictions[self.columns], preserve_index=False)
+        with store.open("wb") as fd:
+            pq.write_table(table, fd)
+        return store.url
+
+    @staticmethod
+    def load(predictions_path, columns=None):
+        """Load predictions written by a PredictionsStorageEngine
+
+        Only needs the path recorded in the database, not the project storage,
+        so it can be used by anything reading the prediction_metadata tables.
+
+        Args:
+            predictions_path (string) The path of the predictions file
+            columns (list, optional) The columns to read. Defaults to all
+
+        Returns: (pandas.DataFrame) The predictions
+        """
+        with Store.factory(predictions_path).open("rb") as fd:
+            return pq.read_table(fd, columns=columns).to_pandas()
+
+
 class MatrixStorageEngine:
     """Store matrices in a given project storage
 
@@ -327,6 +453,18 @@ class MatrixStorageEngine:
         )
 
 
+# metadata recorded about what a stored matrix turned out to hold, rather
+# than how it was planned: its shape (see MatrixStore.shape_metadata) and the
+# content hash given to it by the matrix builder
+DERIVED_METADATA_KEYS = (
+    "columns",
+    "as_of_dates",
+    "num_observations",
+    "num_entities",
+    "content_hash",
+)
+
+
 class MatrixStore:
     """Base class for classes that allow access of a matrix and its metadata.
 
@@ -392,11 +530,15 @@ class MatrixStore:
         design_matrix = matrix_with_labels
         return design_matrix, labels
 
+    def _load_matrix_label_tuple(self):
+        """Load the matrix from storage and split it into design matrix and labels"""
+        return self._preprocess_and_split_matrix(self._load())
+
     @property
     def matrix_label_tuple(self):
         if self._matrix_label_tuple:
             return self._matrix_label_tuple
-        design_matrix, labels = self._preprocess_and_split_matrix(self._load())
+        design_matrix, labels = self._load_matrix_label_tuple()
         if self.should_cache:
             self._matrix_label_tuple = design_matrix, labels
         return design_matrix, labels
@@ -438,24 +580,69 @@ class MatrixStore:
         """Whether or not the matrix and metadata exist in storage"""
         return self.matrix_base_store.exists() and self.metadata_base_store.exists()
 
+    def _from_metadata(self, key):
+        """A value recorded in the metadata by the matrix builder, or None if not recorded"""
+        try:
+            metadata = self.metadata
+        except FileNotFoundError:
+            return None
+        return (metadata or {}).get(key)
+
+    @staticmethod
+    def shape_metadata(design_matrix):
+        """Metadata describing the shape of a design matrix
+
+        Recorded alongside the matrix so that its columns, as-of-dates and size
+        can be answered without loading the matrix body.
+
+        Args:
+            design_matrix (pandas.DataFrame) A matrix indexed by entity_id and as_of_date,
+                without the label column
+
+        Returns: (dict)
+        """
+        as_of_dates = design_matrix.index.get_level_values("as_of_date").unique()
+        return {
+            "columns": design_matrix.columns.tolist(),
+            "as_of_dates": sorted(pd.to_datetime(as_of_dates).date.tolist()),
+            "num_observations": int(len(design_matrix)),
+            "num_entities": int(
+                design_matrix.index.get_level_values("entity_id").nunique()
+            ),
+        }
+
     @property
     def empty(self):
         """Whether or not the matrix has at least one row"""
         if not self.matrix_base_store.exists():
             return True
-        else:
-            head_of_matrix = self.head_of_matrix
-            return head_of_matrix.empty
+        num_observations = self._from_metadata("num_observations")
+        if num_observations is not None:
+            return num_observations == 0
+        return self._empty_in_storage()
+
+    def _empty_in_storage(self):
+        return self.head_of_matrix.empty
 
     def columns(self, include_label=False):
-        """The matrix's column list"""
-        head_of_matrix = self.head_of_matrix
-        columns = head_of_matrix.columns.tolist()
+        """The matrix's column list
+
+        Read from the metadata if recorded by the matrix builder, else from storage
+        """
+        feature_columns = self._from_metadata("columns")
+        if feature_columns is not None:
+            columns = list(feature_columns) + [self.label_column_name]
+        else:
+            columns = self._columns_in_storage()
         if include_label:
             return columns
         else:
             return [col for col in columns if col != self.metadata["label_name"]]
 
+    def _columns_in_storage(self):
+        """All of the stored columns (features and label), without the indices"""
+        return self.head_of_matrix.columns.tolist()
+
     @property
     def label_column_name(self):
         return self.metadata["label_name"]
@@ -474,18 +661,32 @@ class MatrixStore:
     @property
     def as_of_dates(self):
         """All as-of-dates in the matrix. Will be converted to datetime.date"""
+        as_of_dates = self._from_metadata("as_of_dates")
+        if as_of_dates is not None:
+            return list(as_of_dates)
         return sorted(set(
             as_of_date.date() if hasattr(as_of_date, 'date') else as_of_date
-            for entity_id, as_of_date in self.design_matrix.index
+            for as_of_date in self.design_matrix.index.get_level_values("as_of_date").unique()
         ))
 
     @property
     def num_entities(self):
         """The number of entities in the matrix"""
+        num_entities = self._from_metadata("num_entities")
+        if num_entities is not None:
+            return num_entities
         return len(
             self.design_matrix.index.levels[self.design_matrix.index.names.index("entity_id")]
         )
 
+    @property
+    def num_observations(self):
+        """The number of rows in the matrix"""
+        num_observations = self._from_metadata("num_observations")
+        if num_observations is not None:
+            return num_observations
+        return len(self.design_matrix)
+
     @property
     def matrix_type(self):
         """The MatrixType (train or test). Returns an object with:
@@ -518,7 +719,7 @@ class MatrixStore:
         if columnset == desired_columnset:
             if self.columns() != columns:
                 logger.debug("Column orders not the same, re-ordering")
-            return self.design_matrix[columns]
+            return self._design_matrix_columns(columns)
         else:
             if columnset.issuperset(desired_columnset):
                 raise ValueError(
@@ -542,6 +743,37 @@ class MatrixStore:
                     columnset ^ desired_columnset,
                 )
 
+    def _design_matrix_columns(self, columns):
+        """Return the design matrix restricted to (and ordered by) the given columns
+
+        Subclasses that can read a subset of columns from storage may override this
+        to avoid loading the whole matrix.
+        """
+        return self.design_matrix[columns]
+
+    def load_subset(self, as_of_dates=None, columns=None):
+        """Return the design matrix and labels restricted to some as-of-dates and columns
+
+        The base implementation filters the full matrix in memory. Subclasses that
+        can push these filters down to storage may override it.
+
+        Args:
+            as_of_dates (list, optional) The as-of-dates to keep. Defaults to all
+            columns (list, optional) The feature columns to keep. Defaults to all
+
+        Returns: (tuple) the design matrix (pandas.DataFrame) and labels (pandas.Series)
+        """
+        design_matrix, labels = self.matrix_label_tuple
+        if as_of_dates is not None:
+            rows = design_matrix.index.get_level_values("as_of_date").isin(
+                pd.to_datetime(list(as_of_dates))
+            )
+            design_matrix = design_matrix[rows]
+            labels = labels[rows]
+        if columns is not None:
+            design_matrix = design_matrix[columns]
+        return design_matrix, labels
+
     @property
     def full_matrix_for_saving(self):
         return self.design_matrix.assign(**{self.label_column_name: self.labels})
@@ -554,6 +786,73 @@ class MatrixStore:
     def save(self):
         raise NotImplementedError
 
+    def _save_metadata(self):
+        with self.metadata_base_store.open("wb") as fd:
+            yaml.dump(self.metadata, fd, encoding="utf-8")
+
+    @property
+    def _data_stores(self):
+        """The stores holding the matrix itself, i.e. all but the metadata"""
+        return [self.matrix_base_store]
+
+    def _delete_stored_metadata(self):
+        """Delete the stored metadata, keeping it in memory, so that the matrix
+        does not `exist` while its files are being rewritten
+        """
+        if self.metadata_base_store.exists():
+            # load it first, in case it was not set
+            self.metadata = self.metadata
+            self.metadata_base_store.delete()
+
+    def copy_from(self, matrix_store):
+        """Store the content of another stored matrix of the same format as this one
+
+        The files of the matrix are copied (or hard-linked where the storage allows
+        it), and its metadata is saved updated with this store's metadata, which
+        must be set beforehand.
+
+        Args:
+            matrix_store (MatrixStore) The matrix to copy
+        """
+        if type(matrix_store) is not type(self):
+            raise ValueError(
+                f"Cannot copy a {type(matrix_store).__name__} to a {type(self).__name__}"
+            )
+        self._delete_stored_metadata()
+        for store, source_store in zip(self._data_stores, matrix_store._data_stores):
+            store.copy_from(source_store)
+        self.metadata = dict(matrix_store.metadata, **self.metadata)
+        self._save_metadata()
+
+    @contextmanager
+    def chunk_writer(self, num_rows=None):
+        """Save the matrix a chunk of rows at a time
+
+        Must be used as a context manager, which yields a function taking the
+        design matrix and labels of a chunk. The metadata (which must include the
+        label name before the first chunk) is saved when the context exits
+        without error, and any stored metadata is deleted before the first chunk
+        is written, so a partially written matrix never `exists`.
+
+        This implementation gathers the chunks and saves them at once;
+        subclasses able to append to storage write each chunk as it comes.
+
+        Args:
+            num_rows (int, optional) The total number of rows to be written
+        """
+        self._delete_stored_metadata()
+        chunks = []
+
+        def write_chunk(design_matrix, labels):
+            chunks.append((design_matrix, labels))
+
+        yield write_chunk
+        self.matrix_label_tuple = (
+            pd.concat([design_matrix for design_matrix, _ in chunks]),
+            pd.concat([labels for _, labels in chunks]),
+        )
+        self.save()
+
     def clear_cache(self):
         self._matrix_label_tuple = None
 
@@ -590,8 +889,500 @@ class CSVMatrixStore(MatrixStore):
 
     def save(self):
         self.matrix_base_store.write(gzip.compress(self.full_matrix_for_saving.to_csv(None).encode("utf-8")))
-        with self.metadata_base_store.open("wb") as fd:
-            yaml.dump(self.metadata, fd, encoding="utf-8")
+        self._save_metadata()
+
+    @contextmanager
+    def chunk_writer(self, num_rows=None):
+        self._delete_stored_metadata()
+        with self.matrix_base_store.open("wb") as fd:
+            with gzip.GzipFile(fileobj=fd, mode="wb") as compressed:
+                text = io.TextIOWrapper(compressed, encoding="utf-8")
+                chunks_written = 0
+
+                def write_chunk(design_matrix, labels):
+                    nonlocal chunks_written
+                    design_matrix.assign(**{self.label_column_name: labels}).to_csv(
+                        text, header=chunks_written == 0
+                    )
+                    chunks_written += 1
+
+                yield write_chunk
+                text.flush()
+                text.detach()
+        self._save_metadata()
+
+
+class ParquetMatrixStore(MatrixStore):
+    """Store and access matrices using Parquet
+
+    The index, features and label are stored as typed columns (features and label
+    as float32), with one row group per as-of-date. This allows loading only some
+    of the columns or only some of the as-of-dates without reading the whole file.
+
+    Rows are stored grouped by as-of-date and returned sorted by the matrix index.
+    """
+
+    suffix = "parquet"
+    as_of_dates_metadata_key = b"triage.row_group_as_of_dates"
+
+    @contextmanager
+    def _parquet_file(self):
+        with self.matrix_base_store.open("rb") as fd:
+            yield pq.ParquetFile(fd)
+
+    def _row_group_as_of_dates(self, parquet_file):
+        """The as-of-date stored in each row group, as recorded at save time"""
+        file_metadata = parquet_file.metadata.metadata or {}
+        if self.as_of_dates_metadata_key not in file_metadata:
+            # matrices saved in chunks only know their row groups once written,
+            # after the Parquet schema, so they record them with the metadata
+            row_group_as_of_dates = self._from_metadata("row_group_as_of_dates")
+            if row_group_as_of_dates is None:
+                return None
+            return pd.to_datetime(row_group_as_of_dates)
+        return pd.to_datetime(json.loads(file_metadata[self.as_of_dates_metadata_key]))
+
+    def _read_table(self, columns=None, as_of_dates=None):
+        """Read the matrix file into a pandas DataFrame (without setting the index)
+
+        Args:
+            columns (list, optional) non-index columns to read. Defaults to all
+            as_of_dates (list, optional) as-of-dates to read. Defaults to all
+        """
+        if columns is not None:
+            columns = self.indices + [column for column in columns if column not in self.indices]
+        with self._parquet_file() as parquet_file:
+            row_groups = list(range(parquet_file.num_row_groups))
+            if as_of_dates is not None:
+                wanted = set(pd.to_datetime(list(as_of_dates)))
+                row_group_dates = self._row_group_as_of_dates(parquet_file)
+                if row_group_dates is not None and len(row_group_dates) == len(row_groups):
+                    row_groups = [
+                        row_group for row_group in row_groups
+                        if row_group_dates[row_group] in wanted
+                    ]
+            if row_groups:
+                df = pa.concat_tables([
+                    parquet_file.read_row_group(row_group, columns=columns)
+                    for row_group in row_groups
+                ]).to_pandas()
+            else:
+                df = parquet_file.schema.to_arrow_schema().empty_table().to_pandas()
+                if columns is not None:
+                    df = df[columns]
+
+        if as_of_dates is not None:
+            df = df[df["as_of_date"].isin(pd.to_datetime(list(as_of_dates)))]
+        if len(row_groups) > 1:
+            df.sort_values(self.indices, inplace=True, kind="mergesort", ignore_index=True)
+        return df
+
+    @property
+    def head_of_matrix(self):
+        try:
+            with self._parquet_file() as parquet_file:
+                if parquet_file.num_row_groups:
+                    table = parquet_file.read_row_group(0).slice(0, 1)
+                else:
+                    table = parquet_file.schema.to_arrow_schema().empty_table()
+            head_of_matrix = table.to_pandas()
+            head_of_matrix.set_index(self.indices, inplace=True)
+        except FileNotFoundError as fnfe:
+            logger.exception(f"Matrix {self.uuid} not found Returning Empty data frame")
+            head_of_matrix = pd.DataFrame()
+
+        return head_of_matrix
+
+    def _empty_in_storage(self):
+        with self._parquet_file() as parquet_file:
+            return parquet_file.metadata.num_rows == 0
+
+    def _columns_in_storage(self):
+        with self._parquet_file() as parquet_file:
+            return [
+                column for column in parquet_file.schema.names
+                if column not in self.indices
+            ]
+
+    def _design_matrix_columns(self, columns):
+        if self._matrix_label_tuple is not None:
+            return super()._design_matrix_columns(columns)
+        design_matrix = self._read_table(columns=columns)
+        design_matrix.set_index(self.indices, inplace=True)
+        return downcast_matrix(design_matrix)[columns]
+
+    def load_subset(self, as_of_dates=None, columns=None):
+        if self._matrix_label_tuple is not None:
+            return super().load_subset(as_of_dates=as_of_dates, columns=columns)
+        if columns is not None:
+            columns = list(columns) + [self.label_column_name]
+        design_matrix, labels = self._preprocess_and_split_matrix(
+            self._read_table(columns=columns, as_of_dates=as_of_dates)
+        )
+        return design_matrix, labels
+
+    def _load(self):
+        return self._read_table()
+
+    def save(self):
+        matrix = self.full_matrix_for_saving
+        if matrix.index.names == self.indices:
+            matrix = matrix.reset_index()
+        to_float32 = {
+            column: np.float32 for column in matrix.columns
+            if column not in self.indices and matrix[column].dtype != np.float32
+        }
+        if to_float32:
+            matrix = matrix.astype(to_float32)
+
+        if "as_of_date" in matrix.columns:
+            groups = [group for _, group in matrix.groupby("as_of_date", sort=True)]
+        else:
+            groups = [matrix]
+        schema = pa.Schema.from_pandas(matrix, preserve_index=False)
+        if "as_of_date" in matrix.columns:
+            schema = schema.with_metadata({
+                **(schema.metadata or {}),
+                self.as_of_dates_metadata_key: json.dumps(
+                    [str(group["as_of_date"].iloc[0]) for group in groups]
+                ).encode("utf-8"),
+            })
+
+        with self.matrix_base_store.open("wb") as fd:
+            writer = pq.ParquetWriter(fd, schema)
+            try:
+                for group in groups:
+                    writer.write_table(
+                        pa.Table.from_pandas(group, schema=schema, preserve_index=False)
+                    )
+            finally:
+                writer.close()
+        self._save_metadata()
+
+    @contextmanager
+    def chunk_writer(self, num_rows=None):
+        self._delete_stored_metadata()
+        row_group_as_of_dates = []
+        writer = None
+        with self.matrix_base_store.open("wb") as fd:
+            def write_chunk(design_matrix, labels):
+                nonlocal writer
+                matrix = design_matrix.assign(**{self.label_column_name: labels}).reset_index()
+                matrix = matrix.astype({
+                    column: np.float32 for column in matrix.columns
+                    if column not in self.indices and matrix[column].dtype != np.float32
+                })
+                if writer is None:
+                    writer = pq.ParquetWriter(
+                        fd, pa.Schema.from_pandas(matrix, preserve_index=False)
+                    )
+                for as_of_date, group in matrix.groupby("as_of_date", sort=True):
+                    writer.write_table(
+                        pa.Table.from_pandas(group, schema=writer.schema, preserve_index=False)
+                    )
+                    row_group_as_of_dates.append(str(as_of_date))
+
+            try:
+                yield write_chunk
+            finally:
+                if writer is not None:
+                    writer.close()
+        self.metadata = dict(self.metadata, row_group_as_of_dates=row_group_as_of_dates)
+        self._save_metadata()
+
+
+class MemmapMatrixStore(MatrixStore):
+    """Store and access matrices as a raw float32 array that is memory-mapped on load
+
+    The design matrix is written once as a C-contiguous float32 `.npy` file, and the
+    index, labels and column names go to a separate `.index.npz` file. On a local
+    filesystem the design matrix is returned as a read-only DataFrame backed by
+    `np.memmap`, so processes loading the same matrix (e.g. the train/test workers of
+    a MultiCoreExperiment) share the same page cache pages instead of each holding
+    their own copy. On other storage media the array is read into memory.
+    """
+
+    suffix = "npy"
+    save_chunksize = 100000
+
+    def __init__(
+        self, project_storage, directories, matrix_uuid, matrix=None, metadata=None
+    ):
+        self.index_base_store = project_storage.get_store(
+            directories, f"{matrix_uuid}.index.npz"
+        )
+        super().__init__(
+            project_storage, directories, matrix_uuid, matrix=matrix, metadata=metadata
+        )
+
+    @property
+    def exists(self):
+        return super().exists and self.index_base_store.exists()
+
+    @property
+    def _data_stores(self):
+        return [self.matrix_base_store, self.index_base_store]
+
+    def _load_index(self, *keys):
+        """Load the index, labels and/or column names, without touching the design matrix
+
+        Args:
+            *keys: the arrays to load (entity_id, as_of_date, label, columns).
+                Defaults to all of them
+        """
+        with self.index_base_store.open("rb") as fd:
+            with np.load(fd, allow_pickle=False) as index_file:
+                return {key: index_file[key] for key in (keys or index_file.files)}
+
+    def _load_array(self):
+        if isinstance(self.matrix_base_store, FSStore):
+            return np.load(self.matrix_base_store.path, mmap_mode="r", allow_pickle=False)
+        logger.debug(f"Matrix {self.uuid} is not on a local filesystem, loading it in memory")
+        with self.matrix_base_store.open("rb") as fd:
+            return np.load(fd, allow_pickle=False)
+
+    def _load_head_array(self):
+        """The first row of the design matrix, without reading the rest of it"""
+        if isinstance(self.matrix_base_store, FSStore):
+            return np.array(self._load_array()[:1])
+        with self.matrix_base_store.open("rb") as fd:
+            version = np.lib.format.read_magic(fd)
+            if version == (1, 0):
+                shape, _fortran_order, dtype = np.lib.format.read_array_header_1_0(fd)
+            else:
+                shape, _fortran_order, dtype = np.lib.format.read_array_header_2_0(fd)
+            num_rows = min(shape[0], 1)
+            data = fd.read(num_rows * shape[1] * dtype.itemsize)
+        return np.frombuffer(data, dtype=dtype).reshape(num_rows, shape[1])
+
+    def _design_matrix(self, array, index, index_data):
+        return pd.DataFrame(
+            array,
+            index=index,
+            columns=index_data["columns"].tolist(),
+            copy=False,
+        )
+
+    def _load_matrix_label_tuple(self):
+        index_data = self._load_index()
+        index = pd.MultiIndex.from_arrays(
+            [index_data["entity_id"], index_data["as_of_date"]],
+            names=self.indices,
+        )
+        design_matrix = self._design_matrix(self._load_array(), index, index_data)
+        labels = pd.Series(index_data["label"], index=index, name=self.label_column_name)
+        return design_matrix, labels
+
+    def _load(self):
+        design_matrix, labels = self._load_matrix_label_tuple()
+        return design_matrix.assign(**{self.label_column_name: labels}).reset_index()
+
+    @property
+    def head_of_matrix(self):
+        try:
+            index_data = self._load_index()
+            head_array = self._load_head_array()
+        except FileNotFoundError:
+            logger.exception(f"Matrix {self.uuid} not found Returning Empty data frame")
+            return pd.DataFrame()
+        index = pd.MultiIndex.from_arrays(
+            [index_data["entity_id"][:1], index_data["as_of_date"][:1]],
+            names=self.indices,
+        )
+        return self._design_matrix(head_array, index, index_data).assign(
+            **{self.label_column_name: index_data["label"][:1]}
+        )
+
+    def _empty_in_storage(self):
+        return len(self._load_index("entity_id")["entity_id"]) == 0
+
+    def _columns_in_storage(self):
+        return self._load_index("columns")["columns"].tolist() + [self.label_column_name]
+
+    def _design_matrix_columns(self, columns):
+        design_matrix = self.design_matrix
+        if design_matrix.columns.tolist() == list(columns):
+            # avoid copying the memory-mapped array if no reordering is needed
+            return design_matrix
+        return design_matrix[columns]
+
+    def save(self):
+        design_matrix, labels = self.matrix_label_tuple
+        if design_matrix.index.names != self.indices:
+            design_matrix = design_matrix.set_index(self.indices)
+        values = design_matrix.values
+        header = {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+            "fortran_order": False,
+            "shape": values.shape,
+        }
+        with self.matrix_base_store.open("wb") as fd:
+            np.lib.format.write_array_header_1_0(fd, header)
+            for start in range(0, len(values), self.save_chunksize):
+                chunk = values[start:(start + self.save_chunksize)]
+                fd.write(np.ascontiguousarray(chunk, dtype=np.float32).tobytes())
+        with self.index_base_store.open("wb") as fd:
+            np.savez(
+                fd,
+                entity_id=design_matrix.index.get_level_values("entity_id").values,
+                as_of_date=design_matrix.index.get_level_values("as_of_date").values.astype("datetime64[ns]"),
+                label=np.asarray(labels, dtype=np.float32),
+                columns=np.array(design_matrix.columns.tolist(), dtype=str),
+            )
+        self._save_metadata()
+
+    @contextmanager
+    def chunk_writer(self, num_rows=None):
+        """Append each chunk to the `.npy` file, whose header needs the total
+        number of rows up front; without it, chunks are gathered and saved at once
+        """
+        if num_rows is None:
+            with super().chunk_writer() as write_chunk:
+                yield write_chunk
+            return
+
+        self._delete_stored_metadata()
+        index_chunks = []
+        columns = None
+        rows_written = 0
+        with self.matrix_base_store.open("wb") as fd:
+            def write_chunk(design_matrix, labels):
+                nonlocal columns, rows_written
+                if columns is None:
+                    columns = design_matrix.columns.tolist()
+                    np.lib.format.write_array_header_1_0(fd, {
+                        "descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                        "fortran_order": False,
+                        "shape": (num_rows, len(columns)),
+                    })
+                if rows_written + len(design_matrix) > num_rows:
+                    raise ValueError(f"More than the expected {num_rows} rows were written")
+                fd.write(np.ascontiguousarray(design_matrix.values, dtype=np.float32).tobytes())
+                rows_written += len(design_matrix)
+                index_chunks.append((
+                    design_matrix.index.get_level_values("entity_id").values,
+                    design_matrix.index.get_level_values("as_of_date").values.astype("datetime64[ns]"),
+                    np.asarray(labels, dtype=np.float32),
+                ))
+
+            yield write_chunk
+        if rows_written != num_rows:
+            raise ValueError(f"{rows_written} rows were written instead of the expected {num_rows}")
+        with self.index_base_store.open("wb") as fd:
+            np.savez(
+                fd,
+                entity_id=np.concatenate([chunk[0] for chunk in index_chunks]),
+                as_of_date=np.concatenate([chunk[1] for chunk in index_chunks]),
+                label=np.concatenate([chunk[2] for chunk in index_chunks]),
+                columns=np.array(columns, dtype=str),
+            )
+        self._save_metadata()
+
+
+class SparseMatrixStore(MemmapMatrixStore):
+    """Store and access matrices as a compressed scipy CSR matrix
+
+    Suited to matrices with many mostly-zero columns, such as the one-hot columns
+    of collate Categorical aggregates. The design matrix is saved as a CSR matrix of
+    its non-zero values in a compressed `.npz` file, and the index, labels and column
+    names go to a separate `.index.npz` file, as for MemmapMatrixStore. Columns whose
+    share of non-zero values is at most `max_sparse_density` are recorded as sparse
+    and loaded as pandas SparseArrays; the others are loaded as dense float32 columns.
+    """
+
+    suffix = "csr.npz"
+    max_sparse_density = 0.1
+
+    def _load_array(self):
+        with self.matrix_base_store.open("rb") as fd:
+            return scipy.sparse.load_npz(fd).tocsr()
+
+    def _load_head_array(self):
+        # the compressed arrays of the CSR matrix can't be read in part
+        return self._load_array()[:1]
+
+    def _design_matrix(self, array, index, index_data):
+        return from_csr(
+            array,
+            index=index,
+            columns=index_data["columns"].tolist(),
+            sparse_columns=index_data["sparse_columns"],
+        )
+
+    def _design_matrix_columns(self, columns):
+        return MatrixStore._design_matrix_columns(self, columns)
+
+    def _save(self, csr, entity_ids, as_of_dates, labels, columns):
+        num_rows = csr.shape[0]
+        density = csr.getnnz(axis=0) / num_rows if num_rows else np.zeros(csr.shape[1])
+        sparse_columns = density <= self.max_sparse_density
+        logger.debug(
+            f"Saving matrix {self.uuid} with {sparse_columns.sum()} of {len(columns)} columns "
+            f"as sparse and {csr.nnz} non-zero values"
+        )
+        with self.matrix_base_store.open("wb") as fd:
+            scipy.sparse.save_npz(fd, csr, compressed=True)
+        with self.index_base_store.open("wb") as fd:
+            np.savez(
+                fd,
+                entity_id=entity_ids,
+                as_of_date=as_of_dates,
+                label=labels,
+                columns=np.array(columns, dtype=str),
+                sparse_columns=sparse_columns,
+            )
+        self._save_metadata()
+
+    def save(self):
+        design_matrix, labels = self.matrix_label_tuple
+        if design_matrix.index.names != self.indices:
+            design_matrix = design_matrix.set_index(self.indices)
+        self._save(
+            to_csr(design_matrix),
+            design_matrix.index.get_level_values("entity_id").values,
+            design_matrix.index.get_level_values("as_of_date").values.astype("datetime64[ns]"),
+            np.asarray(labels, dtype=np.float32),
+            design_matrix.columns.tolist(),
+        )
+
+    @contextmanager
+    def chunk_writer(self, num_rows=None):
+        """Convert each chunk to CSR as it comes, and stack them when the context exits"""
+        self._delete_stored_metadata()
+        chunks = []
+        columns = None
+
+        def write_chunk(design_matrix, labels):
+            nonlocal columns
+            if columns is None:
+                columns = design_matrix.columns.tolist()
+            chunks.append((
+                to_csr(design_matrix),
+                design_matrix.index.get_level_values("entity_id").values,
+                design_matrix.index.get_level_values("as_of_date").values.astype("datetime64[ns]"),
+                np.asarray(labels, dtype=np.float32),
+            ))
+
+        yield write_chunk
+        if num_rows is not None and sum(chunk[0].shape[0] for chunk in chunks) != num_rows:
+            raise ValueError(f"The number of rows written differs from the expected {num_rows}")
+        self._save(
+            scipy.sparse.vstack([chunk[0] for chunk in chunks], format="csr"),
+            np.concatenate([chunk[1] for chunk in chunks]),
+            np.concatenate([chunk[2] for chunk in chunks]),
+            np.concatenate([chunk[3] for chunk in chunks]),
+            columns,
+        )
+
+
+# matrix storage classes by the name of their format, as given in the
+# experiment config's matrix_format
+MATRIX_STORAGE_CLASSES = {
+    "csv": CSVMatrixStore,
+    "parquet": ParquetMatrixStore,
+    "memmap": MemmapMatrixStore,
+    "sparse": SparseMatrixStore,
+}
 
 
 class TestMatrixType:
@@ -1,4 +1,3 @@
-import csv
 import datetime
 import hashlib
 import numpy as np
@@ -8,7 +7,6 @@ import json
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
-import random
 from itertools import chain
 from functools import partial
 
@@ -18,6 +16,7 @@ from retrying import retry
 from sqlalchemy.orm import sessionmaker
 from ohio import PipeTextIO
 
+from triage.util.pandas import densify_matrix, has_sparse_columns, to_csr
 from triage.component.results_schema import (
     Experiment,
     Matrix,
@@ -154,11 +153,53 @@ class Batch:
             yield self.group()
 
 
+# estimators from these packages are given sparse design matrices as CSR
+SPARSE_INPUT_MODULES = ("sklearn.", "xgboost.", "lightgbm.")
+
+# part of the TypeError scikit-learn's input validation raises, before any
+# fitting, for estimators that require dense data
+SPARSE_REJECTION_MESSAGE = "but dense data is required"
+
+
+def call_with_design_matrix(method, design_matrix, *args):
+    """Call an estimator method (e.g. fit or predict_proba) on a design matrix
+
+    If the design matrix has sparse columns and the estimator comes from a package
+    known to accept sparse input, it is passed as a CSR matrix; should the estimator
+    reject it in its input validation (as scikit-learn estimators requiring dense
+    data do), or not be known to accept it, the sparse columns are made dense. Any
+    other error is raised as is.
+
+    Args:
+        method (callable) A bound method of the estimator
+        design_matrix (pandas.DataFrame) The design matrix
+        *args: any further arguments to the method (e.g. the labels)
+    """
+    if has_sparse_columns(design_matrix):
+        estimator_module = type(getattr(method, "__self__", None)).__module__
+        if estimator_module.startswith(SPARSE_INPUT_MODULES):
+            try:
+                return method(to_csr(design_matrix), *args)
+            except TypeError as exc:
+                if SPARSE_REJECTION_MESSAGE not in str(exc):
+                    raise
+                logger.debug(
+                    f"{estimator_module} rejected a sparse design matrix, passing it as dense"
+                )
+        design_matrix = densify_matrix(design_matrix)
+    return method(design_matrix, *args)
+
+
 AVAILABLE_TIEBREAKERS = {'random', 'best', 'worst'}
 
 def sort_predictions_and_labels(predictions_proba, labels, tiebreaker='random', sort_seed=None):
     """Sort predictions and labels with a configured tiebreaking rule
 
+    Predictions are sorted by descending score, and only the rows inside each
+    block of tied scores are reordered by the tiebreaker. If the predictions
+    are already in descending score order (e.g. the output of a previous call)
+    the score sort is skipped entirely.
+
     Args:
         predictions_proba (np.array) The predicted scores
         labels (np.array) The numeric labels (1/0, not True/False)
@@ -166,36 +207,49 @@ def sort_predictions_and_labels(predictions_proba, labels, tiebreaker='random',
         sort_seed (signed int) The sort seed. Needed if 'random' tiebreaking is picked.
 
     Returns:
-        (tuple) (predictions_proba, labels), sorted
+        (tuple) (predictions_proba, labels), sorted numpy arrays
     """
+    if tiebreaker not in AVAILABLE_TIEBREAKERS:
+        raise ValueError(f"Unknown tiebreaker: {tiebreaker}")
+    if tiebreaker == 'random' and not sort_seed:
+        raise ValueError("If random tiebreaker is used, a sort seed must be given")
+
+    predictions_proba = np.asarray(predictions_proba)
+    labels = np.asarray(labels)
     if len(labels) == 0:
         logger.notice("No labels present, skipping predictions sorting .")
         return (predictions_proba, labels)
-    mask = None
 
-    df = pd.DataFrame(predictions_proba, columns=["score"])
-    df['label_value'] = labels
+    if not np.all(predictions_proba[:-1] >= predictions_proba[1:]):
+        score_order = np.argsort(-predictions_proba, kind='stable')
+        predictions_proba = predictions_proba[score_order]
+        labels = labels[score_order]
 
+    # number the blocks of tied scores; with no ties there is nothing to break
+    new_block = predictions_proba[1:] != predictions_proba[:-1]
+    if new_block.all():
+        return (predictions_proba, labels)
+    tie_block = np.concatenate(([0], np.cumsum(new_block, dtype=np.int64)))
 
+    # fold the tie block and the tiebreaker into one integer key per row, so a
+    # single argsort on it keeps the blocks in place and reorders within them
     if tiebreaker == 'random':
-        if not sort_seed:
-            raise ValueError("If random tiebreaker is used, a sort seed must be given")
-        random.seed(sort_seed)
-        np.random.seed(sort_seed)
-        df['random'] = np.random.rand(len(df))
-        df.sort_values(by=['score', 'random'], inplace=True, ascending=[False, False])
-        df.drop('random', axis=1)
-    elif tiebreaker == 'worst':
-        df.sort_values(by=["score", "label_value"], inplace=True, ascending=[False,True], na_position='first')
-    elif tiebreaker == 'best':
-         df.sort_values(by=["score", "label_value"], inplace=True, ascending=[False,False], na_position='last')
+        rng = np.random.default_rng(sort_seed)
+        sort_key = (tie_block << 31) + rng.integers(0, 2 ** 31, len(labels))
+        within_ties_order = np.argsort(sort_key)
     else:
-        raise ValueError(f"Unknown tiebreaker: {tiebreaker}")
+        null_labels = pd.isnull(labels)
+        positive_labels = labels.astype(float) > 0
+        if tiebreaker == 'worst':
+            # null labels first, then negative labels, then positive labels
+            label_rank = np.where(null_labels, 0, np.where(positive_labels, 2, 1))
+        else:
+            # positive labels first, then negative labels, then null labels
+            label_rank = np.where(null_labels, 2, np.where(positive_labels, 0, 1))
+        # a stable sort, so rows with equal keys keep their incoming order
+        within_ties_order = np.argsort(tie_block * 3 + label_rank, kind='stable')
 
-    return  [
-        df['score'].to_numpy(),
-        df['label_value'].to_numpy()
-    ]
+    return (predictions_proba[within_ties_order], labels[within_ties_order])
 
 
 @db_retry
@@ -232,37 +286,93 @@ def retrieve_model_hash_from_id(db_engine, model_id):
         session.close()
 
 
-def _write_csv(file_like, db_objects, type_of_object):
-    writer = csv.writer(file_like, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+def _csv_field(value):
+    """Render a value as a CSV field that COPY reads back faithfully
+
+    Everything but None is quoted, so empty strings stay empty strings and only
+    None becomes an (unquoted, empty) NULL.
+    """
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _write_csv(file_like, db_objects, type_of_object, attribute_keys):
     for db_object in db_objects:
         if type(db_object) != type_of_object:
             raise TypeError("Cannot copy collection of objects to db as they are not all "
                             f"of the same type. First object was {type_of_object} "
                             f"and later encountered a {type(db_object)}")
-        writer.writerow(
-            [getattr(db_object, col.name) for col in db_object.__table__.columns]
+        file_like.write(
+            ','.join(_csv_field(getattr(db_object, key)) for key in attribute_keys) + '\n'
         )
 
 
-@db_retry
 def save_db_objects(db_engine, db_objects):
     """Saves a collection of SQLAlchemy model objects to the database using a COPY command
 
+    If a connection is passed instead of an engine, the COPY runs inside its
+    transaction and committing is left to the caller. Database errors are only
+    retried when an engine is passed: an error aborts the connection's
+    transaction, so retrying that is up to the caller.
+
     Args:
-        db_engine (sqlalchemy.engine)
+        db_engine (sqlalchemy.engine or sqlalchemy.engine.Connection)
         db_objects (iterable) SQLAlchemy model objects, corresponding to a valid table
     """
+    if isinstance(db_engine, sqlalchemy.engine.Connection):
+        return _copy_db_objects(db_engine, db_objects)
+    return db_retry(_copy_db_objects)(db_engine, db_objects)
+
+
+def _copy_db_objects(db_engine, db_objects):
     db_objects = iter(db_objects)
-    first_object = next(db_objects)
+    first_object = next(db_objects, None)
+    if first_object is None:
+        return
     type_of_object = type(first_object)
-    columns = [col.name for col in first_object.__table__.columns]
+    column_attrs = sqlalchemy.inspect(type_of_object).column_attrs
+    attribute_keys = [column_attr.key for column_attr in column_attrs]
+    columns = [f'"{column_attr.columns[0].name}"' for column_attr in column_attrs]
 
     with PipeTextIO(partial(
             _write_csv,
             db_objects=chain((first_object,), db_objects),
-            type_of_object=type_of_object
+            type_of_object=type_of_object,
+            attribute_keys=attribute_keys,
     )) as pipe:
         postgres_copy.copy_from(source=pipe, dest=type_of_object,
                                 engine_or_conn=db_engine,
                                 columns=columns,
                                 format="csv")
+
+
+def _write_dataframe_csv(file_like, df, chunksize):
+    for start in range(0, len(df), chunksize):
+        df.iloc[start:start + chunksize].to_csv(file_like, header=False, index=False)
+
+
+@db_retry
+def save_dataframe(db_engine, df, table_obj, chunksize=100000):
+    """Saves a DataFrame to the database using a COPY command
+
+    The frame is serialized a chunk of rows at a time straight into the COPY
+    stream, without building an object per row. Its columns must be named
+    after the table's columns. Missing values (and empty strings) are loaded
+    as NULL.
+
+    Args:
+        db_engine (sqlalchemy.engine or sqlalchemy.engine.Connection)
+        df (pandas.DataFrame) The rows to save
+        table_obj (SQLAlchemy model or table) The table to save them to
+        chunksize (int) The number of rows serialized at a time
+    """
+    if df.empty:
+        return
+    columns = [f'"{column}"' for column in df.columns]
+
+    with PipeTextIO(partial(_write_dataframe_csv, df=df, chunksize=chunksize)) as pipe:
+        postgres_copy.copy_from(source=pipe, dest=table_obj,
+                                engine_or_conn=db_engine,
+                                columns=columns,
+                                format="csv")
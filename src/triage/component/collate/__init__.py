@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
-from .collate import available_imputations, Aggregation, Aggregate, Compare, Categorical
-from .from_obj import FromObj
-from .spacetime import SpacetimeAggregation
+from .collate import (
+    available_imputations,
+    available_rollup_functions,
+    Aggregation,
+    Aggregate,
+    Compare,
+    Categorical,
+)
+from .from_obj import available_materialization_options, FromObj
+from .spacetime import available_query_strategies, SpacetimeAggregation
 
 __all__ = [
     "available_imputations",
+    "available_materialization_options",
+    "available_rollup_functions",
+    "available_query_strategies",
     "Aggregation",
     "Aggregate",
     "FromObj",
@@ -28,6 +28,17 @@ available_imputations = {
     "error": ImputeError,
 }
 
+# aggregate functions that can be rolled up from partial aggregates over disjoint
+# sets of rows: the partial aggregate functions, and a template combining them,
+# given the partial columns as positional arguments and an optional FILTER clause
+available_rollup_functions = {
+    "count": (("count",), "coalesce(sum({0}){filter}, 0)::bigint"),
+    "sum": (("sum",), "sum({0}){filter}"),
+    "min": (("min",), "min({0}){filter}"),
+    "max": (("max",), "max({0}){filter}"),
+    "avg": (("sum", "count"), "sum({0}){filter} / nullif(sum({1}){filter}, 0)::numeric"),
+}
+
 
 def make_list(a):
     return [a] if not isinstance(a, list) else a
@@ -96,6 +107,10 @@ class AggregateExpression:
             for c1, c2 in product(lookup1.keys(), lookup2.keys())
         )
 
+    def can_roll_up(self):
+        """Whether the columns can be computed by get_rollup_columns"""
+        return False
+
     def alias(self, expression_template):
         """
         Set the expression template used for naming columns of an AggregateExpression
@@ -262,6 +277,64 @@ class Aggregate(AggregateExpression):
 
             yield ex.literal_column(column).label(to_sql_name(name))
 
+    def can_roll_up(self):
+        """Whether the columns can be computed by get_rollup_columns: all of
+        the functions are in available_rollup_functions, and there are no
+        ordered-set, distinct or multiple-argument aggregates
+        """
+        return (
+            self.orders == [None]
+            and all(f.lower() in available_rollup_functions for f in self.functions)
+            and all(
+                len(quantity) == 1 and not split_distinct(quantity)[0]
+                for quantity in self.quantities.values()
+            )
+        )
+
+    def get_rollup_columns(self, partial_alias, when=None, prefix=None, format_kwargs=None):
+        """
+        Columns equivalent to get_columns, combined from partial aggregates computed
+        over disjoint sets of rows (e.g. the rows of each time interval bucket)
+        Args:
+            partial_alias: function taking the SQL of a partial aggregate, e.g.
+                "sum(quantity)", and returning the name of its column
+            when: used in a filter clause to select the partial aggregates going into
+                each column
+            prefix: prefix for column names
+            format_kwargs: kwargs to pass to format the aggregate quantity
+        Returns:
+            collection of SQLAlchemy columns
+        """
+        if not self.can_roll_up():
+            raise ValueError("Aggregate functions %s cannot be rolled up" % self.functions)
+        if prefix is None:
+            prefix = ""
+        if format_kwargs is None:
+            format_kwargs = {}
+
+        name_template = "{prefix}{quantity_name}_{function}"
+        filter = " FILTER (WHERE {when})".format(when=when) if when else ""
+        coltype_cast = "::{coltype}".format(coltype=self.coltype) if self.coltype else ""
+
+        for function, (quantity_name, (quantity,)) in product(
+            self.functions, self.quantities.items()
+        ):
+            partial_functions, template = available_rollup_functions[function.lower()]
+            partials = [
+                partial_alias(
+                    "{function}({quantity})".format(
+                        function=partial_function, quantity=quantity.format(**format_kwargs)
+                    )
+                )
+                for partial_function in partial_functions
+            ]
+            column = "(" + template.format(*partials, filter=filter) + ")" + coltype_cast
+            name = name_template.format(
+                prefix=prefix, quantity_name=quantity_name, function=function
+            )
+
+            yield ex.literal_column(column).label(to_sql_name(name))
+
     def column_imputation_lookup(self, prefix=None):
         """
         Args:
@@ -460,7 +533,8 @@ class Aggregation:
                 regardless of what exists in the from_obj
             state_group: the group level found in the state table (e.g., "entity_id")
             prefix: prefix for aggregation tables and column names, defaults to from_obj
-            suffix: suffix for aggregation table, defaults to "aggregation"
+            suffix: suffix for aggregation table, defaults to "aggregation". Any
+                other suffix is also added to the group table names
             schema: schema for aggregation tables
 
         The from_obj and group expressions are passed directly to the
@@ -555,6 +629,9 @@ class Aggregation:
         """
         Returns name for table for the given group
         """
+        if group is not None and self.suffix != "aggregation":
+            # keep the group tables apart from those of the default suffix
+            group = "%s_%s" % (group, self.suffix)
         if group is None and not imputed:
             name = '"%s_%s"' % (self.prefix, self.suffix)
         elif group is None and imputed:
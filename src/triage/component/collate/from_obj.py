@@ -1,6 +1,8 @@
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+from triage.component.catwalk.utils import filename_friendly_hash
+from triage.util.conf import convert_str_to_relativedelta
 from triage.validation_primitives import (
     table_should_exist,
     table_should_have_column,
@@ -8,12 +10,56 @@ from triage.validation_primitives import (
 )
 import sqlparse
 
+available_materialization_options = (
+    "unlogged",
+    "partition_interval",
+    "entity_index",
+    "cluster",
+    "analyze",
+    "reuse",
+)
+
 
 class FromObj:
-    def __init__(self, from_obj, name, knowledge_date_column):
+    def __init__(
+        self,
+        from_obj,
+        name,
+        knowledge_date_column,
+        unlogged=False,
+        partition_interval=None,
+        entity_index=False,
+        cluster=False,
+        analyze=False,
+        reuse=False,
+    ):
+        """
+        Args:
+            from_obj: the from_obj of an aggregation
+            name: name of the aggregation, the materialized table is named after it
+            knowledge_date_column: name of the knowledge date column in from_obj
+            unlogged: create the materialized table as UNLOGGED, which is faster to
+                write but emptied after a database crash
+            partition_interval: if given, range partition the materialized table
+                by knowledge date, one partition per interval (e.g. "1year")
+            entity_index: also index (entity_id, knowledge date)
+            cluster: load the rows ordered by (entity_id, knowledge date), so the
+                rows of an entity are stored together
+            analyze: ANALYZE the materialized table after loading it
+            reuse: keep a materialized table built from the same from_obj and
+                options by an earlier run instead of rebuilding it, tagging the
+                table with a hash of them. Changes to the data the from_obj reads
+                from are not detected
+        """
         self.from_obj = from_obj
         self.name = name
         self.knowledge_date_column = knowledge_date_column
+        self.unlogged = unlogged
+        self.partition_interval = partition_interval
+        self.entity_index = entity_index
+        self.cluster = cluster
+        self.analyze = analyze
+        self.reuse = reuse
 
     @property
     def table(self):
@@ -26,18 +72,112 @@ class FromObj:
     def materialized_table(self):
         return f"{self.name}_from_obj"
 
+    @property
+    def content_hash(self):
+        """A hash of the from_obj and the options affecting its materialized table"""
+        return filename_friendly_hash(
+            {
+                "from_obj": self.from_obj,
+                "knowledge_date_column": self.knowledge_date_column,
+                "unlogged": self.unlogged,
+                "partition_interval": self.partition_interval,
+                "entity_index": self.entity_index,
+                "cluster": self.cluster,
+            }
+        )
+
+    @property
+    def _order_by_sql(self):
+        return f" order by entity_id, {self.knowledge_date_column}" if self.cluster else ""
+
+    @property
+    def _unlogged_sql(self):
+        return "unlogged " if self.unlogged else ""
+
     @property
     def create_materialized_table_sql(self):
-        return f"create table {self.materialized_table} as (select * from {self.from_obj})"
+        return (
+            f"create {self._unlogged_sql}table {self.materialized_table} as "
+            f"(select * from {self.from_obj}{self._order_by_sql})"
+        )
 
     @property
     def index_materialized_table_sql(self):
         return f"create index on {self.materialized_table} ({self.knowledge_date_column})"
 
+    @property
+    def entity_index_materialized_table_sql(self):
+        return f"create index on {self.materialized_table} (entity_id, {self.knowledge_date_column})"
+
     @property
     def drop_materialized_table_sql(self):
         return f"drop table if exists {self.materialized_table}"
 
+    @property
+    def load_table(self):
+        return f"{self.materialized_table}_load"
+
+    def partitioned_table_sql(self, min_date, max_date):
+        """SQL statements creating the partitioned materialized table and its
+        partitions, covering min_date to max_date, from the loaded rows
+
+        Args:
+            min_date (datetime.date) earliest knowledge date, or None if no rows
+            max_date (datetime.date) latest knowledge date, or None if no rows
+
+        Returns: (list) of SQL statements
+        """
+        statements = [
+            f"create table {self.materialized_table} (like {self.load_table}) "
+            f"partition by range ({self.knowledge_date_column})"
+        ]
+        if min_date is not None:
+            step = convert_str_to_relativedelta(self.partition_interval)
+            start = min_date
+            partition_num = 0
+            while start <= max_date:
+                end = start + step
+                statements.append(
+                    f"create {self._unlogged_sql}table {self.materialized_table}_p{partition_num} "
+                    f"partition of {self.materialized_table} "
+                    f"for values from ('{start}') to ('{end}')"
+                )
+                start = end
+                partition_num += 1
+        # rows without a knowledge date
+        statements.append(
+            f"create {self._unlogged_sql}table {self.materialized_table}_default "
+            f"partition of {self.materialized_table} default"
+        )
+        statements.append(
+            f"insert into {self.materialized_table} "
+            f"select * from {self.load_table}{self._order_by_sql}"
+        )
+        statements.append(f"drop table {self.load_table}")
+        return statements
+
+    def _create_partitioned_table(self, db_engine):
+        db_engine.execute(f"drop table if exists {self.load_table}")
+        db_engine.execute(
+            f"create unlogged table {self.load_table} as (select * from {self.from_obj})"
+        )
+        min_date, max_date = db_engine.execute(
+            f"select min({self.knowledge_date_column})::date, "
+            f"max({self.knowledge_date_column})::date from {self.load_table}"
+        ).first()
+        with db_engine.begin() as conn:
+            for statement in self.partitioned_table_sql(min_date, max_date):
+                conn.execute(statement)
+
+    def is_materialized(self, db_engine):
+        """Whether the materialized table exists and was built from the same
+        from_obj and options
+        """
+        table_hash = db_engine.execute(
+            f"select obj_description(to_regclass('{self.materialized_table}'), 'pg_class')"
+        ).scalar()
+        return table_hash == self.content_hash
+
     def should_materialize(self):
         try:
             (statement,) = sqlparse.parse(self.from_obj)
@@ -66,13 +206,30 @@ class FromObj:
 
     def maybe_materialize(self, db_engine):
         if self.should_materialize():
+            if self.reuse and self.is_materialized(db_engine):
+                logger.debug(
+                    f"Materialized table {self.materialized_table} was built from the same "
+                    f"from_obj, reusing it"
+                )
+                return
             logger.spam(f"from_obj in {self.name} looks like a subquery, so creating table")
             db_engine.execute(self.drop_materialized_table_sql)
-            db_engine.execute(self.create_materialized_table_sql)
+            if self.partition_interval:
+                self._create_partitioned_table(db_engine)
+            else:
+                db_engine.execute(self.create_materialized_table_sql)
             logger.spam(f"Created table to hold from_obj. New table: {self.materialized_table}")
             self.validate(db_engine)
             db_engine.execute(self.index_materialized_table_sql)
+            if self.entity_index:
+                db_engine.execute(self.entity_index_materialized_table_sql)
             logger.spam(f"Indexed from_obj table: {self.materialized_table}")
+            if self.analyze:
+                db_engine.execute(f"analyze {self.materialized_table}")
+            if self.reuse:
+                db_engine.execute(
+                    f"comment on table {self.materialized_table} is '{self.content_hash}'"
+                )
             logger.debug(f"Materialized table {self.materialized_table}")
         else:
             logger.debug(f"from_obj in {self.name} did not look like a subquery, so did not materialize")
@@ -4,7 +4,12 @@ import sqlalchemy.sql.expression as ex
 from descriptors import cachedproperty
 
 from .sql import make_sql_clause
-from .collate import Aggregation
+from .collate import Aggregation, available_rollup_functions
+
+# per_date issues one SELECT per as-of-date and group, each scanning from_obj;
+# single_scan joins from_obj against all as-of-dates and aggregates them in one
+# SELECT per group
+available_query_strategies = ("per_date", "single_scan")
 
 
 class SpacetimeAggregation(Aggregation):
@@ -24,6 +29,8 @@ class SpacetimeAggregation(Aggregation):
         output_date_column=None,
         input_min_date=None,
         join_with_cohort_table=False,
+        query_strategy="per_date",
+        rollup_intervals=False,
     ):
         """
         Args:
@@ -40,6 +47,15 @@ class SpacetimeAggregation(Aggregation):
             output_date_column: name of date column in aggregated output, defaults to "date"
             input_min_date: minimum date for which rows shall be included, defaults
                 to no absolute time restrictions on the minimum date of included rows
+            query_strategy: how the per-date aggregates are queried, one of
+                available_query_strategies. "per_date" (the default) issues one
+                SELECT per date, "single_scan" joins the from_obj against all
+                dates at once and computes every date in one SELECT per group.
+                "single_scan" does not support {collate_date} in aggregates
+            rollup_intervals: compute the aggregates of all intervals from partial
+                aggregates over the rows in each interval bucket, instead of a
+                filtered aggregate per interval. Only supported for aggregates that
+                can_roll_up (count, sum, min, max and avg)
 
         For all other arguments see collate.Aggregation
         """
@@ -64,6 +80,42 @@ class SpacetimeAggregation(Aggregation):
         self.output_date_column = output_date_column if output_date_column else "date"
         self.input_min_date = input_min_date
         self.join_with_cohort_table = join_with_cohort_table
+        if query_strategy not in available_query_strategies:
+            raise ValueError(
+                "query_strategy must be one of %s, got '%s'"
+                % (available_query_strategies, query_strategy)
+            )
+        if query_strategy == "single_scan":
+            for agg in self.aggregates:
+                if self._depends_on_collate_date(agg):
+                    raise ValueError(
+                        "The single_scan query_strategy does not support "
+                        "{collate_date} in aggregates, use per_date instead"
+                    )
+        self.query_strategy = query_strategy
+        if rollup_intervals:
+            for agg in self.aggregates:
+                if not agg.can_roll_up():
+                    raise ValueError(
+                        "rollup_intervals is only supported for the aggregate "
+                        "functions %s, without orders or distinct quantities"
+                        % sorted(available_rollup_functions)
+                    )
+        self.rollup_intervals = rollup_intervals
+
+    @staticmethod
+    def _depends_on_collate_date(agg):
+        """Whether the SQL of an aggregate changes with the {collate_date}"""
+        first, second = (
+            [
+                str(col.element)
+                for col in agg.get_columns(
+                    format_kwargs={"collate_date": date, "collate_interval": "all"}
+                )
+            ]
+            for date in ("1970-01-01", "1970-01-02")
+        )
+        return first != second
 
     def _state_table_sub(self):
         """Helper function to ensure we only include state table records
@@ -116,7 +168,7 @@ class SpacetimeAggregation(Aggregation):
             prefix=self.prefix, interval=interval, group=group
         )
 
-    def _cols_for_aggregate(self, agg, group, interval, date):
+    def _cols_for_aggregate(self, agg, group, interval, date, date_expression=None):
         """
         Helper for getting the sql for a particular aggregate
         Args:
@@ -124,11 +176,17 @@ class SpacetimeAggregation(Aggregation):
             interval: SQL time interval string, or "all"
             date: SQL date string
             group: group clause, for naming columns
+            date_expression: SQL expression for the as-of-date in the interval
+                filter, defaults to the date literal
         Returns: collection of aggregate column SQL strings
         """
+        if date_expression is None:
+            date_expression = "'%s'::date" % date
         if interval != "all":
-            when = "{date_column} >= '{date}'::date - interval '{interval}'".format(
-                interval=interval, date=date, date_column=self.date_column
+            when = "{date_column} >= {date_expression} - interval '{interval}'".format(
+                interval=interval,
+                date_expression=date_expression,
+                date_column=self.date_column,
             )
         else:
             when = None
@@ -138,18 +196,20 @@ class SpacetimeAggregation(Aggregation):
             format_kwargs={"collate_date": date, "collate_interval": interval},
         )
 
-    def _get_aggregates_sql(self, interval, date, group):
+    def _get_aggregates_sql(self, interval, date, group, date_expression=None):
         """
         Helper for getting aggregates sql
         Args:
             interval: SQL time interval string, or "all"
             date: SQL date string
             group: group clause, for naming columns
+            date_expression: SQL expression for the as-of-date, see
+                _cols_for_aggregate
         Returns: collection of aggregate column SQL strings
         """
         return chain(
             *[
-                self._cols_for_aggregate(agg, group, interval, date)
+                self._cols_for_aggregate(agg, group, interval, date, date_expression)
                 for agg in self.aggregates
             ]
         )
@@ -160,8 +220,12 @@ class SpacetimeAggregation(Aggregation):
 
         Returns: a dictionary of group : queries pairs where
             group are the same keys as groups
-            queries is a list of Select queries, one for each date in dates
+            queries is a list of Select queries, one for each date in dates,
+            or a single query covering all dates with the single_scan strategy
         """
+        if self.query_strategy == "single_scan":
+            return self._get_single_scan_selects()
+
         queries = {}
 
         for group, groupby in self.groups.items():
@@ -190,6 +254,18 @@ class SpacetimeAggregation(Aggregation):
                         ")) cohorted_from_obj")
                 else:
                     from_obj = self.from_obj
+                if self.rollup_intervals:
+                    query = self._rollup_select(
+                        group,
+                        groupby,
+                        intervals,
+                        date,
+                        "'%s'::date" % date,
+                        make_sql_clause(from_obj, ex.text),
+                        where=self.where(date, intervals),
+                    )
+                    queries[group].append(query)
+                    continue
                 query = ex.select(columns=columns, from_obj=make_sql_clause(from_obj, ex.text)).group_by(
                     gb_clause
                 )
@@ -199,6 +275,156 @@ class SpacetimeAggregation(Aggregation):
 
         return queries
 
+    def _single_scan_from_obj(self, intervals):
+        """
+        Helper for the single_scan from clause: the from_obj joined to every
+        as-of-date whose largest interval covers its rows, and to the cohort
+        table if join_with_cohort_table is set
+        Args:
+            intervals: intervals
+        Returns: SQL string for a subquery aliased collate_events, with the
+            as-of-date in its collate_as_of_date column
+        """
+        dates = ", ".join("('%s'::date)" % date for date in self.dates)
+        on = "{date_column} < collate_as_of_date".format(date_column=self.date_column)
+        if "all" not in intervals:
+            greatest = "greatest(%s)" % str.join(
+                ",", ["interval '%s'" % i for i in intervals]
+            )
+            on += " AND {date_column} >= collate_as_of_date - {greatest}".format(
+                date_column=self.date_column, greatest=greatest
+            )
+        if self.input_min_date is not None:
+            on += " AND {date_column} >= '{bot}'::date".format(
+                date_column=self.date_column, bot=self.input_min_date
+            )
+        cohort_join = ""
+        if self.join_with_cohort_table:
+            cohort_join = (
+                f" join {self.state_table} cohort on ("
+                "cohort.entity_id = from_obj.entity_id and "
+                f"cohort.{self.output_date_column} = collate_dates.collate_as_of_date)"
+            )
+        return (
+            "(select from_obj.*, collate_dates.collate_as_of_date from "
+            f"(select * from {self.from_obj}) from_obj "
+            f"join (values {dates}) collate_dates(collate_as_of_date) on ({on})"
+            f"{cohort_join}) collate_events"
+        )
+
+    def _get_single_scan_selects(self):
+        """
+        Constructs one select query per group computing the aggregates for
+        all dates at once, see get_selects
+        """
+        queries = {}
+
+        for group, groupby in self.groups.items():
+            intervals = self.intervals[group]
+            columns = [
+                make_sql_clause(groupby, ex.text),
+                ex.literal_column("collate_as_of_date").label(self.output_date_column),
+            ]
+            columns += list(
+                chain(
+                    *[
+                        self._get_aggregates_sql(
+                            i, self.dates[0], group, "collate_as_of_date"
+                        )
+                        for i in intervals
+                    ]
+                )
+            )
+
+            gb_clause = make_sql_clause(groupby, ex.literal_column)
+            from_obj = ex.text(self._single_scan_from_obj(intervals))
+            if self.rollup_intervals:
+                queries[group] = [
+                    self._rollup_select(
+                        group,
+                        groupby,
+                        intervals,
+                        self.dates[0],
+                        "collate_as_of_date",
+                        from_obj,
+                        date_key="collate_as_of_date",
+                    )
+                ]
+                continue
+            query = ex.select(columns=columns, from_obj=from_obj).group_by(
+                gb_clause, ex.literal_column("collate_as_of_date")
+            )
+            queries[group] = [query]
+
+        return queries
+
+    def _rollup_select(
+        self, group, groupby, intervals, date, date_expression, from_obj, where=None, date_key=None
+    ):
+        """
+        Helper for a select query computing the aggregates of all intervals at
+        once: an inner query groups the rows by which intervals they fall in and
+        computes partial aggregates for each of those buckets, which the outer
+        query rolls up into the aggregates of each interval
+        Args:
+            group: group clause, for naming columns
+            groupby: group by expression
+            intervals: intervals
+            date: SQL date string
+            date_expression: SQL expression for the as-of-date
+            from_obj: from clause of the inner query
+            where: where clause of the inner query
+            date_key: column holding the as-of-date in from_obj, if any, which
+                is grouped by as well
+        Returns: a Select query
+        """
+        partials = {}
+
+        def partial_alias(partial):
+            return partials.setdefault(partial, "collate_partial_%d" % len(partials))
+
+        keys = [groupby] + ([date_key] if date_key else [])
+        buckets = {}
+        columns = []
+        for interval in intervals:
+            if interval != "all":
+                buckets[interval] = "collate_in_%d" % len(buckets)
+            for agg in self.aggregates:
+                columns += agg.get_rollup_columns(
+                    partial_alias,
+                    buckets.get(interval),
+                    self._col_prefix(group, interval),
+                    format_kwargs={"collate_date": date, "collate_interval": interval},
+                )
+
+        inner_columns = [ex.literal_column(key) for key in keys]
+        inner_columns += [
+            ex.literal_column(
+                "{date_column} >= {date_expression} - interval '{interval}'".format(
+                    date_column=self.date_column,
+                    date_expression=date_expression,
+                    interval=interval,
+                )
+            ).label(bucket)
+            for interval, bucket in buckets.items()
+        ]
+        inner_columns += [
+            ex.literal_column(partial).label(alias) for partial, alias in partials.items()
+        ]
+        inner = ex.select(columns=inner_columns, from_obj=from_obj).group_by(
+            *[ex.literal_column(column) for column in keys + list(buckets.values())]
+        )
+        if where is not None:
+            inner = inner.where(where)
+
+        outer_columns = [
+            make_sql_clause(groupby, ex.text),
+            ex.literal_column(date_expression).label(self.output_date_column),
+        ] + columns
+        return ex.select(
+            columns=outer_columns, from_obj=inner.alias("collate_buckets")
+        ).group_by(*[ex.literal_column(key) for key in keys])
+
     def get_imputation_rules(self):
         """
         Constructs a dictionary to lookup an imputation rule from an associated
@@ -362,15 +588,15 @@ class SpacetimeAggregation(Aggregation):
             date_col=self.output_date_column,
         )
 
-    def get_impute_create(self, impute_cols, nonimpute_cols):
+    def get_impute_select(self, impute_cols, nonimpute_cols):
         """
-        Generates the CREATE TABLE query for the aggregation table with imputation.
+        Generates the SELECT query for the aggregation table with imputation.
 
         Args:
             impute_cols: a list of column names with null values
             nonimpute_cols: a list of column names without null values
 
-        Returns: a CREATE TABLE AS query
+        Returns: a SELECT query
         """
 
         # key columns and date column
@@ -392,4 +618,19 @@ class SpacetimeAggregation(Aggregation):
             self.output_date_column,
         )
 
-        return "CREATE TABLE %s AS (%s)" % (self.get_table_name(imputed=True), query)
+        return query
+
+    def get_impute_create(self, impute_cols, nonimpute_cols):
+        """
+        Generates the CREATE TABLE query for the aggregation table with imputation.
+
+        Args:
+            impute_cols: a list of column names with null values
+            nonimpute_cols: a list of column names without null values
+
+        Returns: a CREATE TABLE AS query
+        """
+        return "CREATE TABLE %s AS (%s)" % (
+            self.get_table_name(imputed=True),
+            self.get_impute_select(impute_cols, nonimpute_cols),
+        )
@@ -25,7 +25,7 @@ from matplotlib import pyplot as plt
 from descriptors import cachedproperty
 from sklearn import metrics
 from sklearn import tree
-from triage.component.catwalk.storage import ProjectStorage, ModelStorageEngine, MatrixStorageEngine
+from triage.component.catwalk.storage import ProjectStorage, ModelStorageEngine, MatrixStorageEngine, PredictionsStorageEngine
 
 
 class ModelEvaluator:
@@ -109,6 +109,18 @@ class ModelEvaluator:
 
     @cachedproperty
     def predictions(self):
+        predictions_files = pd.read_sql(
+            f'''
+            SELECT pm.predictions_path,
+                   (m.matrix_metadata->>'label_timespan')::interval AS test_label_timespan
+            FROM test_results.prediction_metadata pm
+            JOIN triage_metadata.matrices m USING (matrix_uuid)
+            WHERE pm.model_id = {self.model_id}
+            AND pm.predictions_path IS NOT NULL
+            ''', con=self.engine)
+        if not predictions_files.empty:
+            return self._predictions_from_files(predictions_files)
+
         preds = pd.read_sql(
             f'''
             SELECT model_id,
@@ -132,6 +144,38 @@ class ModelEvaluator:
                                )
         return preds
 
+    def _predictions_from_files(self, predictions_files):
+        '''
+        Read the predictions saved to files (instead of the predictions table)
+        by catwalk.Predictor, using the paths in the prediction_metadata table
+
+        Arguments:
+            - predictions_files (pd.DataFrame): predictions_path and
+            test_label_timespan of each file
+
+        Return:
+            - Dataframe with the same columns as the predictions table query
+        '''
+        preds = []
+        for predictions_file in predictions_files.itertuples():
+            file_preds = PredictionsStorageEngine.load(
+                predictions_file.predictions_path,
+                columns=['entity_id', 'as_of_date', 'score', 'label_value',
+                         'rank_abs_with_ties', 'rank_pct_with_ties']
+            )
+            preds.append(pd.DataFrame({
+                'model_id': self.model_id,
+                'entity_id': file_preds['entity_id'],
+                'as_of_date': file_preds['as_of_date'],
+                'score': file_preds['score'],
+                'label_value': file_preds['label_value'],
+                'rank_abs': file_preds['rank_abs_with_ties'],
+                'rank_pct': file_preds['rank_pct_with_ties'] * 100,
+                'test_label_timespan': predictions_file.test_label_timespan,
+            }))
+        preds = pd.concat(preds, ignore_index=True)
+        return preds[preds['label_value'].notnull()].reset_index(drop=True)
+
     def _feature_importance_slr(self, path):
         '''
         Calculate feature importances for ScaledLogisticRegression
@@ -5,6 +5,8 @@ logger = verboselogs.VerboseLogger(__name__)
 from scipy import stats
 import yaml
 
+from triage.component.catwalk.storage import PredictionsStorageEngine
+
 
 class CrosstabsConfigLoader:
     def __init__(self, config_path=None, config=None):
@@ -14,6 +16,8 @@ class CrosstabsConfigLoader:
         self.models_dates_join_query = None
         self.features_query = None
         self.predictions_query = None
+        self.predictions_from_files = False
+        self.entity_id_list = []
 
         if config:
             config_to_load = config
@@ -179,7 +183,76 @@ def populate_crosstabs_table(
         return df
 
 
-def run_crosstabs(db_engine, crosstabs_config):
+def _crosstabs_data_from_files(db_engine, crosstabs_config):
+    """ Fetches the crosstabs data for predictions saved to files (see
+    catwalk.storage.PredictionsStorageEngine) instead of the predictions table.
+
+        The features still come from the features_query; the predictions of the
+        models in the models_list_query, on the dates in the as_of_dates_query,
+        are read from the files the prediction_metadata table points to and
+        joined to the features in pandas.
+
+        Returns: A DataFrame, like the one fetched by the predictions query
+    """
+    ctes = """
+        with models_list_query as (
+        {models_list_query}
+        ), as_of_dates_query as (
+        {as_of_dates_query}
+        ),models_dates_join_query as (
+        {models_dates_join_query}
+        ),features_query as (
+        {features_query}
+        )
+        """.format(
+        models_list_query=crosstabs_config.models_list_query,
+        as_of_dates_query=crosstabs_config.as_of_dates_query,
+        models_dates_join_query=crosstabs_config.models_dates_join_query,
+        features_query=crosstabs_config.features_query,
+    )
+    predictions_files = pd.read_sql(
+        ctes + """
+        select model_id, predictions_path
+        from test_results.prediction_metadata
+        where predictions_path is not null
+        and model_id in (select model_id from models_list_query)
+        """,
+        db_engine,
+    )
+    as_of_dates = pd.to_datetime(
+        pd.read_sql(ctes + "select as_of_date from as_of_dates_query", db_engine)["as_of_date"]
+    )
+
+    predictions = []
+    for predictions_file in predictions_files.itertuples():
+        file_predictions = PredictionsStorageEngine.load(
+            predictions_file.predictions_path,
+            columns=["entity_id", "as_of_date", "score", "label_value",
+                     "rank_abs_no_ties", "rank_pct_no_ties"],
+        )
+        file_predictions = file_predictions[file_predictions["as_of_date"].isin(as_of_dates)]
+        predictions.append(pd.DataFrame({
+            "model_id": predictions_file.model_id,
+            "as_of_date": file_predictions["as_of_date"],
+            "entity_id": file_predictions["entity_id"],
+            "score": file_predictions["score"],
+            "label_value": file_predictions["label_value"],
+            "rank_abs": file_predictions["rank_abs_no_ties"],
+            "rank_pct": file_predictions["rank_pct_no_ties"] * 100,
+        }))
+    if not predictions:
+        raise ValueError("No data could be fetched.")
+    predictions = pd.concat(predictions, ignore_index=True)
+    if len(crosstabs_config.entity_id_list) > 0:
+        predictions = predictions[predictions["entity_id"].isin(crosstabs_config.entity_id_list)]
+
+    features = pd.read_sql(ctes + "select * from features_query", db_engine)
+    features["as_of_date"] = pd.to_datetime(features["as_of_date"])
+    df = predictions.merge(features, how="left", on=["model_id", "entity_id", "as_of_date"])
+    return df.sort_values(["model_id", "as_of_date", "rank_abs"], ignore_index=True)
+
+
+def _crosstabs_data_from_db(db_engine, crosstabs_config):
     crosstabs_query = """
         with models_list_query as (
         {models_list_query}
@@ -204,7 +277,14 @@ def run_crosstabs(db_engine, crosstabs_config):
     if len(crosstabs_config.entity_id_list) > 0:
         crosstabs_query += " where entity_id=ANY('{%s}') " % ", ".join(map(str, crosstabs_config.entity_id_list))
     crosstabs_query += "  order by model_id, as_of_date, rank_abs asc;"
-    df = pd.read_sql(crosstabs_query, db_engine)
+    return pd.read_sql(crosstabs_query, db_engine)
+
+
+def run_crosstabs(db_engine, crosstabs_config):
+    if crosstabs_config.predictions_from_files:
+        df = _crosstabs_data_from_files(db_engine, crosstabs_config)
+    else:
+        df = _crosstabs_data_from_db(db_engine, crosstabs_config)
     if len(df) == 0:
         raise ValueError("No data could be fetched.")
     groupby_obj = df.groupby(["model_id", "as_of_date"])
@@ -0,0 +1,24 @@
+"""add matrices_reused to experiment runs
+
+Revision ID: 3c8e1f0b7d52
+Revises: 5f2e6b3a9c41
+Create Date: 2026-10-17 14:03:52.207114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8e1f0b7d52'
+down_revision = '5f2e6b3a9c41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('experiment_runs', sa.Column('matrices_reused', sa.Integer(), nullable=True), schema='triage_metadata')
+
+
+def downgrade():
+    op.drop_column('experiment_runs', 'matrices_reused', schema='triage_metadata')
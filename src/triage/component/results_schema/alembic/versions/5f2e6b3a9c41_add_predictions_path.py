@@ -0,0 +1,26 @@
+"""add predictions_path to prediction metadata
+
+Revision ID: 5f2e6b3a9c41
+Revises: 45219f25072b
+Create Date: 2026-10-17 10:12:31.418825
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2e6b3a9c41'
+down_revision = '45219f25072b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('prediction_metadata', sa.Column('predictions_path', sa.Text(), nullable=True), schema='test_results')
+    op.add_column('prediction_metadata', sa.Column('predictions_path', sa.Text(), nullable=True), schema='train_results')
+
+
+def downgrade():
+    op.drop_column('prediction_metadata', 'predictions_path', schema='train_results')
+    op.drop_column('prediction_metadata', 'predictions_path', schema='test_results')
@@ -104,6 +104,7 @@ class ExperimentRun(Base):
     matrices_made = Column(Integer, default=0)
     matrices_skipped = Column(Integer, default=0)
     matrices_errored = Column(Integer, default=0)
+    matrices_reused = Column(Integer, default=0)
     model_building_started = Column(DateTime)
     models_made = Column(Integer, default=0)
     models_skipped = Column(Integer, default=0)
@@ -319,6 +320,7 @@ class TestPredictionMetadata(Base):
     tiebreaker_ordering = Column(Text)
     random_seed = Column(Integer)
     predictions_saved = Column(Boolean)
+    predictions_path = Column(Text)
 
 
 class TrainPredictionMetadata(Base):
@@ -332,6 +334,7 @@ class TrainPredictionMetadata(Base):
     tiebreaker_ordering = Column(Text)
     random_seed = Column(Integer)
     predictions_saved = Column(Boolean)
+    predictions_path = Column(Text)
 
 class IndividualImportance(Base):
 
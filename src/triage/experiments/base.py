@@ -5,6 +5,7 @@ from abc import ABC, abstractmethod
 import cProfile
 import marshal
 import random
+import tempfile
 import time
 import itertools
 
@@ -25,6 +26,7 @@ from triage.component.architect.features import (
 )
 from triage.component.architect.planner import Planner
 from triage.component.architect.builders import MatrixBuilder
+from triage.component.architect.feature_blocks import FeatureBlockCache
 from triage.component.architect.entity_date_table_generators import (
     EntityDateTableGenerator,
     CohortTableGeneratorNoOp,
@@ -56,10 +58,11 @@ from triage.component.catwalk.utils import (
     filename_friendly_hash,
 )
 from triage.component.catwalk.storage import (
-    CSVMatrixStore,
+    MATRIX_STORAGE_CLASSES,
     ModelStorageEngine,
     ProjectStorage,
     MatrixStorageEngine,
+    PredictionsStorageEngine,
 )
 
 from triage.experiments import CONFIG_VERSION
@@ -99,6 +102,9 @@ class ExperimentBase(ABC):
         config (dict)
         db_engine (triage.util.db.SerializableDbEngine or sqlalchemy.engine.Engine)
         project_path (string)
+        matrix_storage_class (class, optional) The catwalk.storage.MatrixStore subclass
+            to store matrices with. Defaults to the one named by the config's
+            matrix_format (csv if not given)
         replace (bool)
         cleanup_timeout (int)
         materialize_subquery_fromobjs (bool, default True) Whether or not to create and index
@@ -114,7 +120,7 @@ class ExperimentBase(ABC):
         config,
         db_engine,
         project_path=None,
-        matrix_storage_class=CSVMatrixStore,
+        matrix_storage_class=None,
         replace=True,
         cleanup=False,
         cleanup_timeout=None,
@@ -122,6 +128,12 @@ class ExperimentBase(ABC):
         features_ignore_cohort=False,
         profile=False,
         save_predictions=True,
+        save_predictions_to_file=False,
+        n_feature_workers=1,
+        feature_memory_budget=None,
+        cache_feature_blocks=False,
+        extend_matrices=False,
+        matrix_chunk_entities=None,
         skip_validation=False,
         partial_run=False,
     ):
@@ -140,6 +152,15 @@ class ExperimentBase(ABC):
         self.config = config
 
 
+        if matrix_storage_class is None:
+            matrix_format = self.config.get("matrix_format", "csv")
+            if matrix_format not in MATRIX_STORAGE_CLASSES:
+                raise ValueError(
+                    f"matrix_format must be one of {sorted(MATRIX_STORAGE_CLASSES)}, "
+                    f"got '{matrix_format}'"
+                )
+            matrix_storage_class = MATRIX_STORAGE_CLASSES[matrix_format]
+
         self.project_storage = ProjectStorage(project_path)
         self.model_storage_engine = ModelStorageEngine(self.project_storage)
         self.matrix_storage_engine = MatrixStorageEngine(
@@ -159,6 +180,25 @@ class ExperimentBase(ABC):
                           "table. This will decrease both the running time "
                           "of an experiment and also decrease the space needed in the db")
 
+        self.predictions_storage_engine = None
+        if self.save_predictions and save_predictions_to_file:
+            self.predictions_storage_engine = PredictionsStorageEngine(self.project_storage)
+            logger.notice(f"Save predictions to file flag is set to true. "
+                          "Predictions will be stored in files under the project path, "
+                          "and the prediction_metadata tables will point to them, "
+                          "instead of being stored in the predictions tables")
+
+        self.n_feature_workers = n_feature_workers
+        self.feature_memory_budget = feature_memory_budget
+        self.cache_feature_blocks = cache_feature_blocks
+        self.extend_matrices = extend_matrices
+        self.matrix_chunk_entities = matrix_chunk_entities
+        if self.extend_matrices:
+            logger.notice(f"Extend matrices flag is set to true. "
+                          "Train matrices that only add as-of-dates to a stored train matrix "
+                          "will reuse its rows and only extract the new as-of-dates. This "
+                          "assumes the features and labels of the stored as-of-dates haven't changed")
+
         self.skip_validation = skip_validation
         if self.skip_validation:
            logger.notice(f"Skip validation flag is set to true. "
@@ -379,6 +419,11 @@ class ExperimentBase(ABC):
             engine=self.db_engine,
             replace=self.replace,
             run_id=self.run_id,
+            n_feature_workers=self.n_feature_workers,
+            feature_memory_budget=self.feature_memory_budget,
+            extend_matrices=self.extend_matrices,
+            matrix_chunk_entities=self.matrix_chunk_entities,
+            feature_table_hashes=self.feature_generator.aggregation_hashes,
         )
 
         self.subsets = self.config.get("scoring", {}).get("subsets", [])
@@ -405,6 +450,7 @@ class ExperimentBase(ABC):
             db_engine=self.db_engine,
             model_storage_engine=self.model_storage_engine,
             save_predictions=self.save_predictions,
+            predictions_storage_engine=self.predictions_storage_engine,
             replace=self.replace,
             rank_order=self.config.get("prediction", {}).get("rank_tiebreaker", "worst"),
         )
@@ -429,7 +475,8 @@ class ExperimentBase(ABC):
             db_engine=self.db_engine,
             testing_metric_groups=self.config.get("scoring", {}).get("testing_metric_groups", []),
             training_metric_groups=self.config.get("scoring", {}).get("training_metric_groups", []),
-            bias_config=self.config.get("bias_audit_config", {})
+            bias_config=self.config.get("bias_audit_config", {}),
+            random_tiebreaking=self.config.get("scoring", {}).get("random_tiebreaking", "trials"),
         )
 
         self.model_train_tester = ModelTrainTester(
@@ -552,6 +599,7 @@ class ExperimentBase(ABC):
             feature_dates=self.all_as_of_times,
             state_table=self.cohort_table_name,
         )
+        self.feature_generator.prepare_imputed_tables(aggregations)
         with self.get_for_update() as experiment:
             experiment.feature_blocks = len(aggregations)
         return aggregations
@@ -771,7 +819,28 @@ class ExperimentBase(ABC):
         with self.get_for_update() as experiment:
             experiment.matrices_needed = len(self.matrix_build_tasks.keys())
         record_matrix_building_started(self.run_id, self.db_engine)
-        self.process_matrix_build_tasks(self.matrix_build_tasks)
+        shared_feature_blocks = (
+            self.planner.shared_feature_blocks(self.matrix_build_tasks)
+            if self.cache_feature_blocks else {}
+        )
+        # entity-date tables are shared by the matrices of this run only, and
+        # are dropped once they are built
+        try:
+            if not shared_feature_blocks:
+                self.process_matrix_build_tasks(self.matrix_build_tasks)
+            else:
+                feature_block_cache = FeatureBlockCache(
+                    tempfile.mkdtemp(prefix="triage_feature_blocks_"), shared_feature_blocks
+                )
+                logger.verbose(f"Caching feature blocks shared by matrices in {feature_block_cache.directory}")
+                self.matrix_builder.feature_block_cache = feature_block_cache
+                try:
+                    self.process_matrix_build_tasks(self.matrix_build_tasks)
+                finally:
+                    self.matrix_builder.feature_block_cache = None
+                    feature_block_cache.clear()
+        finally:
+            self.matrix_builder.drop_entity_date_tables()
         logger.success(f"Matrices were stored in {self.project_path}/matrices successfully")
 
 
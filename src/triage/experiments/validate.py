@@ -11,6 +11,12 @@ from sklearn.model_selection import ParameterGrid
 
 from triage.component import architect
 from triage.component import catwalk
+from triage.component.catwalk.storage import MATRIX_STORAGE_CLASSES
+from triage.component.collate import (
+    available_materialization_options,
+    available_query_strategies,
+    available_rollup_functions,
+)
 from triage.component.timechop import Timechop
 
 from triage.util.conf import convert_str_to_relativedelta
@@ -287,6 +293,57 @@ class FeatureAggregationsValidator(Validator):
             )
         logger.debug("Validation of groups was successful")
 
+    def _validate_query_strategy(self, aggregation_config):
+        logger.spam("Validating query strategy")
+        query_strategy = aggregation_config.get("query_strategy", "per_date")
+        if query_strategy not in available_query_strategies:
+            raise ValueError(
+                dedent(
+                    f"""
+            Section: feature_aggregations -
+            query_strategy must be one of {available_query_strategies}.
+            Passed value: {query_strategy}"""
+                )
+            )
+        logger.debug("Validation of query strategy was successful")
+
+    def _validate_rollup_intervals(self, aggregation_config):
+        if not aggregation_config.get("rollup_intervals", False):
+            return
+        logger.spam("Validating metrics for rolled up intervals")
+        for agg_type in ["aggregates", "categoricals", "array_categoricals"]:
+            for agg in aggregation_config.get(agg_type, []):
+                for metric in agg["metrics"]:
+                    if metric.lower() not in available_rollup_functions:
+                        raise ValueError(
+                            dedent(
+                                f"""
+                        Section: feature_aggregations -
+                        rollup_intervals only supports the metrics
+                        {sorted(available_rollup_functions)}.
+                        Passed metric: {metric}"""
+                            )
+                        )
+        logger.debug("Validation of metrics for rolled up intervals was successful")
+
+    def _validate_from_obj_materialization(self, aggregation_config):
+        materialization = aggregation_config.get("from_obj_materialization", {})
+        logger.spam("Validating from_obj materialization options")
+        for option in materialization:
+            if option not in available_materialization_options:
+                raise ValueError(
+                    dedent(
+                        f"""
+                Section: feature_aggregations -
+                from_obj_materialization options must be among
+                {available_materialization_options}.
+                Passed option: {option}"""
+                    )
+                )
+        if materialization.get("partition_interval"):
+            self._validate_time_intervals([materialization["partition_interval"]])
+        logger.debug("Validation of from_obj materialization options was successful")
+
     def _validate_imputation_rule(self, aggregate_type, impute_rule):
         """Validate the imputation rule for a given aggregation type."""
         logger.spam("Validating imputation rule")
@@ -383,6 +440,9 @@ class FeatureAggregationsValidator(Validator):
         self._validate_from_obj(aggregation_config["from_obj"])
         self._validate_time_intervals(aggregation_config["intervals"])
         self._validate_groups(aggregation_config["groups"])
+        self._validate_query_strategy(aggregation_config)
+        self._validate_rollup_intervals(aggregation_config)
+        self._validate_from_obj_materialization(aggregation_config)
         self._validate_imputations(aggregation_config)
         logger.debug("Validation of aggregation config was successful")
 
@@ -807,6 +867,21 @@ class PredictionConfigValidator(Validator):
         logger.spam("Validation of prediction configuration was successful")
 
 
+class MatrixFormatValidator(Validator):
+    def _run(self, matrix_format):
+        logger.spam("Validating matrix format")
+        if matrix_format not in MATRIX_STORAGE_CLASSES:
+            raise ValueError(
+                dedent(
+                    f"""
+            Section: matrix_format -
+            matrix_format must be one of {sorted(MATRIX_STORAGE_CLASSES)},
+            got '{matrix_format}'"""
+                )
+            )
+        logger.spam("Validation of matrix format was successful")
+
+
 class ScoringConfigValidator(Validator):
     def _run(self, scoring_config):
         logger.spam("Validating scoring configuration")
@@ -821,6 +896,16 @@ class ScoringConfigValidator(Validator):
                 "Section: scoring - No training_metric_groups configured. "
                 + "If training set evaluation metrics are desired, they must be added"
             )
+        random_tiebreaking = scoring_config.get("random_tiebreaking", "trials")
+        if random_tiebreaking not in catwalk.evaluation.RANDOM_TIEBREAKING_METHODS:
+            raise ValueError(
+                dedent(
+                    f"""Section: scoring -
+                random_tiebreaking '{random_tiebreaking}' is not recognized.
+                Available methods are: {catwalk.evaluation.RANDOM_TIEBREAKING_METHODS}
+                """
+                )
+            )
         metric_lookup = catwalk.evaluation.ModelEvaluator.available_metrics
         available_metrics = set(metric_lookup.keys())
         for group in ("testing_metric_groups", "training_metric_groups"):
@@ -987,6 +1072,9 @@ class ExperimentValidator(Validator):
         PredictionConfigValidator(self.db_engine, strict=self.strict).run(
             experiment_config.get("prediction", {})
         )
+        MatrixFormatValidator(strict=self.strict).run(
+            experiment_config.get("matrix_format", "csv")
+        )
         ScoringConfigValidator(strict=self.strict).run(
             experiment_config.get("scoring", {})
         )
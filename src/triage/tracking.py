@@ -249,6 +249,16 @@ def skipped_matrix(run_id, db_engine):
     increment_field('matrices_skipped', run_id, db_engine)
 
 
+def reused_matrix(run_id, db_engine):
+    """Increment the counter of matrices copied from a stored matrix with the same content
+
+    Args:
+        run_id (int) The identifier/primary key of the run
+        db_engine (sqlalchemy.engine)
+    """
+    increment_field('matrices_reused', run_id, db_engine)
+
+
 def errored_matrix(run_id, db_engine):
     """Increment the matrix error counter for the ExperimentRun
 
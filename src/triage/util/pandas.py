@@ -1,29 +1,209 @@
 from functools import partial
 import pandas as pd
 import numpy as np
+import scipy.sparse
 
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+SMALL_INTEGER_DTYPES = (np.dtype(np.uint8), np.dtype(np.int8))
+
+
+def _downcast_dtypes(df):
+    """The dtypes downcast_matrix converts each column to, None to leave one as it is"""
+    new_dtypes = []
+    integer_positions = []
+    for position, dtype in enumerate(df.dtypes):
+        if isinstance(dtype, pd.SparseDtype):
+            new_dtype = None if dtype == pd.SparseDtype(np.float32, 0) else pd.SparseDtype(np.float32, 0)
+        elif dtype == np.float32 or dtype in SMALL_INTEGER_DTYPES:
+            new_dtype = None
+        elif pd.api.types.is_bool_dtype(dtype):
+            new_dtype = np.dtype(np.uint8)
+        elif pd.api.types.is_integer_dtype(dtype):
+            integer_positions.append(position)
+            new_dtype = np.dtype(np.float32)
+        else:
+            new_dtype = np.dtype(np.float32)
+        new_dtypes.append(new_dtype)
+
+    if integer_positions and len(df):
+        # integer flags and small counts stay integers when they fit exactly
+        integers = df.iloc[:, integer_positions]
+        minimums, maximums = integers.min().to_numpy(), integers.max().to_numpy()
+        for small_dtype in reversed(SMALL_INTEGER_DTYPES):
+            limits = np.iinfo(small_dtype)
+            fits = (minimums >= limits.min) & (maximums <= limits.max)
+            for position in np.array(integer_positions)[fits]:
+                new_dtypes[position] = small_dtype
+    return new_dtypes
+
+
+def _spam_is_logged():
+    """Whether spam messages of this module reach a handler
+
+    The logger level alone doesn't tell, as the triage logging configuration
+    leaves it unset and filters messages by the level of its handlers.
+    """
+    if not logger.isEnabledFor(verboselogs.SPAM):
+        return False
+    current_logger = logger
+    while current_logger is not None:
+        if any(handler.level <= verboselogs.SPAM for handler in current_logger.handlers):
+            return True
+        if not current_logger.propagate:
+            return False
+        current_logger = current_logger.parent
+    return False
+
+
 def downcast_matrix(df):
     """Downcast the numeric values of a matrix.
 
     This will make the matrix use less memory by turning, for instance,
-    int64 columns into int32 columns.
+    float64 columns into float32 columns.
 
-    First converts floats and then integers.
+    Integer and boolean columns whose values fit in an uint8 or int8 (e.g. flags)
+    are converted to those; all other columns become float32, sparse ones staying
+    sparse. Columns already of one of these types are left as they are, and the
+    columns converted to the same type are converted together as a single block.
 
     Operates on the dataframe as passed, without doing anything to the index.
     Callers may pass an index-less dataframe if they wish to re-add the index afterwards
     and save memory on the index storage.
     """
-    logger.spam("Downcasting matrix.")
-    logger.spam(f"Starting memory usage: {df.memory_usage(deep=True).sum()} bytes")
-    logger.spam(f"Initial types: \n {df.dtypes}")
-    new_df = df.apply(lambda x: x.astype(np.float32))
+    log_spam = _spam_is_logged()
+    if log_spam:
+        logger.spam("Downcasting matrix.")
+        logger.spam(f"Starting memory usage: {df.memory_usage(deep=True).sum()} bytes")
+        logger.spam(f"Initial types: \n {df.dtypes}")
+
+    new_dtypes = _downcast_dtypes(df)
+    positions_by_dtype = {}
+    for position, dtype in enumerate(new_dtypes):
+        positions_by_dtype.setdefault(dtype, []).append(position)
 
-    logger.spam("Downcasting matrix completed.")
-    logger.spam(f"Final memory usage: {new_df.memory_usage(deep=True).sum()} bytes")
-    logger.spam(f"Final data types: \n {new_df.dtypes}")
+    if list(positions_by_dtype) == [np.dtype(np.float32)]:
+        new_df = pd.DataFrame(
+            df.to_numpy(dtype=np.float32), index=df.index, columns=df.columns
+        )
+    elif list(positions_by_dtype) in ([None], []):
+        # a shallow copy, so that callers popping columns don't change the original
+        new_df = df.copy(deep=False)
+    else:
+        # convert each group of columns, keyed by position until they are put back in order
+        blocks = []
+        for dtype, positions in positions_by_dtype.items():
+            if dtype is None:
+                block = df.iloc[:, positions]
+            elif isinstance(dtype, pd.SparseDtype):
+                block = df.iloc[:, positions].astype(dtype)
+            else:
+                block = pd.DataFrame(
+                    df.iloc[:, positions].to_numpy(dtype=dtype), index=df.index
+                )
+            block.columns = positions
+            blocks.append(block)
+        new_df = pd.concat(blocks, axis=1)[list(range(len(new_dtypes)))]
+        new_df.columns = df.columns
+
+    if log_spam:
+        logger.spam("Downcasting matrix completed.")
+        logger.spam(f"Final memory usage: {new_df.memory_usage(deep=True).sum()} bytes")
+        logger.spam(f"Final data types: \n {new_df.dtypes}")
 
     return new_df
+
+
+def has_sparse_columns(df):
+    """Whether any column of the dataframe is stored as a pandas SparseArray"""
+    return any(isinstance(dtype, pd.SparseDtype) for dtype in df.dtypes)
+
+
+def densify_matrix(df):
+    """Convert the sparse columns of a matrix (if any) to dense float32 columns"""
+    if not has_sparse_columns(df):
+        return df
+    return pd.DataFrame(
+        {
+            column: (
+                values.sparse.to_dense().astype(np.float32)
+                if isinstance(values.dtype, pd.SparseDtype)
+                else values
+            )
+            for column, values in df.items()
+        },
+        index=df.index,
+        columns=df.columns,
+    )
+
+
+def to_csr(df):
+    """Convert a matrix, whether its columns are sparse or dense, to a float32 CSR matrix
+
+    Zeros of dense columns and the fill value of sparse columns (which must be 0)
+    are left out, so the result holds only the non-zero values. The index is dropped.
+    """
+    rows, columns, values = [], [], []
+    for column_number, (column, column_values) in enumerate(df.items()):
+        if isinstance(column_values.dtype, pd.SparseDtype):
+            array = column_values.array
+            if array.fill_value != 0:
+                raise ValueError(f"Sparse column {column} has a non-zero fill value")
+            column_rows = array.sp_index.to_int_index().indices
+            column_data = array.sp_values
+        else:
+            column_data = column_values.to_numpy()
+            column_rows = np.flatnonzero(column_data)
+            column_data = column_data[column_rows]
+        rows.append(column_rows)
+        columns.append(np.full(len(column_rows), column_number, dtype=np.int32))
+        values.append(column_data.astype(np.float32, copy=False))
+
+    return scipy.sparse.coo_matrix(
+        (
+            np.concatenate(values) if values else np.empty(0, dtype=np.float32),
+            (
+                np.concatenate(rows) if rows else np.empty(0, dtype=np.int32),
+                np.concatenate(columns) if columns else np.empty(0, dtype=np.int32),
+            ),
+        ),
+        shape=df.shape,
+        dtype=np.float32,
+    ).tocsr()
+
+
+def from_csr(csr, index, columns, sparse_columns):
+    """Build a matrix from a CSR matrix, keeping some of its columns sparse
+
+    Args:
+        csr (scipy.sparse.csr_matrix) The values of the matrix
+        index (pandas.Index) The row index of the matrix
+        columns (list) The column names
+        sparse_columns (numpy.ndarray) A boolean mask of the columns to keep
+            as pandas SparseArrays (with a fill value of 0); the others are dense float32
+
+    Returns: (pandas.DataFrame)
+    """
+    if not len(columns):
+        return pd.DataFrame(index=index)
+    csc = csr.tocsc()
+    sparse_columns = np.asarray(sparse_columns, dtype=bool)
+    column_names = np.array(columns, dtype=object)
+    parts = []
+    if sparse_columns.any():
+        parts.append(pd.DataFrame.sparse.from_spmatrix(
+            csc[:, np.flatnonzero(sparse_columns)],
+            index=index,
+            columns=column_names[sparse_columns].tolist(),
+        ))
+    if not sparse_columns.all():
+        parts.append(pd.DataFrame(
+            csc[:, np.flatnonzero(~sparse_columns)].toarray().astype(np.float32, copy=False),
+            index=index,
+            columns=column_names[~sparse_columns].tolist(),
+        ))
+    df = pd.concat(parts, axis=1) if len(parts) > 1 else parts[0]
+    if df.columns.tolist() != list(columns):
+        df = df[list(columns)]
+    return df